@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# the vertigo pipeline of basic-tutorial-2-ex-vertigo.py at full HD, where it
+# is CPU-bound: the optimizer measures the cost of every element, inserts
+# queues between the expensive ones so they run in their own threads and
+# lets videoconvert use several threads, and reports the throughput before
+# and after. the optimized pipeline is then played.
+#
+# usage: basic-tutorial-2-ex-optimize.py [--seconds S] [--no-play]
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+2%3A+GStreamer+concepts
+
+import os
+import sys
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from optimize import Chain, apply, optimize, print_report
+
+CHAIN = ("videotestsrc name=source pattern=0 ! "
+         "video/x-raw,width=1920,height=1080 ! "
+         "vertigotv name=vertigo-filter ! videoconvert name=video-convert ! ")
+
+# initialize GStreamer
+Gst.init(None)
+
+seconds = 5.0
+if "--seconds" in sys.argv:
+    seconds = float(sys.argv[sys.argv.index("--seconds") + 1])
+
+# measure without synchronizing to the clock, to see how fast it can go
+result = optimize(CHAIN + "fakesink sync=false", seconds)
+print_report(result)
+
+if "--no-play" in sys.argv:
+    sys.exit(0)
+
+# build the same chain for display and apply the same changes
+chain = Chain(CHAIN + "autovideosink name=sink")
+apply(chain, result["cuts"], os.cpu_count() or 1)
+pipeline = chain.pipeline
+
+# start playing
+ret = pipeline.set_state(Gst.State.PLAYING)
+if ret == Gst.StateChangeReturn.FAILURE:
+    print("ERROR: Unable to set the pipeline to the playing state")
+
+# wait for EOS or error
+bus = pipeline.get_bus()
+msg = bus.timed_pop_filtered(
+    Gst.CLOCK_TIME_NONE,
+    Gst.MessageType.ERROR | Gst.MessageType.EOS
+)
+
+if msg:
+    t = msg.type
+    if t == Gst.MessageType.ERROR:
+        err, dbg = msg.parse_error()
+        print("ERROR:", msg.src.get_name(), ":", err.message)
+        if dbg:
+            print("debugging info:", dbg)
+    elif t == Gst.MessageType.EOS:
+        print("End-Of-Stream reached")
+
+pipeline.set_state(Gst.State.NULL)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from eventlog import EventLog
+from helper import connect, get_rss
+
+# basic tutorial 3 builds a new pipeline for every run. this player builds its
+# elements once and plays any number of URIs with them: between jobs the
+# pipeline goes back to READY, where uridecodebin drops its pads, and the
+# new source pads are linked again from "pad-added".
+#
+# usage: basic-tutorial-3-ex-reuse.py URI [URI...]
+#        basic-tutorial-3-ex-reuse.py --bench JOBS URI
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+3%3A+Dynamic+pipelines
+
+
+class Player(object):
+
+    def __init__(self, audio_sink="autoaudiosink", video_sink="autovideosink",
+                 log=None):
+        # initialize GStreamer
+        Gst.init(None)
+
+        self.log = log or EventLog()
+        # uridecodebin pads we linked, so they can be unlinked between jobs
+        self.linked_pads = []
+
+        # create the elements. this happens exactly once per player
+        self.source = Gst.ElementFactory.make("uridecodebin", "source")
+        self.audio_convert = Gst.ElementFactory.make(
+            "audioconvert", "audioconvert")
+        self.audio_sink = Gst.ElementFactory.make(audio_sink, "audiosink")
+        self.video_convert = Gst.ElementFactory.make(
+            "videoconvert", "videoconvert")
+        self.video_sink = Gst.ElementFactory.make(video_sink, "videosink")
+
+        # create empty pipeline
+        self.pipeline = Gst.Pipeline.new("test-pipeline")
+
+        if (not self.pipeline or not self.source or not self.audio_convert
+                or not self.audio_sink or not self.video_convert or not self.video_sink):
+            print("ERROR: Could not create all elements")
+            sys.exit(1)
+
+        # build the pipeline. we are NOT linking the source at this point.
+        # will do it for every job
+        self.pipeline.add(self.source, self.audio_convert, self.audio_sink,
+                          self.video_convert, self.video_sink)
+        if not self.audio_convert.link(self.audio_sink):
+            print("ERROR: Could not link 'audioconvert' to 'audiosink'")
+            sys.exit(1)
+
+        if not self.video_convert.link(self.video_sink):
+            print("ERROR: Could not link 'videoconvert' to 'videosink'")
+            sys.exit(1)
+
+        # connect to the pad signals once, they stay connected for all jobs
+        connect(self.source, "pad-added", self.on_pad_added)
+        connect(self.source, "pad-removed", self.on_pad_removed)
+
+    # bring the pipeline back to READY and make sure no pad of the previous
+    # job is still linked to our converters
+    def reset(self):
+        self.pipeline.set_state(Gst.State.READY)
+
+        # uridecodebin removes its pads when going to READY and "pad-removed"
+        # unlinks them, but be defensive about pads that were not removed
+        for src_pad, sink_pad in self.linked_pads:
+            if src_pad.is_linked():
+                src_pad.unlink(sink_pad)
+        self.linked_pads = []
+
+        # drop whatever the previous job left on the bus
+        bus = self.pipeline.get_bus()
+        while bus.pop():
+            pass
+
+    # play a URI to the end. returns True if it played without error
+    def run(self, uri):
+        self.reset()
+        self.source.set_property("uri", uri)
+
+        ret = self.pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            self.log.error(self.pipeline.get_name(),
+                           "Unable to set the pipeline to the playing state")
+            self.reset()
+            return False
+
+        # listen to the bus
+        bus = self.pipeline.get_bus()
+        ok = True
+        while True:
+            msg = bus.timed_pop_filtered(
+                Gst.CLOCK_TIME_NONE,
+                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+
+            if not msg:
+                continue
+
+            if msg.type == Gst.MessageType.ERROR:
+                err, dbg = msg.parse_error()
+                self.log.error(msg.src.get_name(), "{0} ({1})".format(
+                    err.message, dbg or "no debugging info"))
+                ok = False
+            else:
+                self.log.event("eos", msg.src.get_name(),
+                               "End-Of-Stream reached")
+            break
+
+        self.reset()
+        return ok
+
+    # release all resources, the player cannot be used afterwards
+    def close(self):
+        self.pipeline.set_state(Gst.State.NULL)
+        self.linked_pads = []
+
+    # handler for the pad-added signal
+    def on_pad_added(self, src, new_pad):
+        # check the new pad's type
+        new_pad_caps = new_pad.get_current_caps()
+        new_pad_type = new_pad_caps.get_structure(0).get_name()
+
+        if new_pad_type.startswith("audio/x-raw"):
+            sink_pad = self.audio_convert.get_static_pad("sink")
+        elif new_pad_type.startswith("video/x-raw"):
+            sink_pad = self.video_convert.get_static_pad("sink")
+        else:
+            self.log.event(
+                "pad-added", src.get_name(),
+                "It has type '{0:s}' which is not raw audio/video. Ignoring.".format(
+                    new_pad_type))
+            return
+
+        # if our converter is already linked, we have nothing to do here
+        if sink_pad.is_linked():
+            self.log.event("pad-added", src.get_name(),
+                           "We are already linked. Ignoring.")
+            return
+
+        # attempt the link
+        ret = new_pad.link(sink_pad)
+        if not ret == Gst.PadLinkReturn.OK:
+            self.log.error(src.get_name(), "Type is '{0:s}' but link failed".format(
+                new_pad_type))
+        else:
+            self.linked_pads.append((new_pad, sink_pad))
+            self.log.event("pad-added", src.get_name(),
+                           "Link succeeded (type '{0:s}')".format(new_pad_type))
+
+    # handler for the pad-removed signal
+    def on_pad_removed(self, src, pad):
+        for src_pad, sink_pad in list(self.linked_pads):
+            if src_pad == pad:
+                if src_pad.is_linked():
+                    src_pad.unlink(sink_pad)
+                self.linked_pads.remove((src_pad, sink_pad))
+                self.log.event("pad-removed", src.get_name(),
+                               "Unlinked pad '{0:s}'".format(pad.get_name()))
+
+
+# runs the same URI jobs times, either reusing one player or building a new
+# one per job. returns (jobs per second, RSS growth in bytes)
+def soak(uri, jobs, reuse):
+    log = EventLog(output=os.devnull)
+    sinks = {"audio_sink": "fakesink", "video_sink": "fakesink", "log": log}
+
+    # one warm-up job so one-time allocations (plugin loading, caches) do
+    # not count as growth
+    player = Player(**sinks)
+    player.run(uri)
+    if not reuse:
+        player.close()
+        player = None
+
+    rss_start = get_rss()
+    start = time.monotonic()
+    for i in range(jobs):
+        if not reuse:
+            player = Player(**sinks)
+        player.run(uri)
+        if not reuse:
+            player.close()
+            player = None
+    elapsed = time.monotonic() - start
+    rss_growth = get_rss() - rss_start
+
+    if player:
+        player.close()
+
+    return jobs / elapsed, rss_growth
+
+
+def bench(uri, jobs):
+    results = {}
+    for name, reuse in (("rebuild", False), ("reuse", True)):
+        results[name] = soak(uri, jobs, reuse)
+        print("{0:8s} {1:8.2f} jobs/s  RSS growth {2:+.1f} MiB over {3} jobs".format(
+            name, results[name][0], results[name][1] / 1048576.0, jobs))
+
+    print("reuse is {0:.2f}x the throughput of rebuild-per-job".format(
+        results["reuse"][0] / results["rebuild"][0]))
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == "--bench":
+        # fakesinks do not sync to the clock, so the media plays as fast
+        # as it can be decoded
+        Gst.init(None)
+        bench(sys.argv[3], int(sys.argv[2]))
+    elif len(sys.argv) >= 2:
+        p = Player()
+        p.log.start()
+        for uri in sys.argv[1:]:
+            p.run(uri)
+        p.close()
+        p.log.stop()
+    else:
+        print("usage: {0} URI [URI...] | --bench JOBS URI".format(sys.argv[0]))
+        sys.exit(1)
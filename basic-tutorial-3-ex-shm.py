@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from helper import connect
+
+# decode once, consume many times: the producer runs the video branch of basic
+# tutorial 3 and publishes every decoded raw frame into a ring of slots in
+# shared memory. any number of consumer processes attach to the ring by name,
+# read the caps from its header and push the frames, with their original
+# timestamps, into their own pipeline through an appsrc.
+#
+# the producer never waits for anybody: when a consumer falls behind, the
+# slots it has not read yet are overwritten and the consumer counts them as
+# dropped. consumers can attach and detach at any time. each consumer keeps
+# its counters in the ring header, so the producer can report them.
+#
+# shmsink/shmsrc was the first candidate, but it carries neither caps nor
+# timestamps, and with gdppay on top a consumer attaching late never gets
+# the caps packet.
+#
+# usage: basic-tutorial-3-ex-shm.py produce URI [NAME]
+#        basic-tutorial-3-ex-shm.py consume [NAME] [--fake]
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+3%3A+Dynamic+pipelines
+
+DEFAULT_NAME = "gst-tutorial-frames"
+
+MAGIC = b"GSTF"
+SLOTS = 8
+MAX_CONSUMERS = 16
+CAPS_SIZE = 4096
+
+# magic, slots, slot size, head sequence number, caps version, caps length.
+# the caps version is odd while the producer rewrites the caps
+HEADER = struct.Struct("=4sIQQII")
+# pid, delivered, dropped, heartbeat (time.time())
+CONSUMER = struct.Struct("=QQQd")
+# sequence number (0 while being written), pts, duration, size
+SLOT = struct.Struct("=QQQQ")
+
+CONSUMERS_OFFSET = HEADER.size + CAPS_SIZE
+SLOTS_OFFSET = CONSUMERS_OFFSET + MAX_CONSUMERS * CONSUMER.size
+
+# a consumer that has not updated its heartbeat for this long is gone
+CONSUMER_TIMEOUT = 5.0
+
+# how often a consumer started before the producer looks for the ring
+ATTACH_INTERVAL = 0.1
+
+
+class FrameRing(object):
+
+    def __init__(self, shm, slot_size, slots):
+        self.shm = shm
+        self.buf = shm.buf
+        self.slot_size = slot_size
+        self.slots = slots
+
+    @classmethod
+    def create(cls, name, slot_size, slots=SLOTS):
+        size = SLOTS_OFFSET + slots * (SLOT.size + slot_size)
+        try:
+            # remove the ring of a producer that did not exit cleanly
+            shared_memory.SharedMemory(name).unlink()
+        except FileNotFoundError:
+            pass
+
+        shm = shared_memory.SharedMemory(name, create=True, size=size)
+        shm.buf[:SLOTS_OFFSET] = bytes(SLOTS_OFFSET)
+        HEADER.pack_into(shm.buf, 0, MAGIC, slots, slot_size, 0, 0, 0)
+        return cls(shm, slot_size, slots)
+
+    @classmethod
+    def attach(cls, name):
+        shm = shared_memory.SharedMemory(name)
+        # the segment belongs to the producer. without this, python's
+        # resource tracker would remove it when this consumer exits. the
+        # tracker knows it by its POSIX name, with the leading slash
+        resource_tracker.unregister("/" + shm.name, "shared_memory")
+        magic, slots, slot_size, head, version, length = HEADER.unpack_from(
+            shm.buf, 0)
+        if magic != MAGIC:
+            shm.close()
+            raise ValueError("{0} is not a frame ring".format(name))
+        return cls(shm, slot_size, slots)
+
+    # attaches to the ring once the producer has created it and published
+    # the caps of the first frame
+    @classmethod
+    def wait(cls, name):
+        ring = None
+        waiting = False
+        while True:
+            if ring is None:
+                try:
+                    ring = cls.attach(name)
+                except (FileNotFoundError, ValueError):
+                    # not created yet, or its header is not written yet
+                    pass
+            if ring is not None and ring.caps()[0] > 0:
+                return ring
+
+            if not waiting:
+                print("Waiting for the producer of '{0}'".format(name))
+                waiting = True
+            time.sleep(ATTACH_INTERVAL)
+
+    def header(self):
+        return HEADER.unpack_from(self.buf, 0)
+
+    def head(self):
+        return self.header()[3]
+
+    # producer side. readers retry while the version is odd, or when it
+    # changed while they copied the caps
+    def set_caps(self, caps):
+        data = caps.encode()[:CAPS_SIZE]
+        magic, slots, slot_size, head, version, length = self.header()
+        HEADER.pack_into(self.buf, 0, magic, slots, slot_size, head,
+                         version + 1, length)
+        self.buf[HEADER.size:HEADER.size + len(data)] = data
+        HEADER.pack_into(self.buf, 0, magic, slots, slot_size, head,
+                         version + 2, len(data))
+
+    # returns (caps version, caps string), version 0 before the first caps
+    def caps(self):
+        while True:
+            version, length = self.header()[4:6]
+            if version % 2:
+                time.sleep(0.001)
+                continue
+            data = bytes(self.buf[HEADER.size:HEADER.size + length])
+            if self.header()[4] == version:
+                return version, data.decode()
+
+    def slot_offset(self, seq):
+        return SLOTS_OFFSET + (seq % self.slots) * (SLOT.size + self.slot_size)
+
+    # producer side: store a frame in the slot of the next sequence number
+    def write(self, pts, duration, data):
+        magic, slots, slot_size, head, version, length = self.header()
+        seq = head + 1
+        offset = self.slot_offset(seq)
+
+        # readers seeing sequence number 0 know the slot is being rewritten
+        SLOT.pack_into(self.buf, offset, 0, pts, duration, len(data))
+        start = offset + SLOT.size
+        self.buf[start:start + len(data)] = data
+        SLOT.pack_into(self.buf, offset, seq, pts, duration, len(data))
+
+        HEADER.pack_into(self.buf, 0, magic, slots, slot_size, seq, version,
+                         length)
+        return seq
+
+    # consumer side: returns (pts, duration, bytes) of frame seq, or None if
+    # it was overwritten before or while we copied it
+    def read(self, seq):
+        offset = self.slot_offset(seq)
+        stamp, pts, duration, size = SLOT.unpack_from(self.buf, offset)
+        if stamp != seq:
+            return None
+
+        start = offset + SLOT.size
+        data = bytes(self.buf[start:start + size])
+        if SLOT.unpack_from(self.buf, offset)[0] != seq:
+            return None
+        return pts, duration, data
+
+    def consumer_offset(self, index):
+        return CONSUMERS_OFFSET + index * CONSUMER.size
+
+    # claims a free entry of the consumer table, returns its index. the
+    # consumers starting at the same time take turns through a lock file
+    def register(self, pid):
+        path = os.path.join(tempfile.gettempdir(), self.shm.name + ".lock")
+        with open(path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            now = time.time()
+            for i in range(MAX_CONSUMERS):
+                other, delivered, dropped, heartbeat = CONSUMER.unpack_from(
+                    self.buf, self.consumer_offset(i))
+                if other == 0 or now - heartbeat > CONSUMER_TIMEOUT:
+                    CONSUMER.pack_into(self.buf, self.consumer_offset(i),
+                                       pid, 0, 0, now)
+                    return i
+        raise RuntimeError("too many consumers attached")
+
+    def update_consumer(self, index, pid, delivered, dropped):
+        CONSUMER.pack_into(self.buf, self.consumer_offset(index),
+                           pid, delivered, dropped, time.time())
+
+    def consumers(self):
+        now = time.time()
+        result = []
+        for i in range(MAX_CONSUMERS):
+            pid, delivered, dropped, heartbeat = CONSUMER.unpack_from(
+                self.buf, self.consumer_offset(i))
+            if pid and now - heartbeat <= CONSUMER_TIMEOUT:
+                result.append((pid, delivered, dropped))
+        return result
+
+    def close(self, unlink=False):
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class Producer(object):
+
+    def __init__(self, uri, name):
+        self.name = name
+        self.ring = None
+        self.caps = None
+        self.published = 0
+
+        # create the elements
+        self.source = Gst.ElementFactory.make("uridecodebin", "source")
+        self.video_convert = Gst.ElementFactory.make(
+            "videoconvert", "videoconvert")
+        self.video_sink = Gst.ElementFactory.make("appsink", "videosink")
+        self.audio_sink = Gst.ElementFactory.make("fakesink", "audiosink")
+
+        # create empty pipeline
+        self.pipeline = Gst.Pipeline.new("producer-pipeline")
+
+        if (not self.pipeline or not self.source or not self.video_convert
+                or not self.video_sink or not self.audio_sink):
+            print("ERROR: Could not create all elements")
+            sys.exit(1)
+
+        self.pipeline.add(self.source, self.video_convert, self.video_sink,
+                          self.audio_sink)
+        if not self.video_convert.link(self.video_sink):
+            print("ERROR: Could not link 'videoconvert' to 'videosink'")
+            sys.exit(1)
+
+        # play in real time, and never let the decoder wait for us
+        self.video_sink.set_property("emit-signals", True)
+        self.video_sink.set_property("max-buffers", 1)
+        self.video_sink.set_property("drop", True)
+        self.video_sink.set_property("sync", True)
+        self.audio_sink.set_property("sync", True)
+        connect(self.video_sink, "new-sample", self.on_new_sample)
+
+        self.source.set_property("uri", uri)
+        connect(self.source, "pad-added", self.on_pad_added)
+
+    # handler for the pad-added signal
+    def on_pad_added(self, src, new_pad):
+        new_pad_type = new_pad.get_current_caps().get_structure(0).get_name()
+        if new_pad_type.startswith("video/x-raw"):
+            sink_pad = self.video_convert.get_static_pad("sink")
+        elif new_pad_type.startswith("audio/x-raw"):
+            sink_pad = self.audio_sink.get_static_pad("sink")
+        else:
+            return
+
+        if not sink_pad.is_linked():
+            new_pad.link(sink_pad)
+
+    # called from the streaming thread for every decoded frame
+    def on_new_sample(self, sink):
+        sample = sink.emit("pull-sample")
+        buf = sample.get_buffer()
+        ok, info = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return Gst.FlowReturn.ERROR
+
+        try:
+            if self.ring is None:
+                # size the slots for the first frame, raw video does not
+                # change size without a caps change
+                slot_size = (info.size + mmap.PAGESIZE) // mmap.PAGESIZE * mmap.PAGESIZE
+                self.ring = FrameRing.create(self.name, slot_size)
+                print("Publishing frames of {0} bytes as '{1}'".format(
+                    info.size, self.name))
+
+            caps = sample.get_caps().to_string()
+            if caps != self.caps:
+                self.caps = caps
+                self.ring.set_caps(caps)
+
+            if info.size > self.ring.slot_size:
+                print("ERROR: frame of {0} bytes does not fit the ring".format(
+                    info.size))
+                return Gst.FlowReturn.ERROR
+
+            self.ring.write(buf.pts, buf.duration, info.data)
+            self.published += 1
+        finally:
+            buf.unmap(info)
+
+        return Gst.FlowReturn.OK
+
+    def print_stats(self):
+        print("Published {0} frames".format(self.published))
+        if self.ring:
+            for pid, delivered, dropped in self.ring.consumers():
+                print("  consumer {0}: {1} delivered, {2} dropped".format(
+                    pid, delivered, dropped))
+        return True
+
+    def run(self):
+        ret = self.pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            print("ERROR: Unable to set the pipeline to the playing state")
+            sys.exit(1)
+
+        bus = self.pipeline.get_bus()
+        last_stats = time.monotonic()
+        try:
+            while True:
+                msg = bus.timed_pop_filtered(
+                    500 * Gst.MSECOND,
+                    Gst.MessageType.ERROR | Gst.MessageType.EOS)
+                if msg:
+                    if msg.type == Gst.MessageType.ERROR:
+                        err, dbg = msg.parse_error()
+                        print("ERROR:", msg.src.get_name(), ":", err.message)
+                    else:
+                        print("End-Of-Stream reached")
+                    break
+
+                if time.monotonic() - last_stats > 5:
+                    self.print_stats()
+                    last_stats = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+
+        self.pipeline.set_state(Gst.State.NULL)
+        self.print_stats()
+        if self.ring:
+            self.ring.close(unlink=True)
+
+
+class Consumer(object):
+
+    def __init__(self, name, fake=False):
+        self.ring = FrameRing.wait(name)
+        self.index = self.ring.register(os.getpid())
+        self.delivered = 0
+        self.dropped = 0
+        self.running = False
+        self.offset_set = False
+
+        self.source = Gst.ElementFactory.make("appsrc", "source")
+        self.convert = Gst.ElementFactory.make("videoconvert", "convert")
+        self.sink = Gst.ElementFactory.make(
+            "fakesink" if fake else "autovideosink", "sink")
+        self.pipeline = Gst.Pipeline.new("consumer-pipeline")
+
+        if not self.pipeline or not self.source or not self.convert or not self.sink:
+            print("ERROR: Could not create all elements")
+            sys.exit(1)
+
+        self.pipeline.add(self.source, self.convert, self.sink)
+        if not self.source.link(self.convert) or not self.convert.link(self.sink):
+            print("ERROR: Could not link the elements")
+            sys.exit(1)
+
+        self.caps_version, caps = self.ring.caps()
+        self.source.set_property("caps", Gst.Caps.from_string(caps))
+        self.source.set_property("format", Gst.Format.TIME)
+        self.source.set_property("is-live", True)
+        # keep at most a couple of frames queued, we drop the rest ourselves
+        self.source.set_property("max-buffers", 2)
+        self.source.set_property("block", False)
+
+    # reads frames from the ring and pushes them into the pipeline
+    def pump(self):
+        seq = self.ring.head() + 1
+        while self.running:
+            head = self.ring.head()
+            if head < seq:
+                time.sleep(0.002)
+                continue
+
+            # everything older than the ring is gone
+            if head - seq >= self.ring.slots:
+                self.dropped += head - seq - self.ring.slots + 1
+                seq = head - self.ring.slots + 1
+
+            version, caps = self.ring.caps()
+            if version != self.caps_version:
+                self.caps_version = version
+                self.source.set_property("caps", Gst.Caps.from_string(caps))
+
+            frame = self.ring.read(seq)
+            seq += 1
+            if frame is None or self.source.get_property("current-level-buffers") >= 2:
+                self.dropped += 1
+            else:
+                pts, duration, data = frame
+                if not self.offset_set:
+                    # our running time starts at 0, shift the producer's
+                    # timestamps onto it without rewriting them
+                    self.source.get_static_pad("src").set_offset(-pts)
+                    self.offset_set = True
+
+                buf = Gst.Buffer.new_wrapped(data)
+                buf.pts = pts
+                buf.duration = duration
+                self.source.emit("push-buffer", buf)
+                self.delivered += 1
+
+            self.ring.update_consumer(self.index, os.getpid(), self.delivered,
+                                      self.dropped)
+
+    def run(self):
+        ret = self.pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            print("ERROR: Unable to set the pipeline to the playing state")
+            sys.exit(1)
+
+        self.running = True
+        thread = threading.Thread(target=self.pump, daemon=True)
+        thread.start()
+
+        bus = self.pipeline.get_bus()
+        try:
+            while True:
+                msg = bus.timed_pop_filtered(
+                    500 * Gst.MSECOND,
+                    Gst.MessageType.ERROR | Gst.MessageType.EOS)
+                if msg:
+                    if msg.type == Gst.MessageType.ERROR:
+                        err, dbg = msg.parse_error()
+                        print("ERROR:", msg.src.get_name(), ":", err.message)
+                    break
+        except KeyboardInterrupt:
+            pass
+
+        self.running = False
+        thread.join()
+        self.pipeline.set_state(Gst.State.NULL)
+
+        # give our entry of the consumer table back
+        self.ring.update_consumer(self.index, 0, 0, 0)
+        self.ring.close()
+        print("{0} frames delivered, {1} dropped".format(
+            self.delivered, self.dropped))
+
+if __name__ == '__main__':
+    Gst.init(None)
+
+    args = [a for a in sys.argv[1:] if a != "--fake"]
+    if len(args) >= 2 and args[0] == "produce":
+        Producer(args[1], args[2] if len(args) > 2 else DEFAULT_NAME).run()
+    elif len(args) >= 1 and args[0] == "consume":
+        name = args[1] if len(args) > 1 else DEFAULT_NAME
+        try:
+            consumer = Consumer(name, fake="--fake" in sys.argv)
+        except KeyboardInterrupt:
+            sys.exit(1)
+        consumer.run()
+    else:
+        print("usage: {0} produce URI [NAME] | consume [NAME] [--fake]".format(
+            sys.argv[0]))
+        sys.exit(1)
@@ -5,6 +5,9 @@ import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst
 
+from eventlog import EventLog
+from helper import connect
+
 # http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+3%3A+Dynamic+pipelines
 
 
@@ -14,6 +17,11 @@ class Player(object):
         # initialize GStreamer
         Gst.init(None)
 
+        # the callbacks and the bus loop report through the event log, so
+        # they never block on stdout
+        self.log = EventLog()
+        self.log.start()
+
         # create the elements
         self.source = Gst.ElementFactory.make("uridecodebin", "source")
         self.audio_convert = Gst.ElementFactory.make(
@@ -48,7 +56,7 @@ class Player(object):
             "uri", "http://docs.gstreamer.com/media/sintel_trailer-480p.webm")
 
         # connect to the pad-added signal
-        self.source.connect("pad-added", self.on_pad_added)
+        connect(self.source, "pad-added", self.on_pad_added)
 
         # start playing
         ret = self.pipeline.set_state(Gst.State.PLAYING)
@@ -70,37 +78,40 @@ class Player(object):
             t = msg.type
             if t == Gst.MessageType.ERROR:
                 err, dbg = msg.parse_error()
-                print("ERROR:", msg.src.get_name(), " ", err.message)
-                if dbg:
-                    print("debugging info:", dbg)
+                self.log.error(msg.src.get_name(), "{0} ({1})".format(
+                    err.message, dbg or "no debugging info"))
                 terminate = True
             elif t == Gst.MessageType.EOS:
-                print("End-Of-Stream reached")
+                self.log.event("eos", msg.src.get_name(),
+                               "End-Of-Stream reached")
                 terminate = True
             elif t == Gst.MessageType.STATE_CHANGED:
                 # we are only interested in STATE_CHANGED messages from
                 # the pipeline
                 if msg.src == self.pipeline:
                     old_state, new_state, pending_state = msg.parse_state_changed()
-                    print("Pipeline state changed from {0:s} to {1:s}".format(
-                        Gst.Element.state_get_name(old_state),
-                        Gst.Element.state_get_name(new_state)))
+                    self.log.event(
+                        "state-changed", msg.src.get_name(),
+                        "Pipeline state changed from {0:s} to {1:s}".format(
+                            Gst.Element.state_get_name(old_state),
+                            Gst.Element.state_get_name(new_state)))
             else:
                 # should not get here
-                print("ERROR: Unexpected message received")
+                self.log.error(msg.src.get_name(),
+                               "Unexpected message received")
                 break
 
             if terminate:
                 break
 
         self.pipeline.set_state(Gst.State.NULL)
+        self.log.stop()
 
     # handler for the pad-added signal
     def on_pad_added(self, src, new_pad):
-        print(
-            "Received new pad '{0:s}' from '{1:s}'".format(
-                new_pad.get_name(),
-                src.get_name()))
+        self.log.event(
+            "pad-added", src.get_name(),
+            "Received new pad '{0:s}'".format(new_pad.get_name()))
 
         # check the new pad's type
         new_pad_caps = new_pad.get_current_caps()
@@ -112,21 +123,26 @@ class Player(object):
         elif new_pad_type.startswith("video/x-raw"):
             sink_pad = self.video_convert.get_static_pad("sink")
         else:
-            print(
-                "It has type '{0:s}' which is not raw audio/video. Ignoring.".format(new_pad_type))
+            self.log.event(
+                "pad-added", src.get_name(),
+                "It has type '{0:s}' which is not raw audio/video. Ignoring.".format(
+                    new_pad_type))
             return
 
         # if our converter is already linked, we have nothing to do here
         if(sink_pad.is_linked()):
-            print("We are already linked. Ignoring.")
+            self.log.event("pad-added", src.get_name(),
+                           "We are already linked. Ignoring.")
             return
 
         # attempt the link
         ret = new_pad.link(sink_pad)
         if not ret == Gst.PadLinkReturn.OK:
-            print("Type is '{0:s}}' but link failed".format(new_pad_type))
+            self.log.error(src.get_name(), "Type is '{0:s}' but link failed".format(
+                new_pad_type))
         else:
-            print("Link succeeded (type '{0:s}')".format(new_pad_type))
+            self.log.event("pad-added", src.get_name(),
+                           "Link succeeded (type '{0:s}')".format(new_pad_type))
 
         return
 
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+import sys
+import threading
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from helper import add_probe, connect
+
+# extracts clips from a file with segment seeks: every (start, stop) range is
+# a flushing seek with the SEGMENT flag and a stop position, so the demuxer
+# only reads the data of that range and posts SEGMENT_DONE at its end, instead
+# of playing to EOS. all ranges are processed with one pipeline: only the
+# muxer and filesink are replaced between clips.
+#
+# by default the streams are copied without decoding. the demuxer starts
+# reading at the keyframe before the requested start, and everything before
+# the start is dropped on the way to the muxer: audio is cut at the first
+# audio frame reaching into the range, video at the first keyframe at or after
+# the start, because the frames in between cannot be decoded without the
+# keyframe before them. the video of a copied clip can thus start up to one
+# keyframe interval late (re-encoding only that first group of pictures is
+# not done). with --reencode the streams are decoded and the clips are cut
+# exactly.
+#
+# usage: basic-tutorial-4-ex-clips.py [--reencode] [--output TEMPLATE] URI
+#                                     START-STOP [START-STOP...]
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+4%3A+Time+management
+
+# streams uridecodebin hands out without decoding them
+COPY_CAPS = ("video/x-h264; video/x-h265; video/x-vp8; video/x-vp9; "
+             "video/x-av1; video/mpeg; audio/mpeg; audio/x-vorbis; "
+             "audio/x-opus; audio/x-flac; audio/x-ac3; "
+             "video/x-raw; audio/x-raw")
+
+# parsers that convert the copied streams to what the muxer wants
+PARSERS = {
+    "video/x-h264": "h264parse",
+    "video/x-h265": "h265parse",
+    "video/x-av1": "av1parse",
+}
+
+# encoders for raw streams
+ENCODERS = {
+    "video/x-raw": "videoconvert ! x264enc speed-preset=veryfast ! h264parse",
+    "audio/x-raw": "audioconvert ! audioresample ! opusenc",
+}
+
+# what the probe on a stream does with its buffers
+WAITING = "waiting"     # drop everything until the segment of our seek
+TRIMMING = "trimming"   # drop what comes before the start of the range
+PASSING = "passing"     # let everything through
+
+
+# a muxer writing to one file, with one ghost sink pad per stream
+class ClipBin(object):
+
+    def __init__(self, index, location):
+        self.location = location
+        self.bin = Gst.Bin.new("clip{0}".format(index))
+        self.muxer = Gst.ElementFactory.make("matroskamux", None)
+        self.sink = Gst.ElementFactory.make("filesink", None)
+        if not self.muxer or not self.sink:
+            print("ERROR: Could not create the muxer and filesink")
+            sys.exit(1)
+
+        # the clip is written as fast as it can be read, and it must not
+        # prevent the pipeline from reaching PLAYING before we seek
+        self.sink.set_property("location", location)
+        self.sink.set_property("async", False)
+
+        self.bin.add(self.muxer, self.sink)
+        self.muxer.link(self.sink)
+
+    # adds the elements needed for a stream with these caps and returns the
+    # ghost pad to link it to
+    def add_stream(self, caps):
+        name = caps.get_structure(0).get_name()
+        description = ENCODERS.get(name) or PARSERS.get(name) or "identity"
+        chain = Gst.parse_bin_from_description(description, True)
+        self.bin.add(chain)
+        if not chain.link(self.muxer):
+            print("ERROR: The muxer does not accept '{0:s}'".format(name))
+            sys.exit(1)
+
+        pad = Gst.GhostPad.new(None, chain.get_static_pad("sink"))
+        pad.set_active(True)
+        self.bin.add_pad(pad)
+        return pad
+
+
+class ClipExtractor(object):
+
+    def __init__(self, uri, ranges, template="clip-%02d.mkv", reencode=False):
+        # (start, stop) in nanoseconds
+        self.ranges = list(ranges)
+        self.template = template
+        self.reencode = reencode
+        self.current = 0
+        self.terminate = False
+        # one queue per stream, with the caps of the stream
+        self.streams = []
+        self.pads_done = threading.Event()
+        # seqnum of the latest seek, and the state of the probe of every
+        # stream. data decoded before our first seek is dropped
+        self.seek_seqnum = None
+        self.pad_states = {}
+        self.clip_start = None
+
+        # initialize GStreamer
+        Gst.init(None)
+
+        # create the elements
+        self.source = Gst.ElementFactory.make("uridecodebin", "source")
+        self.pipeline = Gst.Pipeline.new("clip-pipeline")
+        if not self.source or not self.pipeline:
+            print("ERROR: Could not create all elements")
+            sys.exit(1)
+
+        self.source.set_property("uri", uri)
+        if not reencode:
+            self.source.set_property("caps", Gst.Caps.from_string(COPY_CAPS))
+        connect(self.source, "pad-added", self.on_pad_added)
+        connect(self.source, "no-more-pads", self.on_no_more_pads)
+
+        self.clip = ClipBin(0, template % 0)
+        self.pipeline.add(self.source, self.clip.bin)
+
+    # handler for the pad-added signal, called from a streaming thread
+    def on_pad_added(self, src, new_pad):
+        caps = new_pad.get_current_caps()
+        queue = Gst.ElementFactory.make("queue", None)
+        self.pipeline.add(queue)
+        queue.sync_state_with_parent()
+
+        # drop whatever is decoded before our seeks, and in copy mode what
+        # lies before the start of the range
+        name = caps.get_structure(0).get_name()
+        keyframes = name.startswith("video/") and name != "video/x-raw"
+        add_probe(
+            new_pad,
+            Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+            self.on_probe, queue, keyframes)
+        new_pad.link(queue.get_static_pad("sink"))
+        queue.get_static_pad("src").link(self.clip.add_stream(caps))
+        self.streams.append((queue, caps))
+
+    def on_no_more_pads(self, src):
+        self.pads_done.set()
+
+    # called from the streaming thread of the stream. keyframes tells
+    # whether the stream can only start at a keyframe
+    def on_probe(self, pad, info, queue, keyframes):
+        state = self.pad_states.get(pad, WAITING)
+
+        if info.type & Gst.PadProbeType.BUFFER:
+            if state == PASSING:
+                return Gst.PadProbeReturn.OK
+            if state == WAITING:
+                return Gst.PadProbeReturn.DROP
+
+            buf = info.get_buffer()
+            start = self.ranges[self.current][0]
+            pts = buf.pts if buf.pts != Gst.CLOCK_TIME_NONE else buf.dts
+            if keyframes:
+                if (buf.has_flags(Gst.BufferFlags.DELTA_UNIT)
+                        or (pts != Gst.CLOCK_TIME_NONE and pts < start)):
+                    return Gst.PadProbeReturn.DROP
+            elif pts != Gst.CLOCK_TIME_NONE:
+                duration = buf.duration if buf.duration != Gst.CLOCK_TIME_NONE else 0
+                if pts + duration <= start:
+                    return Gst.PadProbeReturn.DROP
+
+            self.pad_states[pad] = PASSING
+            return Gst.PadProbeReturn.OK
+
+        event = info.get_event()
+        if (event.type == Gst.EventType.SEGMENT
+                and event.get_seqnum() == self.seek_seqnum):
+            if self.reencode:
+                self.pad_states[pad] = PASSING
+            else:
+                # the segment starts at the keyframe before the range, shift
+                # the running time so that the clip starts at 0 at the start
+                # of the range
+                segment = event.parse_segment()
+                start = self.ranges[self.current][0]
+                queue.get_static_pad("src").set_offset(
+                    -max(0, start - segment.start))
+                self.pad_states[pad] = TRIMMING
+        return Gst.PadProbeReturn.OK
+
+    def seek(self):
+        start, stop = self.ranges[self.current]
+        flags = Gst.SeekFlags.FLUSH | Gst.SeekFlags.SEGMENT
+        if self.reencode:
+            flags |= Gst.SeekFlags.ACCURATE
+        else:
+            flags |= Gst.SeekFlags.KEY_UNIT | Gst.SeekFlags.SNAP_BEFORE
+
+        event = Gst.Event.new_seek(
+            1.0, Gst.Format.TIME, flags, Gst.SeekType.SET, start,
+            Gst.SeekType.SET, stop)
+        # the seek flushes, nothing passes until its segment arrives
+        self.seek_seqnum = event.get_seqnum()
+        for pad in list(self.pad_states):
+            self.pad_states[pad] = WAITING
+        self.clip_start = time.monotonic()
+        if not self.pipeline.send_event(event):
+            print("ERROR: Seek to {0:.3f}s failed".format(start / Gst.SECOND))
+            self.terminate = True
+
+    # the demuxer stopped at the end of the range: finish the file by
+    # sending EOS through the queues, behind any data still queued
+    def on_segment_done(self):
+        for queue, caps in self.streams:
+            queue.get_static_pad("sink").send_event(Gst.Event.new_eos())
+
+    # the clip bin received EOS on all streams and its file is complete
+    def on_clip_done(self):
+        print("Wrote {0} in {1:.2f}s".format(
+            self.clip.location, time.monotonic() - self.clip_start))
+
+        self.current += 1
+        if self.current >= len(self.ranges):
+            self.terminate = True
+            return
+
+        # replace the muxer and filesink. the demuxer is paused at the end of
+        # its segment, so nothing flows while we do this
+        old = self.clip
+        for queue, caps in self.streams:
+            src_pad = queue.get_static_pad("src")
+            src_pad.unlink(src_pad.get_peer())
+        old.bin.set_state(Gst.State.NULL)
+        self.pipeline.remove(old.bin)
+
+        self.clip = ClipBin(self.current, self.template % self.current)
+        self.pipeline.add(self.clip.bin)
+        for queue, caps in self.streams:
+            queue.get_static_pad("src").link(self.clip.add_stream(caps))
+        self.clip.bin.sync_state_with_parent()
+
+        # the flushing seek also clears the EOS from the queues
+        self.seek()
+
+    def run(self):
+        ret = self.pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            print("ERROR: Unable to set the pipeline to the playing state")
+            sys.exit(1)
+
+        # we can seek once the demuxer has exposed all its streams
+        if not self.pads_done.wait(10):
+            print("ERROR: No streams found")
+            self.pipeline.set_state(Gst.State.NULL)
+            return False
+        self.seek()
+
+        bus = self.pipeline.get_bus()
+        ok = True
+        while not self.terminate:
+            msg = bus.timed_pop_filtered(
+                100 * Gst.MSECOND,
+                Gst.MessageType.ERROR | Gst.MessageType.EOS
+                | Gst.MessageType.SEGMENT_DONE)
+            if not msg:
+                continue
+
+            t = msg.type
+            if t == Gst.MessageType.ERROR:
+                err, dbg = msg.parse_error()
+                print("ERROR:", msg.src.get_name(), ":", err.message)
+                if dbg:
+                    print("Debug info:", dbg)
+                ok = False
+                self.terminate = True
+            elif t == Gst.MessageType.SEGMENT_DONE:
+                self.on_segment_done()
+            elif t == Gst.MessageType.EOS:
+                # the clip bin holds the only sink, so the pipeline is EOS
+                # exactly when the clip is
+                self.on_clip_done()
+
+        self.pipeline.set_state(Gst.State.NULL)
+        return ok
+
+
+def parse_range(text):
+    start, stop = text.split("-")
+    return int(float(start) * Gst.SECOND), int(float(stop) * Gst.SECOND)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    reencode = "--reencode" in args
+    if reencode:
+        args.remove("--reencode")
+
+    template = "clip-%02d.mkv"
+    if "--output" in args:
+        i = args.index("--output")
+        template = args[i + 1]
+        del args[i:i + 2]
+
+    if len(args) < 2:
+        print("usage: {0} [--reencode] [--output TEMPLATE] URI START-STOP [START-STOP...]".format(
+            sys.argv[0]))
+        sys.exit(1)
+
+    extractor = ClipExtractor(args[0], [parse_range(r) for r in args[1:]],
+                              template, reencode)
+    sys.exit(0 if extractor.run() else 1)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+from gi.repository import Gst, GstPbutils, GLib
+
+from eventlog import EventLog
+from helper import add_probe, connect, format_ns, percentile
+
+# gapless playback of a playlist: instead of tearing playbin down at EOS, the
+# next URI is handed to playbin from its "about-to-finish" signal. playbin
+# then keeps its decoders and sinks and switches to the new item without
+# going through the NULL state.
+#
+# usage: basic-tutorial-4-ex-playlist.py URI [URI...]
+#
+# https://gstreamer.freedesktop.org/documentation/playback/playbin.html#playbin::about-to-finish
+
+
+# measures the gap between consecutive items as seen by a sink: the distance
+# in running time between the end of the last buffer of an item and the start
+# of the first buffer of the next one, and the same in wall clock time
+class GapMeter(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.segment = None
+        self.last_end = None
+        self.last_wall = None
+        self.boundary = False
+        # list of (running time gap, wall clock gap) in ns
+        self.gaps = []
+
+    def attach(self, sink):
+        pad = sink.get_static_pad("sink")
+        add_probe(
+            pad, Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM,
+            self.on_probe)
+
+    # runs on the streaming thread, so it only records numbers
+    def on_probe(self, pad, info):
+        if info.type & Gst.PadProbeType.BUFFER:
+            buf = info.get_buffer()
+            now = time.monotonic_ns()
+            if self.segment and buf.pts != Gst.CLOCK_TIME_NONE:
+                start = self.segment.to_running_time(Gst.Format.TIME, buf.pts)
+                if self.boundary and self.last_end is not None:
+                    self.gaps.append(
+                        (start - self.last_end, now - self.last_wall))
+                self.boundary = False
+
+                duration = buf.duration
+                if duration == Gst.CLOCK_TIME_NONE:
+                    duration = 0
+                self.last_end = start + duration
+                self.last_wall = now
+        else:
+            event = info.get_event()
+            if event.type == Gst.EventType.STREAM_START:
+                self.boundary = True
+            elif event.type == Gst.EventType.SEGMENT:
+                self.segment = event.parse_segment()
+
+        return Gst.PadProbeReturn.OK
+
+
+class PlaylistPlayer(object):
+
+    def __init__(self, uris):
+        # the playlist and the item playbin is currently prerolling
+        self.uris = list(uris)
+        self.current = 0
+        self.terminate = False
+        # URIs the discoverer found to be unplayable, they are skipped
+        self.bad_uris = set()
+        self.log = EventLog()
+
+        # initialize GStreamer
+        Gst.init(None)
+
+        # create the elements
+        self.playbin = Gst.ElementFactory.make("playbin", "playbin")
+        audio_sink = Gst.ElementFactory.make("autoaudiosink", "audiosink")
+        video_sink = Gst.ElementFactory.make("autovideosink", "videosink")
+        if not self.playbin or not audio_sink or not video_sink:
+            print("ERROR: Could not create all elements")
+            sys.exit(1)
+
+        # use our own sinks so we can watch the data reaching them
+        self.playbin.set_property("audio-sink", audio_sink)
+        self.playbin.set_property("video-sink", video_sink)
+        self.audio_gaps = GapMeter("audio")
+        self.audio_gaps.attach(audio_sink)
+        self.video_gaps = GapMeter("video")
+        self.video_gaps.attach(video_sink)
+
+        # playbin asks for the next URI once the current one is fully
+        # demuxed. this is called from a streaming thread
+        connect(self.playbin, "about-to-finish", self.on_about_to_finish)
+
+        # the discoverer looks at the next item while the current one is
+        # still playing, so it is validated and its source (disk cache,
+        # HTTP connection) is warm by the time playbin prerolls it
+        self.discoverer = GstPbutils.Discoverer.new(5 * Gst.SECOND)
+        connect(self.discoverer, "discovered", self.on_discovered)
+
+        self.playbin.set_property("uri", self.uris[0])
+
+    def next_index(self, index):
+        index += 1
+        while index < len(self.uris) and self.uris[index] in self.bad_uris:
+            index += 1
+        return index
+
+    # called from a streaming thread when playbin is ready for the next URI
+    def on_about_to_finish(self, playbin):
+        index = self.next_index(self.current)
+        if index >= len(self.uris):
+            self.log.event("playlist", "playbin", "Last item, not queueing")
+            return
+
+        self.current = index
+        playbin.set_property("uri", self.uris[index])
+        self.log.event("playlist", "playbin",
+                       "Queued item {0}: {1}".format(index, self.uris[index]))
+
+    def on_discovered(self, discoverer, info, error):
+        if info.get_result() != GstPbutils.DiscovererResult.OK:
+            self.bad_uris.add(info.get_uri())
+            self.log.event("preroll", "discoverer",
+                           "Skipping unplayable item {0}".format(info.get_uri()))
+        else:
+            self.log.event("preroll", "discoverer",
+                           "Next item ready: {0}".format(info.get_uri()))
+
+    # start looking at the item after the one that just started
+    def preroll_next(self):
+        index = self.next_index(self.current)
+        if index < len(self.uris):
+            self.discoverer.discover_uri_async(self.uris[index])
+
+    def play(self):
+        self.log.start()
+        self.discoverer.start()
+
+        # start playing
+        ret = self.playbin.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            print("ERROR: Unable to set the pipeline to the playing state")
+            sys.exit(1)
+
+        try:
+            # listen to the bus
+            bus = self.playbin.get_bus()
+            while not self.terminate:
+                msg = bus.timed_pop_filtered(
+                    100 * Gst.MSECOND,
+                    (Gst.MessageType.ERROR | Gst.MessageType.EOS
+                        | Gst.MessageType.STREAM_START)
+                )
+                if msg:
+                    self.handle_message(msg)
+
+                # the discoverer reports through the default main context
+                while GLib.MainContext.default().iteration(False):
+                    pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.discoverer.stop()
+            self.playbin.set_state(Gst.State.NULL)
+            self.log.stop()
+
+        self.print_report()
+
+    def handle_message(self, msg):
+        t = msg.type
+        if t == Gst.MessageType.ERROR:
+            err, dbg = msg.parse_error()
+            self.log.error(msg.src.get_name(), "{0} ({1})".format(
+                err.message, dbg or "no debug info"))
+            self.terminate = True
+        elif t == Gst.MessageType.EOS:
+            self.log.event("eos", msg.src.get_name(),
+                           "End of playlist reached")
+            self.terminate = True
+        elif t == Gst.MessageType.STREAM_START:
+            # a new item started playing
+            self.log.event("playlist", msg.src.get_name(),
+                           "Playing item {0}: {1}".format(
+                               self.current, self.uris[self.current]))
+            self.preroll_next()
+
+    def print_report(self):
+        for meter in (self.audio_gaps, self.video_gaps):
+            if not meter.gaps:
+                continue
+
+            print("Inter-item gaps ({0}, {1} boundaries):".format(
+                meter.name, len(meter.gaps)))
+            for i, (gap, wall) in enumerate(meter.gaps):
+                print("  #{0}: running time {1:+.3f} ms, wall clock {2:.3f} ms".format(
+                    i + 1, gap / 1e6, wall / 1e6))
+
+            gaps = [abs(g) for g, w in meter.gaps]
+            print("  p50 {0}  max {1}".format(
+                format_ns(percentile(gaps, 50)), format_ns(max(gaps))))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("usage: {0} URI [URI...]".format(sys.argv[0]))
+        sys.exit(1)
+
+    p = PlaylistPlayer(sys.argv[1:])
+    p.play()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import threading
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from helper import add_probe, connect, format_ns, get_cpu_time
+
+# scans through a recording at a multiple of the normal speed, forwards or
+# backwards, with a trick mode seek: the demuxer only hands out keyframes,
+# audio is not decoded at all, and the trick mode interval makes it skip
+# keyframes so that about --fps frames per second are shown, however fast
+# the scan. without trick mode (--no-trickmode) every frame is decoded and
+# most of them are thrown away by the sink for being late.
+#
+# every second, the frames the decoder produced and the frames the sink
+# rendered and dropped are reported, together with the CPU load.
+#
+# usage: basic-tutorial-4-ex-scan.py [--rate R] [--fps F] [--no-trickmode]
+#                                    [--seconds S] URI
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+4%3A+Time+management
+
+
+class Scanner(object):
+
+    def __init__(self, uri, rate=8.0, fps=10.0, trickmode=True):
+        self.rate = rate
+        self.fps = fps
+        self.trickmode = trickmode
+        self.terminate = False
+        self.seek_done = False
+
+        # frames leaving the video decoder, and the video sink
+        self.lock = threading.Lock()
+        self.decoded = 0
+        self.video_sink = None
+
+        # initialize GStreamer
+        Gst.init(None)
+
+        # create the elements
+        self.playbin = Gst.ElementFactory.make("playbin", "playbin")
+        if not self.playbin:
+            print("ERROR: Could not create 'playbin' element")
+            sys.exit(1)
+
+        self.playbin.set_property("uri", uri)
+        connect(self.playbin, "deep-element-added", self.on_deep_element_added)
+
+    # called from a streaming thread for every element playbin creates
+    def on_deep_element_added(self, bin, sub_bin, element):
+        factory = element.get_factory()
+        if not factory:
+            return
+
+        klass = factory.get_klass()
+        if "Decoder" in klass and "Video" in klass:
+            add_probe(element.get_static_pad("src"), Gst.PadProbeType.BUFFER,
+                      self.on_decoded)
+        elif "Sink" in klass and "Video" in klass and element.find_property("stats"):
+            self.video_sink = element
+
+    # called from the decoder's streaming thread
+    def on_decoded(self, pad, info):
+        with self.lock:
+            self.decoded += 1
+        return Gst.PadProbeReturn.OK
+
+    def sink_stats(self):
+        if not self.video_sink:
+            return 0, 0
+        s = self.video_sink.get_property("stats")
+        ok, rendered = s.get_uint64("rendered")
+        ok2, dropped = s.get_uint64("dropped")
+        return rendered if ok else 0, dropped if ok2 else 0
+
+    def seek(self):
+        ok, position = self.playbin.query_position(Gst.Format.TIME)
+        if not ok:
+            position = 0
+
+        flags = Gst.SeekFlags.FLUSH
+        if self.trickmode:
+            flags |= (Gst.SeekFlags.TRICKMODE
+                      | Gst.SeekFlags.TRICKMODE_KEY_UNITS
+                      | Gst.SeekFlags.TRICKMODE_NO_AUDIO)
+
+        # playing backwards means playing from the start of the segment up
+        # to the current position, in reverse. from the start of the media,
+        # scan back from its end
+        if self.rate < 0 and position == 0:
+            ok, duration = self.playbin.query_duration(Gst.Format.TIME)
+            if ok:
+                position = duration
+
+        if self.rate > 0:
+            event = Gst.Event.new_seek(
+                self.rate, Gst.Format.TIME, flags, Gst.SeekType.SET, position,
+                Gst.SeekType.NONE, Gst.CLOCK_TIME_NONE)
+        else:
+            event = Gst.Event.new_seek(
+                self.rate, Gst.Format.TIME, flags, Gst.SeekType.SET, 0,
+                Gst.SeekType.SET, position)
+
+        # in one second the scan covers |rate| seconds of media, out of
+        # which we want to show fps frames
+        interval = int(abs(self.rate) / self.fps * Gst.SECOND)
+        if self.trickmode:
+            if hasattr(event, "set_seek_trickmode_interval"):
+                event.set_seek_trickmode_interval(interval)
+            else:
+                # before GStreamer 1.16 every keyframe is shown
+                print("WARNING: This GStreamer cannot skip keyframes, "
+                      "--fps {0} is not honored".format(self.fps))
+
+        print("Scanning at {0}x from {1}, one keyframe every {2:.2f}s of media".format(
+            self.rate, format_ns(position), interval / Gst.SECOND))
+        if not self.playbin.send_event(event):
+            print("ERROR: The scan seek failed")
+            self.terminate = True
+
+    def report(self, last):
+        with self.lock:
+            decoded = self.decoded
+        rendered, dropped = self.sink_stats()
+        cpu = get_cpu_time()
+        ok, position = self.playbin.query_position(Gst.Format.TIME)
+
+        if last:
+            print("{0}  decoded {1:4d}  rendered {2:4d}  dropped {3:4d}  cpu {4:4.0%}".format(
+                format_ns(position) if ok else "?",
+                decoded - last[0], rendered - last[1], dropped - last[2],
+                cpu - last[3]))
+        return decoded, rendered, dropped, cpu
+
+    def run(self, seconds=None):
+        # preroll first, the scan starts from the first frame
+        ret = self.playbin.set_state(Gst.State.PAUSED)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            print("ERROR: Unable to set the pipeline to the paused state")
+            sys.exit(1)
+
+        bus = self.playbin.get_bus()
+        first = last = None
+        elapsed = 0
+        while not self.terminate:
+            msg = bus.timed_pop_filtered(
+                Gst.SECOND,
+                Gst.MessageType.ERROR | Gst.MessageType.EOS
+                | Gst.MessageType.ASYNC_DONE)
+
+            if not msg:
+                if self.seek_done:
+                    last = self.report(last)
+                    elapsed += 1
+                    if seconds and elapsed >= seconds:
+                        break
+                continue
+
+            t = msg.type
+            if t == Gst.MessageType.ERROR:
+                err, dbg = msg.parse_error()
+                print("ERROR:", msg.src.get_name(), ":", err.message)
+                self.terminate = True
+            elif t == Gst.MessageType.EOS:
+                print("Reached the {0} of the media".format(
+                    "end" if self.rate > 0 else "start"))
+                self.terminate = True
+            elif t == Gst.MessageType.ASYNC_DONE and not self.seek_done:
+                self.seek()
+                self.seek_done = True
+                first = last = self.report(None)
+                self.playbin.set_state(Gst.State.PLAYING)
+
+        if first:
+            total = self.report(None)
+            print("total: decoded {0}, rendered {1}, dropped {2}, cpu {3:.2f}s".format(
+                total[0] - first[0], total[1] - first[1], total[2] - first[2],
+                total[3] - first[3]))
+        self.playbin.set_state(Gst.State.NULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan through a recording")
+    parser.add_argument("--rate", type=float, default=8.0,
+                        help="playback rate, negative to scan backwards")
+    parser.add_argument("--fps", type=float, default=10.0,
+                        help="frames per second to show")
+    parser.add_argument("--no-trickmode", dest="trickmode",
+                        action="store_false",
+                        help="decode every frame, for comparison")
+    parser.add_argument("--seconds", type=float, help="stop after S seconds")
+    parser.add_argument("uri")
+    args = parser.parse_args()
+
+    if args.rate == 0 or args.fps <= 0:
+        parser.error("the rate must not be 0 and fps must be positive")
+
+    uri = args.uri
+    if "://" not in uri:
+        uri = Gst.filename_to_uri(os.path.abspath(uri))
+    scanner = Scanner(uri, args.rate, args.fps, args.trickmode)
+    scanner.run(args.seconds)
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,8 @@ import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst
 
+from buffering import BufferingController
+from eventlog import EventLog
 from helper import format_ns
 
 # http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+4%3A+Time+management
@@ -23,6 +25,9 @@ class Player(object):
         self.seek_done = False
         # media duration (ns)
         self.duration = Gst.CLOCK_TIME_NONE
+        # the bus loop reports through the event log, so it never blocks
+        # on stdout
+        self.log = EventLog()
 
         # initialize GStreamer
         Gst.init(None)
@@ -37,17 +42,21 @@ class Player(object):
         self.playbin.set_property(
             "uri", "http://docs.gstreamer.com/media/sintel_trailer-480p.webm")
 
+        # pauses playback while the network buffers refill
+        self.buffering = BufferingController(self.playbin, log=self.log)
+
     def play(self):
         # dont start again if we are already playing
         if self.playing:
             return
 
         # start playing
-        ret = self.playbin.set_state(Gst.State.PLAYING)
+        ret = self.buffering.set_state(Gst.State.PLAYING)
         if ret == Gst.StateChangeReturn.FAILURE:
             print("ERROR: Unable to set the pipeline to the playing state")
             sys.exit(1)
 
+        self.log.start()
         try:
             # listen to the bus
             bus = self.playbin.get_bus()
@@ -55,7 +64,8 @@ class Player(object):
                 msg = bus.timed_pop_filtered(
                     100 * Gst.MSECOND,
                     (Gst.MessageType.STATE_CHANGED | Gst.MessageType.ERROR
-                        | Gst.MessageType.EOS | Gst.MessageType.DURATION_CHANGED)
+                        | Gst.MessageType.EOS | Gst.MessageType.DURATION_CHANGED
+                        | Gst.MessageType.BUFFERING)
                 )
 
                 # parse message
@@ -69,23 +79,27 @@ class Player(object):
                         ret, current = self.playbin.query_position(
                             Gst.Format.TIME)
                         if not ret:
-                            print("ERROR: Could not query current position")
+                            self.log.event("query", "playbin",
+                                           "Could not query current position")
 
                         # if we don't know it yet, query the stream duration
                         if self.duration == Gst.CLOCK_TIME_NONE:
                             (ret, self.duration) = self.playbin.query_duration(
                                 Gst.Format.TIME)
                             if not ret:
-                                print("ERROR: Could not query stream duration")
+                                self.log.event("query", "playbin",
+                                               "Could not query stream duration")
 
-                        # print current position and total duration
-                        print(
+                        # log current position and total duration
+                        self.log.event(
+                            "position", "playbin",
                             "Position {0} / {1}".format(format_ns(current), format_ns(self.duration)))
 
                         # if seeking is enabled, we have not done it yet and the time is right,
                         # seek
                         if self.seek_enabled and not self.seek_done and current > 10 * Gst.SECOND:
-                            print("Reached 10s, performing seek...")
+                            self.log.event("seek", "playbin",
+                                           "Reached 10s, performing seek...")
                             self.playbin.seek_simple(
                                 Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, 30 * Gst.SECOND)
 
@@ -94,27 +108,35 @@ class Player(object):
                     break
         finally:
             self.playbin.set_state(Gst.State.NULL)
+            stats = self.buffering.stats()
+            self.log.event("buffering", "playbin",
+                           "{0} rebuffers, stalled for {1:.2f}s".format(
+                               stats["rebuffers"], stats["stall-time"]))
+            self.log.stop()
 
     def handle_message(self, msg):
         t = msg.type
         if t == Gst.MessageType.ERROR:
             err, dbg = msg.parse_error()
-            print("ERROR:", msg.src.get_name(), ":", err)
-            if dbg:
-                print("Debug info:", dbg)
+            self.log.error(msg.src.get_name(), "{0} ({1})".format(
+                err.message, dbg or "no debug info"))
             self.terminate = True
         elif t == Gst.MessageType.EOS:
-            print("End-Of-Stream reached")
+            self.log.event("eos", msg.src.get_name(), "End-Of-Stream reached")
             self.terminate = True
+        elif t == Gst.MessageType.BUFFERING:
+            self.buffering.handle_message(msg)
         elif t == Gst.MessageType.DURATION_CHANGED:
             # the duration has changed, invalidate the current one
             self.duration = Gst.CLOCK_TIME_NONE
         elif t == Gst.MessageType.STATE_CHANGED:
             old_state, new_state, pending_state = msg.parse_state_changed()
             if msg.src == self.playbin:
-                print("Pipeline state changed from '{0:s}' to '{1:s}'".format(
-                    Gst.Element.state_get_name(old_state),
-                    Gst.Element.state_get_name(new_state)))
+                self.log.event(
+                    "state-changed", msg.src.get_name(),
+                    "Pipeline state changed from '{0:s}' to '{1:s}'".format(
+                        Gst.Element.state_get_name(old_state),
+                        Gst.Element.state_get_name(new_state)))
 
                 # remember whether we are in the playing state or not
                 self.playing = new_state == Gst.State.PLAYING
@@ -126,16 +148,19 @@ class Player(object):
                         fmt, self.seek_enabled, start, end = query.parse_seeking()
 
                         if self.seek_enabled:
-                            print(
+                            self.log.event(
+                                "seeking", "playbin",
                                 "Seeking is ENABLED (from {0} to {1})".format(
                                     format_ns(start), format_ns(end)))
                         else:
-                            print("Seeking is DISABLED for this stream")
+                            self.log.event(
+                                "seeking", "playbin",
+                                "Seeking is DISABLED for this stream")
                     else:
-                        print("ERROR: Seeking query failed")
+                        self.log.error("playbin", "Seeking query failed")
 
         else:
-            print("ERROR: Unexpected message received")
+            self.log.error(msg.src.get_name(), "Unexpected message received")
 
 if __name__ == '__main__':
     p = Player()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import sys
+import time
 import gi
 gi.require_version('Gst', '1.0')
 gi.require_version('Gtk', '3.0')
@@ -8,6 +9,10 @@ gi.require_version('GdkX11', '3.0')
 gi.require_version('GstVideo', '1.0')
 from gi.repository import Gst, Gtk, GLib, GdkX11, GstVideo
 
+from buffering import BufferingController
+from helper import add_probe, connect, get_cpu_time
+from snapshot import Snapshotter
+
 # http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+5%3A+GUI+toolkit+integration
 
 
@@ -22,19 +27,73 @@ class Player(object):
 
         self.state = Gst.State.NULL
         self.duration = Gst.CLOCK_TIME_NONE
-        self.playbin = Gst.ElementFactory.make("playbin", "playbin")
+
+        # playbin3 only decodes the streams that are selected, playbin
+        # decodes all of them and switches between the decoded streams
+        self.playbin = Gst.ElementFactory.make("playbin3", "playbin")
+        self.use_playbin3 = self.playbin is not None
+        if not self.use_playbin3:
+            self.playbin = Gst.ElementFactory.make("playbin", "playbin")
         if not self.playbin:
             print("ERROR: Could not create playbin.")
             sys.exit(1)
 
+        # the streams of the media (playbin3) and the ids of the selected ones
+        self.collection = None
+        self.selected = []
+        # when the pending track switch was requested, and the CPU load
+        # before it
+        self.switch_start = None
+        self.switch_cpu = None
+        # (wall clock, cpu time) samples of the last seconds
+        self.cpu_samples = []
+
         # set up URI
         self.playbin.set_property(
             "uri", "http://docs.gstreamer.com/media/sintel_trailer-480p.webm")
 
-        # connect to interesting signals in playbin
-        self.playbin.connect("video-tags-changed", self.on_tags_changed)
-        self.playbin.connect("audio-tags-changed", self.on_tags_changed)
-        self.playbin.connect("text-tags-changed", self.on_tags_changed)
+        # pauses playback while the network buffers refill
+        self.buffering = BufferingController(self.playbin)
+
+        # converts the frame on screen when the snapshot button is clicked
+        self.snapshots = Snapshotter(self.playbin, max_width=640)
+
+        # scale the video down to the size of the video window before it is
+        # converted and rendered. the video filter sits in front of the
+        # conversion playbin does for the sink
+        self.scale = Gst.ElementFactory.make("videoscale", "scale")
+        self.scale_caps = Gst.ElementFactory.make("capsfilter", "scale-caps")
+        if not self.scale or not self.scale_caps:
+            print("ERROR: Could not create the scaling elements.")
+            sys.exit(1)
+
+        scale_bin = Gst.Bin.new("scale-bin")
+        scale_bin.add(self.scale, self.scale_caps)
+        self.scale.link(self.scale_caps)
+        scale_bin.add_pad(Gst.GhostPad.new(
+            "sink", self.scale.get_static_pad("sink")))
+        scale_bin.add_pad(Gst.GhostPad.new(
+            "src", self.scale_caps.get_static_pad("src")))
+        self.playbin.set_property("video-filter", scale_bin)
+
+        # the size of the video window and of the decoded video
+        self.render_size = None
+        self.video_size = None
+        # pending timeout applying a new render size
+        self.resize_id = 0
+        # decoders that can decode at a reduced resolution themselves
+        self.lowres_decoders = []
+        add_probe(
+            self.scale.get_static_pad("sink"),
+            Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_scale_event)
+        connect(self.playbin, "deep-element-added", self.on_deep_element_added)
+
+        # connect to interesting signals in playbin. playbin3 reports its
+        # streams with a stream collection message instead
+        if not self.use_playbin3:
+            connect(self.playbin, "video-tags-changed", self.on_tags_changed)
+            connect(self.playbin, "audio-tags-changed", self.on_tags_changed)
+            connect(self.playbin, "text-tags-changed", self.on_tags_changed)
 
         # create the GUI
         self.build_ui()
@@ -46,13 +105,16 @@ class Player(object):
         bus.connect("message::error", self.on_error)
         bus.connect("message::eos", self.on_eos)
         bus.connect("message::state-changed", self.on_state_changed)
+        bus.connect("message::buffering", self.on_buffering)
         bus.connect("message::application", self.on_application_message)
+        bus.connect("message::stream-collection", self.on_stream_collection)
+        bus.connect("message::streams-selected", self.on_streams_selected)
 
     # set the playbin to PLAYING (start playback), register refresh callback
     # and start the GTK main loop
     def start(self):
         # start playing
-        ret = self.playbin.set_state(Gst.State.PLAYING)
+        ret = self.buffering.set_state(Gst.State.PLAYING)
         if ret == Gst.StateChangeReturn.FAILURE:
             print("ERROR: Unable to set the pipeline to the playing state")
             sys.exit(1)
@@ -73,6 +135,15 @@ class Player(object):
             self.playbin.set_state(Gst.State.NULL)
             self.playbin = None
 
+            stats = self.buffering.stats()
+            print("{0} rebuffers, stalled for {1:.2f}s".format(
+                stats["rebuffers"], stats["stall-time"]))
+            stats = self.snapshots.stats()
+            if stats["requests"]:
+                print("{0} snapshots, {1} converted in {2:.3f}s".format(
+                    stats["requests"], stats["conversions"],
+                    stats["convert-time"]))
+
     def build_ui(self):
         main_window = Gtk.Window.new(Gtk.WindowType.TOPLEVEL)
         main_window.connect("delete-event", self.on_delete_event)
@@ -81,6 +152,7 @@ class Player(object):
         video_window.set_double_buffered(False)
         video_window.connect("realize", self.on_realize)
         video_window.connect("draw", self.on_draw)
+        video_window.connect("size-allocate", self.on_size_allocate)
 
         play_button = Gtk.Button.new_from_stock(Gtk.STOCK_MEDIA_PLAY)
         play_button.connect("clicked", self.on_play)
@@ -91,6 +163,9 @@ class Player(object):
         stop_button = Gtk.Button.new_from_stock(Gtk.STOCK_MEDIA_STOP)
         stop_button.connect("clicked", self.on_stop)
 
+        snapshot_button = Gtk.Button.new_with_label("Snapshot")
+        snapshot_button.connect("clicked", self.on_snapshot)
+
         self.slider = Gtk.HScale.new_with_range(0, 100, 1)
         self.slider.set_draw_value(False)
         self.slider_update_signal_id = self.slider.connect(
@@ -99,15 +174,32 @@ class Player(object):
         self.streams_list = Gtk.TextView.new()
         self.streams_list.set_editable(False)
 
+        # track selection. the ids are stream ids with playbin3 and stream
+        # indices with playbin
+        self.audio_combo = Gtk.ComboBoxText.new()
+        self.audio_signal_id = self.audio_combo.connect(
+            "changed", self.on_track_changed)
+        self.text_combo = Gtk.ComboBoxText.new()
+        self.text_signal_id = self.text_combo.connect(
+            "changed", self.on_track_changed)
+
+        streams_box = Gtk.VBox.new(False, 0)
+        streams_box.pack_start(self.streams_list, True, True, 0)
+        streams_box.pack_start(Gtk.Label.new("Audio"), False, False, 2)
+        streams_box.pack_start(self.audio_combo, False, False, 2)
+        streams_box.pack_start(Gtk.Label.new("Subtitles"), False, False, 2)
+        streams_box.pack_start(self.text_combo, False, False, 2)
+
         controls = Gtk.HBox.new(False, 0)
         controls.pack_start(play_button, False, False, 2)
         controls.pack_start(pause_button, False, False, 2)
         controls.pack_start(stop_button, False, False, 2)
+        controls.pack_start(snapshot_button, False, False, 2)
         controls.pack_start(self.slider, True, True, 0)
 
         main_hbox = Gtk.HBox.new(False, 0)
         main_hbox.pack_start(video_window, True, True, 0)
-        main_hbox.pack_start(self.streams_list, False, False, 2)
+        main_hbox.pack_start(streams_box, False, False, 2)
 
         main_box = Gtk.VBox.new(False, 0)
         main_box.pack_start(main_hbox, True, True, 0)
@@ -130,21 +222,111 @@ class Player(object):
         self.playbin.set_window_handle(window_handle)
         # self.playbin.set_xwindow_id(window_handle)
 
+    # this function is called whenever the video window gets a new size.
+    # while the window is being resized this happens many times in a row,
+    # so the new size is only applied once it stopped changing
+    def on_size_allocate(self, widget, allocation):
+        scale = widget.get_scale_factor()
+        self.render_size = (allocation.width * scale, allocation.height * scale)
+
+        if self.resize_id:
+            GLib.source_remove(self.resize_id)
+        self.resize_id = GLib.timeout_add(250, self.apply_render_size)
+
+    # called from a streaming thread for the events reaching the scaler. we
+    # need the size of the decoded video to keep its aspect ratio
+    def on_scale_event(self, pad, info):
+        event = info.get_event()
+        if event.type == Gst.EventType.CAPS:
+            s = event.parse_caps().get_structure(0)
+            ok, width = s.get_int("width")
+            ok2, height = s.get_int("height")
+            ok3, par_n, par_d = s.get_fraction("pixel-aspect-ratio")
+            if not ok3:
+                par_n, par_d = 1, 1
+            if ok and ok2:
+                self.video_size = (width * par_n / par_d, height)
+                GLib.idle_add(self.apply_render_size)
+        return Gst.PadProbeReturn.OK
+
+    # called from a streaming thread for every element playbin creates
+    def on_deep_element_added(self, bin, sub_bin, element):
+        factory = element.get_factory()
+        if (factory and factory.get_klass().find("Decoder") >= 0
+                and element.find_property("lowres")):
+            self.lowres_decoders.append(element)
+
+    # restricts the output of the scaler to the window size, keeping the
+    # aspect ratio of the video. video is never scaled up
+    def apply_render_size(self):
+        self.resize_id = 0
+        if not self.render_size or not self.video_size:
+            return False
+
+        width, height = self.render_size
+        video_width, video_height = self.video_size
+        factor = min(width / video_width, height / video_height)
+        if factor >= 1 or width <= 0 or height <= 0:
+            caps = Gst.Caps.new_any()
+        else:
+            # most formats want even sizes
+            width = max(2, int(video_width * factor) // 2 * 2)
+            height = max(2, int(video_height * factor) // 2 * 2)
+            caps = Gst.Caps.from_string(
+                "video/x-raw,width={0},height={1},pixel-aspect-ratio=1/1".format(
+                    width, height))
+
+        current = self.scale_caps.get_property("caps")
+        if not current or not current.is_equal(caps):
+            # setting new caps makes the scaler renegotiate on the fly
+            self.scale_caps.set_property("caps", caps)
+
+        # libav decoders can skip work for 1/2 and 1/4 of the resolution.
+        # it takes effect the next time the decoder is opened
+        lowres = 0
+        if factor <= 0.25:
+            lowres = 2
+        elif factor <= 0.5:
+            lowres = 1
+        for decoder in self.lowres_decoders:
+            decoder.set_property("lowres", lowres)
+
+        return False
+
     # this function is called when the PLAY button is clicked
     def on_play(self, button):
-        self.playbin.set_state(Gst.State.PLAYING)
+        self.buffering.set_state(Gst.State.PLAYING)
         pass
 
     # this function is called when the PAUSE button is clicked
     def on_pause(self, button):
-        self.playbin.set_state(Gst.State.PAUSED)
+        self.buffering.set_state(Gst.State.PAUSED)
         pass
 
     # this function is called when the STOP button is clicked
     def on_stop(self, button):
-        self.playbin.set_state(Gst.State.READY)
+        self.buffering.set_state(Gst.State.READY)
         pass
 
+    # this function is called when the SNAPSHOT button is clicked
+    def on_snapshot(self, button):
+        sample = self.snapshots.snapshot()
+        if not sample:
+            print("No video frame to take a snapshot of")
+            return
+
+        # named after the frame in the snapshot, which is not the one on
+        # screen when the request was rate limited
+        position = self.snapshots.position
+        if position is None or position == Gst.CLOCK_TIME_NONE:
+            position = 0
+        path = "snapshot-{0:.3f}.png".format(position / Gst.SECOND)
+        self.snapshots.write(sample, path)
+        if self.snapshots.current:
+            print("Saved {0}".format(path))
+        else:
+            print("Saved {0}, the previous snapshot (too many requests)".format(path))
+
     # this function is called when the main window is closed
     def on_delete_event(self, widget, event):
         self.on_stop(None)
@@ -168,14 +350,19 @@ class Player(object):
     # we perform a seek to the new position here
     def on_slider_changed(self, range):
         value = self.slider.get_value()
-        self.playbin.seek_simple(Gst.Format.TIME,
-                                 Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
-                                 value * Gst.SECOND)
+        if self.playbin.seek_simple(Gst.Format.TIME,
+                                    Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
+                                    value * Gst.SECOND):
+            self.buffering.seeked()
 
     # this function is called periodically to refresh the GUI
     def refresh_ui(self):
         current = -1
 
+        # keep a few seconds of CPU usage to compare track switches against
+        self.cpu_samples.append((time.monotonic(), get_cpu_time()))
+        del self.cpu_samples[:-4]
+
         # we do not want to update anything unless we are in the PAUSED
         # or PLAYING states
         if self.state < Gst.State.PAUSED:
@@ -226,7 +413,12 @@ class Player(object):
     # we just set the pipeline to READY (which stops playback)
     def on_eos(self, bus, msg):
         print("End-Of-Stream reached")
-        self.playbin.set_state(Gst.State.READY)
+        self.buffering.set_state(Gst.State.READY)
+
+    # this function is called when a buffering message is posted on the bus.
+    # the controller pauses the pipeline until the buffers are full again
+    def on_buffering(self, bus, msg):
+        self.buffering.handle_message(msg)
 
     # this function is called when the pipeline changes states.
     # we use it to keep track of the current state
@@ -245,9 +437,177 @@ class Player(object):
             # we reach the PAUSED state
             self.refresh_ui()
 
+    # CPU load of the process (1.0 is one core) over the last seconds
+    def cpu_load(self, since=None):
+        samples = [s for s in self.cpu_samples if since is None or s[0] >= since]
+        if len(samples) < 2:
+            return None
+        (wall0, cpu0), (wall1, cpu1) = samples[0], samples[-1]
+        return (cpu1 - cpu0) / (wall1 - wall0)
+
+    # this function is called when the user picks an audio or subtitle track
+    def on_track_changed(self, combo):
+        # media without audio has no audio track to pick
+        audio = self.audio_combo.get_active_id()
+        text = self.text_combo.get_active_id() or "off"
+
+        if self.use_playbin3:
+            if not self.selected:
+                # nothing is selected yet, we would lose the video
+                return
+
+            # keep the video streams, replace audio and subtitles. the
+            # pipeline keeps running, only the decoders change
+            streams = [sid for sid in self.selected
+                       if self.stream_type(sid) & Gst.StreamType.VIDEO]
+            if audio is not None:
+                streams.append(audio)
+            if text != "off":
+                streams.append(text)
+
+            self.start_switch()
+            if not self.playbin.send_event(Gst.Event.new_select_streams(streams)):
+                print("ERROR: The track switch was refused")
+                self.switch_start = None
+        else:
+            self.start_switch()
+            if audio is not None:
+                self.playbin.set_property("current-audio", int(audio))
+            flags = self.playbin.get_property("flags")
+            if text == "off":
+                # GST_PLAY_FLAG_TEXT
+                self.playbin.set_property("flags", flags & ~(1 << 2))
+            else:
+                self.playbin.set_property("flags", flags | (1 << 2))
+                self.playbin.set_property("current-text", int(text))
+            # playbin switches between already decoded streams, so the
+            # switch is done now
+            self.on_switch_done()
+
+    # remembers when a switch was requested, to time it once it is done
+    def start_switch(self):
+        self.switch_start = time.monotonic()
+        self.switch_cpu = self.cpu_load()
+
+    def stream_type(self, stream_id):
+        if self.collection:
+            for i in range(self.collection.get_size()):
+                stream = self.collection.get_stream(i)
+                if stream.get_stream_id() == stream_id:
+                    return stream.get_stream_type()
+        return Gst.StreamType.UNKNOWN
+
+    def on_switch_done(self):
+        if self.switch_start is None:
+            return
+
+        print("Track switch took {0:.1f} ms".format(
+            (time.monotonic() - self.switch_start) * 1000))
+
+        # compare the CPU load once the new streams had time to settle
+        start, before = self.switch_start, self.switch_cpu
+        self.switch_start = None
+
+        def report():
+            after = self.cpu_load(since=start)
+            if before is not None and after is not None:
+                print("CPU load {0:.0%} before the switch, {1:.0%} after".format(
+                    before, after))
+            return False
+
+        GLib.timeout_add_seconds(3, report)
+
+    # this function is called when playbin3 found the streams of the media
+    def on_stream_collection(self, bus, msg):
+        self.collection = msg.parse_stream_collection()
+        self.analyze_streams()
+
+    # this function is called when playbin3 activated a new set of streams
+    def on_streams_selected(self, bus, msg):
+        self.selected = [
+            msg.streams_selected_get_stream(i).get_stream_id()
+            for i in range(msg.streams_selected_get_size())]
+        self.on_switch_done()
+        self.update_track_combos()
+
+    # fills the track selectors with the available tracks, without
+    # triggering a switch
+    def update_track_combos(self):
+        self.audio_combo.handler_block(self.audio_signal_id)
+        self.text_combo.handler_block(self.text_signal_id)
+        self.audio_combo.remove_all()
+        self.text_combo.remove_all()
+        self.text_combo.append("off", "off")
+
+        if self.collection:
+            for i in range(self.collection.get_size()):
+                stream = self.collection.get_stream(i)
+                sid = stream.get_stream_id()
+                stype = stream.get_stream_type()
+                label = self.stream_label(stream.get_tags(), i)
+                if stype & Gst.StreamType.AUDIO:
+                    self.audio_combo.append(sid, label)
+                elif stype & Gst.StreamType.TEXT:
+                    self.text_combo.append(sid, label)
+            for sid in self.selected:
+                stype = self.stream_type(sid)
+                if stype & Gst.StreamType.AUDIO:
+                    self.audio_combo.set_active_id(sid)
+                elif stype & Gst.StreamType.TEXT:
+                    self.text_combo.set_active_id(sid)
+        else:
+            for i in range(self.playbin.get_property("n-audio")):
+                tags = self.playbin.emit("get-audio-tags", i)
+                self.audio_combo.append(str(i), self.stream_label(tags, i))
+            for i in range(self.playbin.get_property("n-text")):
+                tags = self.playbin.emit("get-text-tags", i)
+                self.text_combo.append(str(i), self.stream_label(tags, i))
+            self.audio_combo.set_active_id(
+                str(self.playbin.get_property("current-audio")))
+            self.text_combo.set_active_id(
+                str(self.playbin.get_property("current-text")))
+
+        if self.text_combo.get_active_id() is None:
+            self.text_combo.set_active_id("off")
+
+        self.audio_combo.handler_unblock(self.audio_signal_id)
+        self.text_combo.handler_unblock(self.text_signal_id)
+
+    def stream_label(self, tags, index):
+        language = None
+        if tags:
+            ret, language = tags.get_string(Gst.TAG_LANGUAGE_CODE)
+        return "{0}: {1}".format(index, language or "unknown")
+
+    # writes the streams of a playbin3 stream collection to the text widget
+    def analyze_collection(self):
+        buffer = self.streams_list.get_buffer()
+        buffer.set_text("")
+
+        for i in range(self.collection.get_size()):
+            stream = self.collection.get_stream(i)
+            tags = stream.get_tags()
+            buffer.insert_at_cursor("{0} stream {1}\n".format(
+                Gst.stream_type_get_name(stream.get_stream_type()), i))
+            if not tags:
+                continue
+
+            for tag, label in ((Gst.TAG_VIDEO_CODEC, "codec"),
+                               (Gst.TAG_AUDIO_CODEC, "codec"),
+                               (Gst.TAG_LANGUAGE_CODE, "language")):
+                ret, str = tags.get_string(tag)
+                if ret:
+                    buffer.insert_at_cursor("  {0}: {1}\n".format(label, str))
+
     # extract metadata from all the streams and write it to the text widget
     # in the GUI
     def analyze_streams(self):
+        if self.use_playbin3:
+            if self.collection:
+                self.analyze_collection()
+                self.update_track_combos()
+            return
+
         # clear current contents of the widget
         buffer = self.streams_list.get_buffer()
         buffer.set_text("")
@@ -304,6 +664,8 @@ class Player(object):
                         "  language: {0}\n".format(
                             str or "unknown"))
 
+        self.update_track_combos()
+
     # this function is called when an "application" message is posted on the bus
     # here we retrieve the message posted by the on_tags_changed callback
     def on_application_message(self, bus, msg):
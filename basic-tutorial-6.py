@@ -5,6 +5,9 @@ import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
 
+from busfilter import AGGREGATE, DROP, PASS, BusFilter, Rule
+from eventlog import EventLog
+
 # http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+6%3A+Media+formats+and+Pad+Capabilities
 
 # the functions below print the capabilities in a human-friendly format
@@ -69,14 +72,17 @@ def print_pad_templates_information(factory):
 
         print("")
 
-# shows the current capabilities of the requested pad in the given element
+# shows the current capabilities of the requested pad in the given element.
+# this runs from the bus loop, so the caps go to the event log instead of
+# being printed field by field
 
 
-def print_pad_capabilities(element, pad_name):
+def print_pad_capabilities(element, pad_name, log):
     # retrieve pad
     pad = element.get_static_pad(pad_name)
     if not pad:
-        print("ERROR: Could not retrieve pad '{0:s}'".format(pad_name))
+        log.error(element.get_name(),
+                  "Could not retrieve pad '{0:s}'".format(pad_name))
         return
 
     # retrieve negotiated caps (or acceptable caps if negotiation is not
@@ -85,9 +91,8 @@ def print_pad_capabilities(element, pad_name):
     if not caps:
         caps = pad.get_allowed_caps()
 
-    # print
-    print("Caps for the {0:s} pad:".format(pad_name))
-    print_caps(caps, "      ")
+    log.event("caps", element.get_name(), "Caps for the {0:s} pad: {1}".format(
+        pad_name, caps.to_string() if caps else "NONE"))
 
 
 def main():
@@ -121,9 +126,23 @@ def main():
         print("ERROR: Could not link source to sink")
         return -1
 
+    log = EventLog()
+    log.start()
+
+    # only let the messages the loop below looks at reach the bus. the
+    # state changes of the source and sink are dropped on the thread that
+    # posts them
+    bus_filter = BusFilter([
+        Rule(PASS, types=Gst.MessageType.ERROR | Gst.MessageType.EOS),
+        Rule(PASS, types=Gst.MessageType.STATE_CHANGED,
+             sources=[pipeline.get_name()]),
+        Rule(AGGREGATE, types=Gst.MessageType.STATE_CHANGED),
+    ], default=DROP)
+    bus_filter.install(pipeline)
+
     # print initial negotiated caps (in NULL state)
-    print("In NULL state:")
-    print_pad_capabilities(sink, "sink")
+    log.event("state", pipeline.get_name(), "In NULL state:")
+    print_pad_capabilities(sink, "sink", log)
 
     # start playing
     ret = pipeline.set_state(Gst.State.PLAYING)
@@ -143,30 +162,30 @@ def main():
                 t = msg.type
                 if t == Gst.MessageType.ERROR:
                     err, dbg = msg.parse_error()
-                    print("ERROR:", msg.src.get_name(), ":", err.message)
-                    if dbg:
-                        print("Debug information:", dbg)
+                    log.error(msg.src.get_name(), "{0} ({1})".format(
+                        err.message, dbg or "no debug information"))
                     terminate = True
                 elif t == Gst.MessageType.EOS:
-                    print("End-Of-Stream reached")
+                    log.event("eos", msg.src.get_name(),
+                              "End-Of-Stream reached")
                     terminate = True
                 elif t == Gst.MessageType.STATE_CHANGED:
                     # we are only interested in state-changed messages from the
                     # pieline
                     if msg.src == pipeline:
                         old, new, pending = msg.parse_state_changed()
-                        print(
-                            "Pipeline state changed from",
-                            Gst.Element.state_get_name(old),
-                            "to",
-                            Gst.Element.state_get_name(new),
-                            ":")
+                        log.event(
+                            "state-changed", msg.src.get_name(),
+                            "Pipeline state changed from {0} to {1}:".format(
+                                Gst.Element.state_get_name(old),
+                                Gst.Element.state_get_name(new)))
 
                         # print the current capabilities of the sink
-                        print_pad_capabilities(sink, "sink")
+                        print_pad_capabilities(sink, "sink", log)
                 else:
                     # should not get here
-                    print("ERROR: unexpected message received")
+                    log.error(msg.src.get_name(),
+                              "unexpected message received")
         except KeyboardInterrupt:
             terminate = True
 
@@ -174,6 +193,8 @@ def main():
             break
 
     pipeline.set_state(Gst.State.NULL)
+    log.event("bus", pipeline.get_name(), bus_filter.summary())
+    log.stop()
 
 if __name__ == '__main__':
     main()
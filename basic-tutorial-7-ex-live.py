@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+import threading
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from helper import add_probe, connect, percentile
+from taskpool import PipelineFactory, make_pool
+
+# the pipeline of basic tutorial 7 with a live source, for interactive
+# monitoring: the source produces small buffers in real time, the queues of
+# the tee branches hold at most a few of them and drop the oldest when a
+# branch falls behind, and the pipeline latency can be set explicitly instead
+# of taking the latency the elements report.
+#
+# while playing, the time every buffer spends between leaving the source and
+# reaching each queue and each sink is measured. a live source timestamps
+# buffers with the running time at which their capture started, so "running
+# time now minus the running time of the buffer" at any pad is the latency
+# accumulated up to that pad. the sinks render a buffer at its running time
+# plus the pipeline latency, buffers reaching the sink later than that are
+# late.
+#
+# with --pool-size the streaming threads come from a shared, bounded pool
+# (see taskpool.py) instead of one new thread per task.
+#
+# usage: basic-tutorial-7-ex-live.py [--latency MS] [--buffer MS]
+#                                    [--queue-buffers N] [--duration S] [--fake]
+#                                    [--pool-size N]
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+7%3A+Multithreading+and+Pad+Availability
+
+RATE = 44100
+
+
+class LatencyProbe(object):
+
+    def __init__(self, name, pad, keep=10000):
+        self.name = name
+        self.keep = keep
+        self.samples = []
+        self.lock = threading.Lock()
+        add_probe(pad, Gst.PadProbeType.BUFFER, self.on_buffer)
+
+    # called from a streaming thread for every buffer
+    def on_buffer(self, pad, info):
+        buffer = info.get_buffer()
+        element = pad.get_parent_element()
+        clock = element.get_clock() if element else None
+        event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if not clock or not event or buffer.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+
+        segment = event.parse_segment()
+        running_time = segment.to_running_time(Gst.Format.TIME, buffer.pts)
+        now = clock.get_time() - element.get_base_time()
+        with self.lock:
+            self.samples.append(now - running_time)
+            if len(self.samples) > self.keep:
+                del self.samples[:len(self.samples) - self.keep]
+        return Gst.PadProbeReturn.OK
+
+    def take(self):
+        with self.lock:
+            samples, self.samples = self.samples, []
+        return samples
+
+
+class LivePipeline(object):
+
+    def __init__(self, latency=None, buffer_ms=10, queue_buffers=2, fake=False,
+                 factory=None):
+        self.latency = latency
+        self.overruns = {}
+        self.factory = factory
+
+        # create the elements
+        self.pipeline = Gst.Pipeline.new("live-pipeline")
+        if factory:
+            factory.adopt(self.pipeline)
+        self.source = Gst.ElementFactory.make("audiotestsrc", "audio_source")
+        self.tee = Gst.ElementFactory.make("tee", "tee")
+        if not self.pipeline or not self.source or not self.tee:
+            print("ERROR: Not all elements could be created.")
+            sys.exit(1)
+
+        # produce buffers in real time, each buffer_ms long
+        self.source.set_property("is-live", True)
+        self.source.set_property("freq", 215.0)
+        self.source.set_property("samplesperbuffer",
+                                 max(1, RATE * buffer_ms // 1000))
+        caps = Gst.ElementFactory.make("capsfilter", "audio_caps")
+        caps.set_property("caps", Gst.Caps.from_string(
+            "audio/x-raw,rate={0}".format(RATE)))
+        self.pipeline.add(self.source, caps, self.tee)
+        if not self.source.link(caps) or not caps.link(self.tee):
+            print("ERROR: Elements could not be linked")
+            sys.exit(1)
+
+        if fake:
+            audio_sink = "fakesink sync=true"
+            video_sink = "fakesink sync=true"
+        else:
+            audio_sink = "autoaudiosink"
+            video_sink = "autovideosink"
+        self.branches = {
+            "audio": self.add_branch(
+                "audio", "audioconvert ! audioresample ! " + audio_sink,
+                queue_buffers),
+            "video": self.add_branch(
+                "video", "wavescope shader=0 style=1 ! videoconvert ! " + video_sink,
+                queue_buffers),
+        }
+
+        self.probes = [LatencyProbe("source", self.source.get_static_pad("src"))]
+        for name, (queue, sink) in sorted(self.branches.items()):
+            self.probes.append(LatencyProbe(
+                name + " queue", queue.get_static_pad("src")))
+            self.probes.append(LatencyProbe(
+                name + " sink", sink.get_static_pad("sink")))
+
+        if latency is not None:
+            self.pipeline.set_latency(latency)
+
+    # a leaky queue holding at most a few buffers followed by the branch
+    def add_branch(self, name, description, queue_buffers):
+        queue = Gst.ElementFactory.make("queue", name + "_queue")
+        queue.set_property("max-size-buffers", queue_buffers)
+        queue.set_property("max-size-bytes", 0)
+        queue.set_property("max-size-time", 0)
+        # drop the oldest buffer instead of blocking the tee
+        queue.set_property("leaky", 2)
+        self.overruns[name] = 0
+        connect(queue, "overrun", self.on_overrun, name)
+
+        branch = Gst.parse_bin_from_description(description, True)
+        branch.set_name(name + "_branch")
+        self.pipeline.add(queue, branch)
+        if not queue.link(branch) or not self.tee.link(queue):
+            print("ERROR: The {0} branch could not be linked".format(name))
+            sys.exit(1)
+
+        # the sink: iterate_sorted() hands out sinks first, it is the first
+        # element of the sorted branch although it is the last one linked
+        sink = None
+        for element in branch.iterate_sorted():
+            sink = element
+            break
+        return queue, sink
+
+    # called from a streaming thread when a queue is full and drops a buffer
+    def on_overrun(self, queue, name):
+        self.overruns[name] += 1
+
+    # the latency of an element changed, distribute the new latency
+    def on_latency(self):
+        if self.latency is None:
+            self.pipeline.recalculate_latency()
+
+    def query_latency(self):
+        query = Gst.Query.new_latency()
+        if not self.pipeline.query(query):
+            return None
+        return query.parse_latency()
+
+    def report(self):
+        # buffers reaching a sink later than this are rendered late
+        budget = self.pipeline.get_latency()
+        result = self.query_latency()
+        if result:
+            live, min_latency, max_latency = result
+            print("latency query: live {0}, min {1:.1f} ms, max {2}".format(
+                live, min_latency / Gst.MSECOND,
+                "none" if max_latency == Gst.CLOCK_TIME_NONE
+                else "{0:.1f} ms".format(max_latency / Gst.MSECOND)))
+            if budget == Gst.CLOCK_TIME_NONE:
+                budget = min_latency
+        if budget != Gst.CLOCK_TIME_NONE:
+            print("pipeline latency: {0:.1f} ms".format(budget / Gst.MSECOND))
+
+        print("{0:14s} {1:>7s} {2:>8s} {3:>8s} {4:>8s} {5:>8s} {6:>6s}".format(
+            "pad", "buffers", "p50 ms", "p95 ms", "p99 ms", "max ms", "late"))
+        for probe in self.probes:
+            samples = probe.take()
+            if not samples:
+                continue
+            late = 0
+            if probe.name.endswith("sink") and budget != Gst.CLOCK_TIME_NONE:
+                late = sum(1 for s in samples if s > budget)
+            print("{0:14s} {1:7d} {2:8.2f} {3:8.2f} {4:8.2f} {5:8.2f} {6:6d}".format(
+                probe.name, len(samples),
+                percentile(samples, 50) / Gst.MSECOND,
+                percentile(samples, 95) / Gst.MSECOND,
+                percentile(samples, 99) / Gst.MSECOND,
+                max(samples) / Gst.MSECOND, late))
+        print("queue overruns: " + ", ".join(
+            "{0} {1}".format(k, v) for k, v in sorted(self.overruns.items())))
+
+    def run(self, duration=None, interval=5.0):
+        ret = self.pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            print("ERROR: Unable to set the pipeline to the playing state")
+            sys.exit(1)
+
+        start = time.monotonic()
+        last_report = start
+        bus = self.pipeline.get_bus()
+        while True:
+            try:
+                msg = bus.timed_pop_filtered(
+                    0.1 * Gst.SECOND,
+                    Gst.MessageType.ERROR | Gst.MessageType.EOS
+                    | Gst.MessageType.LATENCY)
+                if msg and msg.type == Gst.MessageType.LATENCY:
+                    self.on_latency()
+                elif msg:
+                    if msg.type == Gst.MessageType.ERROR:
+                        err, dbg = msg.parse_error()
+                        print("ERROR:", msg.src.get_name(), ":", err.message)
+                    break
+
+                now = time.monotonic()
+                if now - last_report >= interval:
+                    self.report()
+                    last_report = now
+                if duration and now - start >= duration:
+                    break
+            except KeyboardInterrupt:
+                break
+
+        self.report()
+        self.pipeline.set_state(Gst.State.NULL)
+        if self.factory:
+            print(self.factory.summary())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Low-latency live tee pipeline with latency measurement")
+    parser.add_argument("--latency", type=float,
+                        help="pipeline latency in ms (default: as reported)")
+    parser.add_argument("--buffer", type=int, default=10,
+                        help="duration of the source buffers in ms")
+    parser.add_argument("--queue-buffers", type=int, default=2,
+                        help="buffers the branch queues hold at most")
+    parser.add_argument("--duration", type=float, help="stop after S seconds")
+    parser.add_argument("--fake", action="store_true",
+                        help="use fakesinks instead of audio and video output")
+    parser.add_argument("--pool-size", type=int,
+                        help="run the streaming threads on a shared pool")
+    args = parser.parse_args()
+
+    # initialize GStreamer
+    Gst.init(None)
+
+    latency = None
+    if args.latency is not None:
+        latency = int(args.latency * Gst.MSECOND)
+    factory = None
+    if args.pool_size:
+        factory = PipelineFactory(make_pool(args.pool_size))
+    pipeline = LivePipeline(latency, args.buffer, args.queue_buffers, args.fake,
+                            factory)
+    pipeline.run(args.duration)
+
+if __name__ == '__main__':
+    main()
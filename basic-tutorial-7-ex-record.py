@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from recording import Recorder
+from taskpool import PipelineFactory, make_pool
+
+# the pipeline of basic tutorial 7 with a live source and a third, rolling
+# recording branch on the tee. the recording is written in segments of
+# --segment seconds, and the oldest segments are deleted to stay within
+# --budget megabytes. with --toggle the branch is detached and attached again
+# every few seconds while the audio and video branches keep playing. with
+# --pool-size the streaming threads, including those of every attached
+# recording branch, come from a shared pool (see taskpool.py).
+#
+# usage: basic-tutorial-7-ex-record.py [--dir DIR] [--segment S]
+#                                      [--budget MB] [--toggle S] [--duration S]
+#                                      [--pool-size N]
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+7%3A+Multithreading+and+Pad+Availability
+
+
+def print_stats(recorder):
+    stats = recorder.stats()
+    text = "{0} segments, {1:.1f} of {2:.1f} MiB ({3:.1f} MiB reserved), {4} deleted, {5} dropped".format(
+        stats["segments"], stats["bytes"] / 1048576.0,
+        stats["budget"] / 1048576.0, stats["reserved"] / 1048576.0,
+        stats["deleted"], stats["dropped"])
+    if stats["latency-p50"] is not None:
+        text += ", write latency p50 {0:.1f} ms p99 {1:.1f} ms max {2:.1f} ms".format(
+            stats["latency-p50"] * 1e3, stats["latency-p99"] * 1e3,
+            stats["latency-max"] * 1e3)
+    print(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rolling recording off a tee")
+    parser.add_argument("--dir", default="recordings")
+    parser.add_argument("--segment", type=float, default=10.0,
+                        help="segment duration in seconds")
+    parser.add_argument("--budget", type=float, default=16.0,
+                        help="disk budget in MiB")
+    parser.add_argument("--toggle", type=float,
+                        help="detach and attach the recording every S seconds")
+    parser.add_argument("--duration", type=float, help="stop after S seconds")
+    parser.add_argument("--pool-size", type=int,
+                        help="run the streaming threads on a shared pool")
+    args = parser.parse_args()
+
+    # initialize GStreamer
+    Gst.init(None)
+
+    # create the elements
+    audio_source = Gst.ElementFactory.make("audiotestsrc", "audio_source")
+    tee = Gst.ElementFactory.make("tee", "tee")
+    audio_queue = Gst.ElementFactory.make("queue", "audio_queue")
+    audio_convert = Gst.ElementFactory.make("audioconvert", "audio_convert")
+    audio_resample = Gst.ElementFactory.make("audioresample", "audio_resample")
+    audio_sink = Gst.ElementFactory.make("autoaudiosink", "audio_sink")
+    video_queue = Gst.ElementFactory.make("queue", "video_queue")
+    visual = Gst.ElementFactory.make("wavescope", "visual")
+    video_convert = Gst.ElementFactory.make("videoconvert", "video_convert")
+    video_sink = Gst.ElementFactory.make("autovideosink", "video_sink")
+
+    # create the empty pipeline
+    pipeline = Gst.Pipeline.new("test-pipeline")
+    factory = None
+    if pipeline and args.pool_size:
+        factory = PipelineFactory(make_pool(args.pool_size))
+        factory.adopt(pipeline)
+
+    if (not pipeline or not audio_source or not tee or not audio_queue
+            or not audio_convert or not audio_resample or not audio_sink
+            or not video_queue or not visual or not video_convert
+            or not video_sink):
+        print("ERROR: Not all elements could be created.")
+        sys.exit(1)
+
+    # configure elements. the recording needs timestamps of a live source
+    audio_source.set_property("is-live", True)
+    audio_source.set_property("freq", 215.0)
+    visual.set_property("shader", 0)
+    visual.set_property("style", 1)
+
+    pipeline.add(audio_source, tee, audio_queue, audio_convert, audio_resample,
+                 audio_sink, video_queue, visual, video_convert, video_sink)
+
+    ret = audio_source.link(tee)
+    ret = ret and audio_queue.link(audio_convert)
+    ret = ret and audio_convert.link(audio_resample)
+    ret = ret and audio_resample.link(audio_sink)
+    ret = ret and video_queue.link(visual)
+    ret = ret and visual.link(video_convert)
+    ret = ret and video_convert.link(video_sink)
+    ret = ret and tee.link(audio_queue)
+    ret = ret and tee.link(video_queue)
+
+    if not ret:
+        print("ERROR: Elements could not be linked")
+        sys.exit(1)
+
+    recorder = Recorder(
+        pipeline, tee, args.dir,
+        "audioconvert ! audioresample ! opusenc",
+        segment_duration=args.segment, budget=int(args.budget * 1048576))
+
+    # start playing, then attach the recording to the running pipeline
+    pipeline.set_state(Gst.State.PLAYING)
+    recorder.attach()
+
+    start = time.monotonic()
+    last_toggle = last_stats = start
+    stopping = None
+    bus = pipeline.get_bus()
+    while True:
+        try:
+            msg = bus.timed_pop_filtered(
+                0.1 * Gst.SECOND,
+                Gst.MessageType.ERROR | Gst.MessageType.EOS
+                | Gst.MessageType.ELEMENT)
+            if msg and msg.type == Gst.MessageType.ELEMENT:
+                recorder.handle_message(msg)
+            elif msg:
+                if msg.type == Gst.MessageType.ERROR:
+                    err, dbg = msg.parse_error()
+                    print("ERROR:", msg.src.get_name(), ":", err.message)
+                break
+
+            now = time.monotonic()
+            if args.toggle and not stopping and now - last_toggle >= args.toggle:
+                if recorder.is_attached():
+                    recorder.detach()
+                else:
+                    recorder.attach()
+                last_toggle = now
+            if now - last_stats >= 5.0:
+                # the open segment may grow beyond what was reserved for it
+                recorder.enforce_budget()
+                print_stats(recorder)
+                last_stats = now
+            if args.duration and now - start >= args.duration and not stopping:
+                stopping = now
+        except KeyboardInterrupt:
+            stopping = stopping or time.monotonic()
+
+        # finish the current segment before shutting down, but do not wait
+        # forever for it. when giving up, the unfinished segment is still
+        # counted against the budget
+        if stopping:
+            if not recorder.is_attached():
+                break
+            if time.monotonic() - stopping > 5.0:
+                print("Gave up waiting for the last segment")
+                recorder.remove()
+                break
+            recorder.detach()
+
+    print_stats(recorder)
+    pipeline.set_state(Gst.State.NULL)
+    if factory:
+        print(factory.summary())
+
+if __name__ == '__main__':
+    main()
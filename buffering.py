@@ -0,0 +1,185 @@
+# pauses network playback while the buffers refill.
+#
+# the controller is fed the BUFFERING messages from the bus. when the fill
+# level drops below the low watermark the pipeline is paused, and when it
+# reaches the high watermark the pipeline goes back to the state the
+# application asked for. the download rate reported in the buffering stats is
+# used to size the buffers: a rebuffer grows the buffered duration, a long
+# stall-free stretch shrinks it again.
+#
+# live pipelines are never paused, buffering makes no sense for them.
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+12%3A+Streaming
+
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from helper import connect
+
+
+class BufferingController(object):
+
+    def __init__(self, pipeline, low_percent=10, high_percent=100,
+                 duration=2.0, min_duration=1.0, max_duration=30.0,
+                 shrink_after=60.0, log=None):
+        self.pipeline = pipeline
+        self.low_percent = low_percent
+        self.high_percent = high_percent
+        # seconds of media to buffer, adapted at runtime
+        self.duration = duration
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        # seconds without a stall before the buffer is shrunk again
+        self.shrink_after = shrink_after
+        self.log = log
+
+        # the state the application wants the pipeline to be in
+        self.target_state = Gst.State.NULL
+        self.is_live = False
+        self.buffering = False
+        self.percent = 100
+        # estimated download rate in bytes per second
+        self.rate = None
+
+        self.rebuffers = 0
+        self.stall_time = 0.0
+        self.stall_start = None
+        self.playing_since = None
+        self.queues = []
+
+        # the download queues are created when the media is opened, and
+        # removed when it is closed or replaced
+        connect(pipeline, "deep-element-added", self.on_deep_element_added)
+        connect(pipeline, "deep-element-removed", self.on_deep_element_removed)
+
+    def report(self, text):
+        if self.log:
+            self.log.event("buffering", self.pipeline.get_name(), text)
+        else:
+            print(text)
+
+    # use instead of pipeline.set_state(), so a request to play while we
+    # are buffering is deferred until the buffers are full
+    def set_state(self, state):
+        self.target_state = state
+        if state == Gst.State.PLAYING and self.buffering:
+            state = Gst.State.PAUSED
+        elif state < Gst.State.PAUSED:
+            # the fill after the next start is not a rebuffer either
+            self.buffering = False
+            self.stall_start = None
+            self.playing_since = None
+
+        ret = self.pipeline.set_state(state)
+        if ret == Gst.StateChangeReturn.NO_PREROLL:
+            self.is_live = True
+        return ret
+
+    # call after a flushing seek: the buffers are refilled from the new
+    # position, which is not a rebuffer and must not grow the buffers
+    def seeked(self):
+        self.playing_since = None
+
+    def handle_message(self, msg):
+        if msg.type != Gst.MessageType.BUFFERING or self.is_live:
+            return
+
+        self.percent = msg.parse_buffering()
+        mode, avg_in, avg_out, left = msg.parse_buffering_stats()
+        if avg_in > 0:
+            # smooth the rate, a single reading is very noisy
+            if self.rate is None:
+                self.rate = float(avg_in)
+            else:
+                self.rate = 0.8 * self.rate + 0.2 * avg_in
+
+        if not self.buffering and self.percent < self.low_percent:
+            self.start_buffering()
+        elif self.buffering and self.percent >= self.high_percent:
+            self.stop_buffering()
+        elif not self.buffering:
+            # the first fill may never have gone below the low watermark
+            if self.playing_since is None and self.percent >= self.high_percent:
+                self.playing_since = time.monotonic()
+            self.maybe_shrink()
+
+    def start_buffering(self):
+        self.buffering = True
+        self.stall_start = time.monotonic()
+
+        # the first fill after opening the media is not a rebuffer
+        if self.playing_since is not None:
+            self.rebuffers += 1
+            self.duration = min(self.duration * 1.5, self.max_duration)
+            self.adapt()
+
+        if self.target_state == Gst.State.PLAYING:
+            self.pipeline.set_state(Gst.State.PAUSED)
+        self.report("Buffering started at {0}%".format(self.percent))
+
+    def stop_buffering(self):
+        self.buffering = False
+        stalled = time.monotonic() - self.stall_start
+        if self.playing_since is not None:
+            self.stall_time += stalled
+        self.stall_start = None
+        self.playing_since = time.monotonic()
+
+        if self.target_state == Gst.State.PLAYING:
+            self.pipeline.set_state(Gst.State.PLAYING)
+        self.report("Buffering done after {0:.2f}s".format(stalled))
+
+    def maybe_shrink(self):
+        if self.playing_since is None or self.duration <= self.min_duration:
+            return
+
+        if time.monotonic() - self.playing_since > self.shrink_after:
+            self.duration = max(self.duration / 1.5, self.min_duration)
+            self.playing_since = time.monotonic()
+            self.adapt()
+
+    # applies the buffered duration, and the matching size at the observed
+    # download rate, to the pipeline and its download queues
+    def adapt(self):
+        duration = int(self.duration * Gst.SECOND)
+        size = int(self.rate * self.duration) if self.rate else -1
+
+        for element in [self.pipeline] + self.queues:
+            if element.find_property("buffer-duration"):
+                element.set_property("buffer-duration", duration)
+                if size > 0:
+                    element.set_property("buffer-size", size)
+            elif element.find_property("max-size-time"):
+                element.set_property("max-size-time", duration)
+                if size > 0:
+                    element.set_property("max-size-bytes", size)
+
+        self.report("Buffering {0:.1f}s ({1} bytes at {2} bytes/s)".format(
+            self.duration, size, int(self.rate or 0)))
+
+    # called from a streaming thread
+    def on_deep_element_added(self, bin, sub_bin, element):
+        factory = element.get_factory()
+        if factory and factory.get_name() == "queue2":
+            self.queues.append(element)
+
+    # called from the thread removing the element
+    def on_deep_element_removed(self, bin, sub_bin, element):
+        if element in self.queues:
+            self.queues.remove(element)
+
+    def stats(self):
+        stall_time = self.stall_time
+        if self.buffering and self.stall_start and self.playing_since:
+            stall_time += time.monotonic() - self.stall_start
+
+        return {
+            "rebuffers": self.rebuffers,
+            "stall-time": stall_time,
+            "percent": self.percent,
+            "rate": self.rate,
+            "duration": self.duration,
+            "live": self.is_live,
+        }
@@ -0,0 +1,132 @@
+# filters bus messages on the thread that posts them, before they are queued.
+#
+# every message a pipeline posts is queued on its bus, wakes up the thread
+# waiting on the bus and is marshalled into Python there, only for most of
+# them to be thrown away by the application: in a large pipeline the bulk of
+# the bus traffic is the state changes of all the child elements, while the
+# applications only look at those of the pipeline itself.
+#
+# a bus sync handler sees every message synchronously from the posting
+# thread and can drop it right there. the filter applies a list of rules,
+# the first rule matching a message (by type, source element name and
+# structure name) decides:
+#
+#   PASS       queue the message on the bus as usual
+#   DROP       discard it
+#   AGGREGATE  discard it, but count it and keep the latest message of its
+#              type and source, which can be looked up with latest()
+#
+# other sync handlers (like the one of taskpool.py) can be run first, a
+# handler returning DROP takes the message out before the rules see it.
+
+import fnmatch
+import threading
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+PASS = "pass"
+DROP = "drop"
+AGGREGATE = "aggregate"
+
+
+class Rule(object):
+
+    # types is a combination of Gst.MessageType flags, sources and
+    # except_sources are lists of element name patterns and structures a
+    # list of structure name patterns. a criterion that is not given matches
+    # everything
+    def __init__(self, action, types=None, sources=None, except_sources=None,
+                 structures=None):
+        self.action = action
+        self.types = types
+        self.sources = sources
+        self.except_sources = except_sources
+        self.structures = structures
+
+    def matches(self, msg, source, structure):
+        if self.types is not None and not msg.type & self.types:
+            return False
+        if self.sources is not None and not any(
+                fnmatch.fnmatchcase(source, p) for p in self.sources):
+            return False
+        if self.except_sources is not None and any(
+                fnmatch.fnmatchcase(source, p) for p in self.except_sources):
+            return False
+        if self.structures is not None and not any(
+                fnmatch.fnmatchcase(structure, p) for p in self.structures):
+            return False
+        return True
+
+
+class BusFilter(object):
+
+    def __init__(self, rules, default=PASS, handlers=()):
+        self.rules = list(rules)
+        self.default = default
+        # sync handlers to run before the rules
+        self.handlers = list(handlers)
+
+        self.lock = threading.Lock()
+        # per message type name: [posted, delivered]
+        self.counters = {}
+        # (type name, source name): [count, latest message]
+        self.aggregated = {}
+
+    def install(self, pipeline):
+        pipeline.get_bus().set_sync_handler(self.handle_sync_message)
+
+    # called from the thread posting the message
+    def handle_sync_message(self, bus, msg):
+        for handler in self.handlers:
+            if handler(bus, msg) == Gst.BusSyncReply.DROP:
+                return self.count(msg, False)
+
+        source = msg.src.get_name() if msg.src else ""
+        s = msg.get_structure()
+        structure = s.get_name() if s else ""
+
+        action = self.default
+        for rule in self.rules:
+            if rule.matches(msg, source, structure):
+                action = rule.action
+                break
+
+        if action == AGGREGATE:
+            key = (Gst.message_type_get_name(msg.type), source)
+            with self.lock:
+                entry = self.aggregated.setdefault(key, [0, None])
+                entry[0] += 1
+                entry[1] = msg
+        return self.count(msg, action == PASS)
+
+    def count(self, msg, delivered):
+        name = Gst.message_type_get_name(msg.type)
+        with self.lock:
+            counters = self.counters.setdefault(name, [0, 0])
+            counters[0] += 1
+            if delivered:
+                counters[1] += 1
+        return Gst.BusSyncReply.PASS if delivered else Gst.BusSyncReply.DROP
+
+    # the latest aggregated message of this type (a Gst.MessageType) from
+    # the element with this name, or None
+    def latest(self, type, source):
+        with self.lock:
+            entry = self.aggregated.get(
+                (Gst.message_type_get_name(type), source))
+        return entry[1] if entry else None
+
+    # {type name: (posted, delivered)}
+    def stats(self):
+        with self.lock:
+            return dict((k, tuple(v)) for k, v in self.counters.items())
+
+    def summary(self):
+        stats = self.stats()
+        posted = sum(v[0] for v in stats.values())
+        delivered = sum(v[1] for v in stats.values())
+        return "{0} messages posted, {1} delivered ({2})".format(
+            posted, delivered, ", ".join(
+                "{0} {1}/{2}".format(k, v[1], v[0])
+                for k, v in sorted(stats.items())))
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+# an on-disk cache for media played over HTTP.
+#
+# the first play of a URI uses progressive download: playbin's DOWNLOAD flag
+# (or uridecodebin's "download" property) makes queue2 keep the stream in a
+# temporary file, which we place inside the cache directory. when the whole
+# stream has been downloaded the file is stored under the hash of its
+# contents. later plays of the same URI are redirected to the cached file.
+# the least recently used files are evicted to keep the cache under its size
+# limit.
+#
+#   ./cache.py play URI          play a URI through the cache
+#   ./cache.py stats             show what is in the cache
+#   ./cache.py selftest FILE     serve FILE over a local HTTP server and
+#                                check the second play is a cache hit
+#
+# http://docs.gstreamer.com/display/GstSDK/Playback+tutorial+4%3A+Progressive+streaming
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from helper import connect
+
+DEFAULT_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "gst-tutorial-media")
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+# GST_PLAY_FLAG_DOWNLOAD, playbin's flags type is not introspectable
+PLAY_FLAG_DOWNLOAD = 1 << 7
+
+# seconds a partial download must have been left untouched before it is
+# considered abandoned. a download of another process sharing the cache
+# keeps writing to its file
+STALE_PARTIAL_AGE = 60
+
+
+class DownloadCache(object):
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.index_path = os.path.join(directory, "index.json")
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        # uri -> {"hash": content hash, "size": bytes, "atime": last use}
+        self.index = {}
+        self.load_index()
+        self.remove_stale_partials()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.bytes_served = 0
+
+        # the queue2 elements downloading for us, with the URI they download
+        self.downloads = []
+        self.lock = threading.Lock()
+
+    def load_index(self):
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def save_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, self.index_path)
+
+    # removes the temporary files of downloads that were never committed,
+    # left behind when a player crashed or was killed
+    def remove_stale_partials(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.startswith("partial-"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > STALE_PARTIAL_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    # returns the path of the cached copy of uri, or None
+    def lookup(self, uri):
+        entry = self.index.get(uri)
+        if not entry or not os.path.exists(self.blob_path(entry["hash"])):
+            return None
+
+        entry["atime"] = time.time()
+        self.save_index()
+        return self.blob_path(entry["hash"])
+
+    # returns the URI to play: a file URI on a hit, uri itself on a miss
+    def resolve(self, uri):
+        path = self.lookup(uri)
+        if path:
+            self.hits += 1
+            self.bytes_served += os.path.getsize(path)
+            return Gst.filename_to_uri(path)
+
+        self.misses += 1
+        return uri
+
+    # prepares playbin or uridecodebin to download uri into the cache.
+    # returns the URI the element should play
+    def attach(self, element, uri):
+        # only HTTP is cached, other URIs are neither hits nor misses
+        if not uri.startswith(("http://", "https://")):
+            return uri
+
+        resolved = self.resolve(uri)
+        if resolved != uri:
+            return resolved
+
+        factory = element.get_factory().get_name()
+        if factory.startswith("playbin"):
+            flags = element.get_property("flags")
+            element.set_property("flags", flags | PLAY_FLAG_DOWNLOAD)
+        else:
+            element.set_property("download", True)
+
+        connect(element, "deep-element-added", self.on_deep_element_added, uri)
+        return uri
+
+    # called from a streaming thread when the download queue is created
+    def on_deep_element_added(self, bin, sub_bin, element, uri):
+        factory = element.get_factory()
+        if not factory or factory.get_name() != "queue2":
+            return
+
+        element.set_property(
+            "temp-template", os.path.join(self.directory, "partial-XXXXXX"))
+        element.set_property("temp-remove", False)
+        with self.lock:
+            self.downloads.append((element, uri))
+
+    # moves completed downloads into the cache. must be called before the
+    # pipeline goes to NULL, as long as the download queues can still be
+    # queried. complete tells whether the media was played to the end
+    # without seeking, otherwise the temporary files may have holes
+    def commit(self, complete):
+        with self.lock:
+            downloads, self.downloads = self.downloads, []
+
+        for queue, uri in downloads:
+            location = queue.get_property("temp-location")
+            if not location or not os.path.exists(location):
+                continue
+
+            ok, total = queue.get_static_pad("sink").peer_query_duration(
+                Gst.Format.BYTES)
+            if complete and ok and total > 0 and os.path.getsize(location) == total:
+                self.store(uri, location)
+            else:
+                os.remove(location)
+
+    # stores a downloaded file under the hash of its contents
+    def store(self, uri, path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            # same content under another URI, keep a single copy
+            os.remove(path)
+        else:
+            shutil.move(path, blob)
+
+        self.index[uri] = {
+            "hash": digest,
+            "size": os.path.getsize(blob),
+            "atime": time.time(),
+        }
+        self.stores += 1
+        self.evict()
+        self.save_index()
+
+    def total_size(self):
+        blobs = dict((e["hash"], e["size"]) for e in self.index.values())
+        return sum(blobs.values())
+
+    # removes the least recently used files until the cache fits its limit
+    def evict(self):
+        # a file is as recent as the most recent URI using it
+        atimes = {}
+        for entry in self.index.values():
+            atimes[entry["hash"]] = max(
+                atimes.get(entry["hash"], 0), entry["atime"])
+
+        for digest in sorted(atimes, key=atimes.get):
+            if self.total_size() <= self.max_size:
+                break
+
+            for uri in [u for u, e in self.index.items() if e["hash"] == digest]:
+                del self.index[uri]
+            try:
+                os.remove(self.blob_path(digest))
+            except OSError:
+                pass
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit-ratio": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "bytes-served": self.bytes_served,
+            "entries": len(self.index),
+            "size": self.total_size(),
+            "max-size": self.max_size,
+        }
+
+
+# plays uri through the cache with playbin. returns True when played to the
+# end without error
+def play(cache, uri, fake_sinks=False):
+    playbin = Gst.ElementFactory.make("playbin", "playbin")
+    if not playbin:
+        print("ERROR: Could not create 'playbin' element")
+        sys.exit(1)
+
+    if fake_sinks:
+        # render as fast as possible, used for the self test
+        playbin.set_property("audio-sink", Gst.ElementFactory.make("fakesink"))
+        playbin.set_property("video-sink", Gst.ElementFactory.make("fakesink"))
+
+    playbin.set_property("uri", cache.attach(playbin, uri))
+    print("Playing", playbin.get_property("uri"))
+
+    ret = playbin.set_state(Gst.State.PLAYING)
+    if ret == Gst.StateChangeReturn.FAILURE:
+        print("ERROR: Unable to set the pipeline to the playing state")
+        playbin.set_state(Gst.State.NULL)
+        return False
+
+    eos = False
+    bus = playbin.get_bus()
+    try:
+        while True:
+            msg = bus.timed_pop_filtered(
+                Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+            if not msg:
+                continue
+
+            if msg.type == Gst.MessageType.ERROR:
+                err, dbg = msg.parse_error()
+                print("ERROR:", msg.src.get_name(), ":", err.message)
+                if dbg:
+                    print("Debug info:", dbg)
+            else:
+                eos = True
+            break
+    except KeyboardInterrupt:
+        pass
+
+    cache.commit(eos)
+    playbin.set_state(Gst.State.NULL)
+    return eos
+
+
+def print_stats(cache):
+    for key, value in sorted(cache.stats().items()):
+        print("  {0:14s} {1}".format(key, value))
+
+
+# serves the directory of path over HTTP on a free local port and plays the
+# file twice through a fresh cache. the second play must be a hit
+def selftest(path):
+    import http.server
+    import tempfile
+    import functools
+
+    handler = functools.partial(
+        http.server.SimpleHTTPRequestHandler,
+        directory=os.path.dirname(os.path.abspath(path)))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    uri = "http://127.0.0.1:{0}/{1}".format(
+        server.server_address[1], os.path.basename(path))
+    directory = tempfile.mkdtemp(prefix="gst-cache-test-")
+    try:
+        cache = DownloadCache(directory)
+        first = play(cache, uri, fake_sinks=True)
+        second = play(cache, uri, fake_sinks=True)
+        print_stats(cache)
+
+        ok = first and second and cache.hits == 1 and cache.misses == 1
+        print("selftest", "PASSED" if ok else "FAILED")
+        return 0 if ok else 1
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    Gst.init(None)
+
+    if len(sys.argv) == 3 and sys.argv[1] == "play":
+        cache = DownloadCache()
+        play(cache, sys.argv[2])
+        print_stats(cache)
+    elif len(sys.argv) == 2 and sys.argv[1] == "stats":
+        print_stats(DownloadCache())
+    elif len(sys.argv) == 3 and sys.argv[1] == "selftest":
+        return selftest(sys.argv[2])
+    else:
+        print("usage: {0} play URI | stats | selftest FILE".format(sys.argv[0]))
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
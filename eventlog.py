@@ -0,0 +1,150 @@
+# a fixed-size in-memory event log for the bus loops and callbacks.
+#
+# writers only append a tuple to a bounded deque, under a lock held just for
+# that, and never do I/O (when the ring is full the oldest event is
+# overwritten). a background thread drains the ring and writes the events out
+# in batches, noting where events were overwritten before they could be
+# written. the last few events are also kept around so they can be dumped
+# when an error occurs
+
+import collections
+import itertools
+import sys
+import threading
+import time
+
+
+class EventLog(object):
+
+    def __init__(self, size=4096, history=256, output=None, interval=0.25,
+                 dump_on_error=None, error_output=None):
+        # the ring the writers append to and the flusher drains
+        self.ring = collections.deque(maxlen=size)
+        # the last events written, whether flushed already or not
+        self.history = collections.deque(maxlen=history)
+        # where to write batches to, a file name or a file object
+        self.output = output or sys.stdout
+        # where to dump the history to when an error is logged
+        self.error_output = error_output or sys.stderr
+        self.interval = interval
+        # None dumps only when the batches do not go to a terminal, where the
+        # events are on screen already
+        if dump_on_error is None:
+            dump_on_error = isinstance(self.output, str) or not (
+                hasattr(self.output, "isatty") and self.output.isatty())
+        self.dump_on_error = dump_on_error
+        # number of events overwritten before they could be flushed
+        self.dropped = 0
+
+        # numbering and appending must happen together, or entries of two
+        # threads can land in the ring out of order and look like drops
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._last_seq = -1
+        self._start = time.monotonic_ns()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._dump_requested = False
+        self._thread = None
+        self._file = None
+
+    # record an event. safe to call from any thread, including GStreamer
+    # streaming threads
+    def event(self, type, element, text=""):
+        with self._lock:
+            entry = (next(self._seq), time.monotonic_ns(), type, element, text)
+            self.ring.append(entry)
+            self.history.append(entry)
+
+    # record an error, and dump the recent history if requested
+    def error(self, element, text=""):
+        self.event("error", element, text)
+        if self.dump_on_error:
+            # let the flusher do the I/O
+            self._dump_requested = True
+            self._wakeup.set()
+
+    def start(self):
+        if self._thread:
+            return
+
+        if isinstance(self.output, str):
+            self._file = open(self.output, "a")
+        else:
+            self._file = self.output
+
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="eventlog-flusher", daemon=True)
+        self._thread.start()
+
+    # flush all pending events and stop the background thread
+    def stop(self):
+        if not self._thread:
+            return
+
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+        if self._file is not self.output:
+            self._file.close()
+        self._file = None
+
+        if self.dropped:
+            self.error_output.write(
+                "eventlog: {0} events dropped, the ring of {1} overran\n".format(
+                    self.dropped, self.ring.maxlen))
+            self.error_output.flush()
+
+    def format(self, entry):
+        seq, ts, type, element, text = entry
+        return "[{0:12.6f}] {1:<16s} {2:<16s} {3}\n".format(
+            (ts - self._start) / 1e9, type, element or "-", text)
+
+    # write the recent history to the error output (or the given file). the
+    # events are in the regular output as well, the dump is marked as a copy
+    def dump(self, out=None):
+        out = out or self.error_output
+        entries = list(self.history)
+        out.write("--- eventlog history: last {0} events, also in the log ---\n".format(
+            len(entries)))
+        out.write("".join(self.format(e) for e in entries))
+        out.write("--- end of eventlog history ---\n")
+        out.flush()
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                entry = self.ring.popleft()
+            except IndexError:
+                break
+
+            if entry[0] > self._last_seq + 1:
+                lost = entry[0] - self._last_seq - 1
+                self.dropped += lost
+                batch.append(self.format((
+                    None, entry[1], "dropped", "eventlog",
+                    "{0} events overwritten before they were written".format(lost))))
+            self._last_seq = entry[0]
+            batch.append(self.format(entry))
+
+        if batch:
+            self._file.write("".join(batch))
+            self._file.flush()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self._drain()
+
+            if self._dump_requested:
+                self._dump_requested = False
+                self.dump()
+
+            if self._stopping:
+                self._drain()
+                break
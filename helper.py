@@ -1,6 +1,70 @@
+import os
+import resource
+
+from profiler import profiler
+
+
 def format_ns(ns):
     s, ns = divmod(ns, 1000000000)
     m, s = divmod(s, 60)
     h, m = divmod(m, 60)
 
     return "%u:%02u:%02u.%09u" % (h, m, s, ns)
+
+
+# percentile of a list of numbers (p in 0..100): the value at p percent of
+# the way from the smallest to the largest one, rounded to the nearest index
+def percentile(values, p):
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = int(round(p / 100.0 * (len(ordered) - 1)))
+    return ordered[max(0, min(rank, len(ordered) - 1))]
+
+
+# resident set size of the current process in bytes
+def get_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # no procfs, fall back to the peak RSS (kilobytes on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# number of open file descriptors of the current process
+def get_fd_count():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+
+# number of OS threads of the current process, including the ones GStreamer
+# started behind Python's back
+def get_thread_count():
+    try:
+        return len(os.listdir("/proc/self/task"))
+    except OSError:
+        return -1
+
+
+# CPU time (user + system) used by the current process so far, in seconds
+def get_cpu_time():
+    times = os.times()
+    return times.user + times.system
+
+
+# connects a signal handler, wrapped for profiling if GST_PY_PROFILE is set
+def connect(obj, signal, handler, *args):
+    return obj.connect(signal, profiler.wrap(signal, handler), *args)
+
+
+# adds a pad probe, wrapped for profiling if GST_PY_PROFILE is set
+def add_probe(pad, mask, callback, *args):
+    parent = pad.get_parent()
+    name = "probe {0}:{1}".format(parent.get_name() if parent else "",
+                                  pad.get_name())
+    return pad.add_probe(mask, profiler.wrap(name, callback), *args)
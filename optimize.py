@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+# spreads a linear filter chain over several cores. without queues, all
+# elements from the source to the sink run in the source's streaming thread,
+# one buffer at a time, so the chain never uses more than one core.
+#
+# the optimizer runs the chain once and measures the time every element
+# spends on a buffer (from the buffer entering its sink pad until it leaves
+# its src pad). it then cuts the chain into stages of about equal cost and
+# inserts a small queue at every cut, so every stage runs in its own thread
+# and the stages work on consecutive buffers at the same time. elements that
+# can split their work themselves ("n-threads", e.g. videoconvert and
+# videoscale) are told to use all cores. finally the optimized chain is run
+# again and the throughput of both is reported.
+#
+#   ./optimize.py "videotestsrc ! vertigotv ! videoconvert ! fakesink sync=false"
+#
+# the chain must be linear and must not synchronize to the clock for the
+# throughput to mean anything.
+
+import argparse
+import os
+import sys
+import threading
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from helper import add_probe
+
+# buffers a thread boundary holds at most
+QUEUE_BUFFERS = 3
+
+
+class Chain(object):
+
+    def __init__(self, description):
+        self.description = description
+        self.pipeline = Gst.parse_launch(description)
+        self.queues = []
+        self.threaded = []
+
+        # walk from the source along the src pads
+        self.elements = []
+        sources = list(self.pipeline.iterate_sources())
+        if len(sources) != 1:
+            raise ValueError("The pipeline is not a linear chain")
+        element = sources[0]
+        while element:
+            self.elements.append(element)
+            pad = element.get_static_pad("src")
+            peer = pad.get_peer() if pad else None
+            element = peer.get_parent_element() if peer else None
+
+        self.lock = threading.Lock()
+        self.buffers = 0
+        # per element name: time the current buffer entered, total time
+        # spent and number of buffers
+        self.enter = {}
+        self.busy = {}
+        self.calls = {}
+
+    # inserts a bounded queue before the element at index
+    def insert_queue(self, index):
+        upstream = self.elements[index - 1]
+        downstream = self.elements[index]
+        queue = Gst.ElementFactory.make(
+            "queue", "boundary-{0}".format(downstream.get_name()))
+        queue.set_property("max-size-buffers", QUEUE_BUFFERS)
+        queue.set_property("max-size-bytes", 0)
+        queue.set_property("max-size-time", 0)
+
+        self.pipeline.add(queue)
+        upstream.unlink(downstream)
+        if not upstream.link(queue) or not queue.link(downstream):
+            raise RuntimeError("Could not insert a queue before {0}".format(
+                downstream.get_name()))
+        self.queues.append(queue)
+
+    # lets elements that can work multithreaded use n threads
+    def set_threads(self, n):
+        for element in self.elements:
+            if element.find_property("n-threads"):
+                element.set_property("n-threads", n)
+                self.threaded.append(element.get_name())
+
+    def on_sink_buffer(self, pad, info):
+        with self.lock:
+            self.buffers += 1
+        return Gst.PadProbeReturn.OK
+
+    def on_enter(self, pad, info, name):
+        self.enter[name] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def on_leave(self, pad, info, name):
+        start = self.enter.pop(name, None)
+        if start is not None:
+            self.busy[name] = self.busy.get(name, 0.0) + time.perf_counter() - start
+            self.calls[name] = self.calls.get(name, 0) + 1
+        return Gst.PadProbeReturn.OK
+
+    # runs the pipeline for the given time, returns False on error or EOS
+    def wait(self, seconds):
+        bus = self.pipeline.get_bus()
+        msg = bus.timed_pop_filtered(
+            int(seconds * Gst.SECOND),
+            Gst.MessageType.ERROR | Gst.MessageType.EOS)
+        if msg and msg.type == Gst.MessageType.ERROR:
+            err, dbg = msg.parse_error()
+            print("ERROR:", msg.src.get_name(), ":", err.message)
+        return msg is None
+
+    def count(self, seconds):
+        with self.lock:
+            start_buffers = self.buffers
+        start = time.monotonic()
+        ok = self.wait(seconds)
+        elapsed = time.monotonic() - start
+        with self.lock:
+            buffers = self.buffers - start_buffers
+        return ok, buffers, elapsed
+
+    # measures the time per buffer of every element, then the throughput
+    # without the timing probes. returns (fps, {name: seconds per buffer})
+    def run(self, seconds=5.0, warmup=1.0, timing=True):
+        sink = self.elements[-1]
+        add_probe(sink.get_static_pad("sink"), Gst.PadProbeType.BUFFER,
+                  self.on_sink_buffer)
+
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            raise RuntimeError("Unable to set the pipeline to the playing state")
+
+        costs = {}
+        ok = self.wait(warmup)
+        if ok and timing:
+            probes = []
+            for element in self.elements[1:-1]:
+                name = element.get_name()
+                for pad, callback in ((element.get_static_pad("sink"), self.on_enter),
+                                      (element.get_static_pad("src"), self.on_leave)):
+                    probes.append((pad, add_probe(
+                        pad, Gst.PadProbeType.BUFFER, callback, name)))
+
+            ok, buffers, elapsed = self.count(seconds)
+            for pad, probe_id in probes:
+                pad.remove_probe(probe_id)
+
+            for element in self.elements[1:-1]:
+                name = element.get_name()
+                if self.calls.get(name):
+                    costs[name] = self.busy[name] / self.calls[name]
+            # in a single thread, whatever is not spent in the filters is
+            # spent in the source (and the sink)
+            if buffers and not self.queues:
+                costs[self.elements[0].get_name()] = max(
+                    0.0, elapsed / buffers - sum(costs.values()))
+
+        fps = 0.0
+        if ok:
+            ok, buffers, elapsed = self.count(seconds)
+            fps = buffers / elapsed if elapsed else 0.0
+        self.pipeline.set_state(Gst.State.NULL)
+        if not ok:
+            raise RuntimeError("The pipeline stopped early")
+        return fps, costs
+
+
+# indices of the elements to put a queue in front of, so that the chain is
+# cut into at most `stages` parts of roughly equal cost
+def plan_cuts(costs, stages, min_share=0.05):
+    total = sum(costs)
+    if not total or stages < 2:
+        return []
+
+    target = total / stages
+    cuts = []
+    # cost of the stage since the last cut
+    acc = costs[0]
+    for i in range(1, len(costs)):
+        rest = sum(costs[i:])
+        # cut where adding the next element would make the stage too
+        # expensive, but do not split off stages with next to nothing to do
+        if (acc + costs[i] > target and acc >= min_share * total
+                and rest >= min_share * total and len(cuts) < stages - 1):
+            cuts.append(i)
+            acc = 0.0
+        acc += costs[i]
+    return cuts
+
+
+# inserts queues at the cuts and sets n-threads. the indices refer to the
+# elements of the chain as it was parsed
+def apply(chain, cuts, threads):
+    for index in cuts:
+        chain.insert_queue(index)
+    if threads > 1:
+        chain.set_threads(threads)
+
+
+def optimize(description, seconds=5.0, stages=None, threads=None):
+    stages = stages or os.cpu_count() or 1
+    threads = threads or os.cpu_count() or 1
+
+    before = Chain(description)
+    fps_before, costs = before.run(seconds)
+    names = [e.get_name() for e in before.elements]
+
+    after = Chain(description)
+    cuts = plan_cuts([costs.get(name, 0.0) for name in names], stages)
+    apply(after, cuts, threads)
+    fps_after, unused = after.run(seconds, timing=False)
+
+    return {
+        "elements": names,
+        "costs": costs,
+        "cuts": cuts,
+        "queues-before": [names[i] for i in cuts],
+        "threaded": after.threaded,
+        "fps-before": fps_before,
+        "fps-after": fps_after,
+    }
+
+
+def print_report(result):
+    total = sum(result["costs"].values())
+    print("{0:24s} {1:>10s} {2:>7s}".format("element", "ms/buffer", "share"))
+    for name in result["elements"]:
+        cost = result["costs"].get(name)
+        if cost is None:
+            continue
+        marker = " <- queue" if name in result["queues-before"] else ""
+        print("{0:24s} {1:10.3f} {2:7.1%}{3}".format(
+            name, cost * 1e3, cost / total if total else 0, marker))
+
+    if result["threaded"]:
+        print("n-threads set on: " + ", ".join(result["threaded"]))
+    print("throughput: {0:.1f} fps before, {1:.1f} fps after ({2:+.0%})".format(
+        result["fps-before"], result["fps-after"],
+        result["fps-after"] / result["fps-before"] - 1
+        if result["fps-before"] else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Insert thread boundaries into a linear filter chain")
+    parser.add_argument("--seconds", type=float, default=5.0,
+                        help="measuring time per run")
+    parser.add_argument("--stages", type=int,
+                        help="maximum number of threads (default: cores)")
+    parser.add_argument("--threads", type=int,
+                        help="n-threads for elements that support it")
+    parser.add_argument("description", help="gst-launch style chain")
+    args = parser.parse_args()
+
+    Gst.init(None)
+    try:
+        result = optimize(args.description, args.seconds, args.stages,
+                          args.threads)
+    except (GLib.Error, ValueError, RuntimeError) as e:
+        print("ERROR:", e)
+        return 1
+    print_report(result)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
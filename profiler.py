@@ -0,0 +1,171 @@
+# profiler for the Python callbacks GStreamer calls from its streaming
+# threads. signal handlers and pad probes hold the GIL while they run, so a
+# slow one stalls the media flow of its thread, and any other thread waiting
+# for the GIL meanwhile.
+#
+# callbacks connected with helper.connect() and helper.add_probe() are
+# wrapped when profiling is enabled, by setting GST_PY_PROFILE=1 (the report
+# is printed at exit) or by calling enable(). otherwise the callbacks are
+# connected unchanged and cost nothing.
+#
+# per callback and thread the wrapper records the number of calls, the wall
+# time and the part of it the thread was not running on a CPU, into a log2
+# histogram of microseconds. Python cannot see how long the thread waited
+# for the GIL before the callback was entered, but a handler that loses the
+# GIL to another thread (or blocks on I/O or a lock) while running shows up
+# as off-CPU time.
+
+import atexit
+import os
+import sys
+import threading
+import time
+
+# log2 buckets of microseconds, the last one collects everything above
+BUCKETS = 32
+
+
+class CallbackStats(object):
+
+    __slots__ = ("count", "wall", "off_cpu", "max_wall", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.off_cpu = 0.0
+        self.max_wall = 0.0
+        self.histogram = [0] * BUCKETS
+
+    def add(self, wall, cpu):
+        self.count += 1
+        self.wall += wall
+        self.off_cpu += max(0.0, wall - cpu)
+        if wall > self.max_wall:
+            self.max_wall = wall
+        bucket = int(wall * 1e6).bit_length()
+        self.histogram[min(bucket, BUCKETS - 1)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.wall += other.wall
+        self.off_cpu += other.off_cpu
+        self.max_wall = max(self.max_wall, other.max_wall)
+        for i, n in enumerate(other.histogram):
+            self.histogram[i] += n
+
+    # upper bound in seconds of the bucket holding the p-th percentile
+    def percentile(self, p):
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.histogram):
+            seen += n
+            if n and seen >= rank:
+                return (1 << i) / 1e6
+        return self.max_wall
+
+
+class Profiler(object):
+
+    def __init__(self):
+        self.enabled = False
+        # every thread records into its own table, so recording takes no lock
+        self.local = threading.local()
+        # (thread name, native id, is main thread, table) of every thread
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def enable(self, report_at_exit=True):
+        if not self.enabled and report_at_exit:
+            atexit.register(self.report)
+        self.enabled = True
+
+    def table(self):
+        table = getattr(self.local, "table", None)
+        if table is None:
+            table = self.local.table = {}
+            thread = threading.current_thread()
+            with self.lock:
+                self.threads.append((
+                    thread.name, threading.get_native_id(),
+                    thread is threading.main_thread(), table))
+        return table
+
+    # returns the callback wrapped for profiling, or unchanged if disabled
+    def wrap(self, name, callback):
+        if not self.enabled:
+            return callback
+
+        name = "{0} {1}".format(
+            name, getattr(callback, "__qualname__", repr(callback)))
+
+        def wrapper(*args):
+            wall = time.perf_counter()
+            cpu = time.thread_time()
+            try:
+                return callback(*args)
+            finally:
+                cpu = time.thread_time() - cpu
+                wall = time.perf_counter() - wall
+                table = self.table()
+                stats = table.get(name)
+                if stats is None:
+                    stats = table[name] = CallbackStats()
+                stats.add(wall, cpu)
+
+        return wrapper
+
+    # per callback: (stats on streaming threads, stats on the main thread,
+    # names of the streaming threads it ran on)
+    def collect(self):
+        result = {}
+        with self.lock:
+            threads = list(self.threads)
+        for thread_name, native_id, is_main, table in threads:
+            for name, stats in list(table.items()):
+                streaming, main, names = result.setdefault(
+                    name, (CallbackStats(), CallbackStats(), set()))
+                if is_main:
+                    main.merge(stats)
+                else:
+                    streaming.merge(stats)
+                    names.add("{0}/{1}".format(thread_name, native_id))
+        return result
+
+    # callbacks ranked by the time they kept streaming threads busy
+    def report(self, output=None):
+        output = output or sys.stderr
+        result = self.collect()
+        if not result:
+            return
+
+        ranked = sorted(result.items(),
+                        key=lambda item: (item[1][0].wall, item[1][1].wall),
+                        reverse=True)
+        output.write("{0:48s} {1:>7s} {2:>7s} {3:>9s} {4:>9s} {5:>9s} {6:>8s} {7:>7s}\n".format(
+            "callback", "calls", "main", "total ms", "p50 us", "p99 us",
+            "max ms", "off-cpu"))
+        for name, (streaming, main, names) in ranked:
+            stats = CallbackStats()
+            stats.merge(streaming)
+            stats.merge(main)
+            output.write("{0:48s} {1:7d} {2:7d} {3:9.2f} {4:9.0f} {5:9.0f} {6:8.2f} {7:6.0%}\n".format(
+                name[:48], stats.count, main.count, stats.wall * 1e3,
+                stats.percentile(50) * 1e6, stats.percentile(99) * 1e6,
+                stats.max_wall * 1e3,
+                stats.off_cpu / stats.wall if stats.wall else 0))
+            if names:
+                output.write("    streaming threads: {0}\n".format(
+                    ", ".join(sorted(names))))
+
+
+profiler = Profiler()
+if os.environ.get("GST_PY_PROFILE", "") not in ("", "0"):
+    profiler.enable()
+
+
+def enable(report_at_exit=True):
+    profiler.enable(report_at_exit)
+
+
+def report(output=None):
+    profiler.report(output)
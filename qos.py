@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+# watches the QOS messages the sinks (and decoders) post when they drop late
+# frames and degrades the video in steps while the host cannot keep up:
+#
+#   level 1: half the frame rate (videorate)
+#   level 2: also half the resolution (videoscale)
+#   level 3: also let the decoders skip non-reference frames
+#
+# when no frames have been dropped for a while, the controller goes back up
+# one level at a time. the elements for levels 1 and 2 come from
+# make_degradation_filter(), which is meant to be used as playbin's
+# "video-filter".
+#
+# usage: qos.py URI
+#
+# https://gstreamer.freedesktop.org/documentation/additional/design/qos.html
+
+import sys
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from helper import add_probe, connect
+
+LEVELS = ("full", "half framerate", "half resolution", "skip frames")
+
+# value of the libav decoders' "skip-frame" property skipping B-frames
+SKIP_NON_REF = 1
+
+
+# videorate and videoscale with a capsfilter each, all passthrough until the
+# controller restricts the caps
+def make_degradation_filter():
+    filter = Gst.parse_bin_from_description(
+        "videorate name=rate drop-only=true ! capsfilter name=rate-caps ! "
+        "videoscale name=scale ! capsfilter name=scale-caps", True)
+    filter.set_name("degradation-filter")
+    return filter
+
+
+class ElementQos(object):
+
+    def __init__(self):
+        self.processed = 0
+        self.dropped = 0
+        self.jitter = 0
+        self.max_jitter = 0
+        self.messages = 0
+
+
+class QosController(object):
+
+    def __init__(self, pipeline, filter=None, window=2.0, threshold=0.05,
+                 sustain=2.0, recover_after=10.0, log=None):
+        self.pipeline = pipeline
+        self.filter = filter
+        # seconds of history the drop ratio is computed over
+        self.window = window
+        # drop ratio above which we are overloaded
+        self.threshold = threshold
+        # seconds the overload must last before degrading
+        self.sustain = sustain
+        # seconds without drops before upgrading again
+        self.recover_after = recover_after
+        self.log = log
+
+        self.level = 0
+        # (time, from level, to level, reason)
+        self.events = []
+        # per element name
+        self.elements = {}
+        # (time, processed delta, dropped delta) of the last seconds
+        self.samples = []
+        self.overloaded_since = None
+        self.last_drop = None
+        self.last_change = time.monotonic()
+
+        self.video_size = None
+        self.framerate = None
+        self.decoders = []
+
+        if filter:
+            add_probe(
+                filter.get_by_name("rate").get_static_pad("sink"),
+                Gst.PadProbeType.EVENT_DOWNSTREAM, self.on_filter_event)
+        connect(pipeline, "deep-element-added", self.on_deep_element_added)
+
+    def report(self, text):
+        if self.log:
+            self.log.event("qos", self.pipeline.get_name(), text)
+        else:
+            print(text)
+
+    # called from a streaming thread, remembers the input format so the
+    # degraded caps can be derived from it
+    def on_filter_event(self, pad, info):
+        event = info.get_event()
+        if event.type == Gst.EventType.CAPS:
+            s = event.parse_caps().get_structure(0)
+            ok, width = s.get_int("width")
+            ok2, height = s.get_int("height")
+            if ok and ok2:
+                self.video_size = (width, height)
+            ok, num, den = s.get_fraction("framerate")
+            if ok and num > 0:
+                self.framerate = (num, den)
+        return Gst.PadProbeReturn.OK
+
+    # called from a streaming thread for every element created in the pipeline
+    def on_deep_element_added(self, bin, sub_bin, element):
+        factory = element.get_factory()
+        if (factory and factory.get_klass().find("Decoder") >= 0
+                and element.find_property("skip-frame")):
+            self.decoders.append(element)
+            if self.level >= 3:
+                element.set_property("skip-frame", SKIP_NON_REF)
+
+    def handle_message(self, msg):
+        if msg.type != Gst.MessageType.QOS:
+            return
+
+        fmt, processed, dropped = msg.parse_qos_stats()
+        jitter, proportion, quality = msg.parse_qos_values()
+
+        name = msg.src.get_name()
+        stats = self.elements.setdefault(name, ElementQos())
+        # processed and dropped are running totals of the element
+        d_processed = max(0, processed - stats.processed)
+        d_dropped = max(0, dropped - stats.dropped)
+        stats.processed = processed
+        stats.dropped = dropped
+        stats.jitter = jitter
+        stats.max_jitter = max(stats.max_jitter, jitter)
+        stats.messages += 1
+
+        now = time.monotonic()
+        self.samples.append((now, d_processed, d_dropped))
+        if d_dropped or jitter > 0:
+            self.last_drop = now
+        self.evaluate()
+
+    # called for every QOS message and periodically, as a healthy pipeline
+    # does not post any
+    def evaluate(self):
+        now = time.monotonic()
+        self.samples = [s for s in self.samples if now - s[0] <= self.window]
+        processed = sum(s[1] for s in self.samples)
+        dropped = sum(s[2] for s in self.samples)
+        total = processed + dropped
+        ratio = dropped / total if total else 0.0
+
+        if ratio > self.threshold:
+            if self.overloaded_since is None:
+                self.overloaded_since = now
+            elif (now - self.overloaded_since >= self.sustain
+                    and now - self.last_change >= self.sustain
+                    and self.level < len(LEVELS) - 1):
+                self.set_level(self.level + 1,
+                               "{0:.0%} of frames dropped".format(ratio))
+                self.overloaded_since = None
+        else:
+            self.overloaded_since = None
+            quiet = now - (self.last_drop or self.last_change)
+            if (self.level > 0 and quiet >= self.recover_after
+                    and now - self.last_change >= self.recover_after):
+                self.set_level(self.level - 1,
+                               "no drops for {0:.0f}s".format(quiet))
+
+        return True
+
+    def set_level(self, level, reason):
+        self.events.append((time.time(), self.level, level, reason))
+        self.report("QoS level {0} -> {1} ({2}): {3}".format(
+            self.level, level, LEVELS[level], reason))
+        self.level = level
+        self.last_change = time.monotonic()
+        self.apply()
+
+    def apply(self):
+        if self.filter:
+            rate_caps = Gst.Caps.new_any()
+            if self.level >= 1 and self.framerate:
+                num, den = self.framerate
+                rate_caps = Gst.Caps.from_string(
+                    "video/x-raw,framerate={0}/{1}".format(num, den * 2))
+            self.filter.get_by_name("rate-caps").set_property("caps", rate_caps)
+
+            scale_caps = Gst.Caps.new_any()
+            if self.level >= 2 and self.video_size:
+                width, height = self.video_size
+                scale_caps = Gst.Caps.from_string(
+                    "video/x-raw,width={0},height={1}".format(
+                        max(2, width // 4 * 2), max(2, height // 4 * 2)))
+            self.filter.get_by_name("scale-caps").set_property(
+                "caps", scale_caps)
+
+        for decoder in self.decoders:
+            decoder.set_property(
+                "skip-frame", SKIP_NON_REF if self.level >= 3 else 0)
+
+    def metrics(self):
+        return {
+            "level": self.level,
+            "level-name": LEVELS[self.level],
+            "degradations": sum(1 for e in self.events if e[2] > e[1]),
+            "recoveries": sum(1 for e in self.events if e[2] < e[1]),
+            "events": list(self.events),
+            "elements": dict(
+                (name, {"processed": s.processed, "dropped": s.dropped,
+                        "jitter": s.jitter, "max-jitter": s.max_jitter,
+                        "messages": s.messages})
+                for name, s in self.elements.items()),
+        }
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("usage: {0} URI".format(sys.argv[0]))
+        return 1
+
+    Gst.init(None)
+    playbin = Gst.ElementFactory.make("playbin", "playbin")
+    if not playbin:
+        print("ERROR: Could not create 'playbin' element")
+        return 1
+
+    filter = make_degradation_filter()
+    playbin.set_property("video-filter", filter)
+    playbin.set_property("uri", sys.argv[1])
+    controller = QosController(playbin, filter)
+
+    loop = GLib.MainLoop()
+
+    def on_message(bus, msg):
+        if msg.type == Gst.MessageType.QOS:
+            controller.handle_message(msg)
+        elif msg.type == Gst.MessageType.ERROR:
+            err, dbg = msg.parse_error()
+            print("ERROR:", msg.src.get_name(), ":", err.message)
+            loop.quit()
+        elif msg.type == Gst.MessageType.EOS:
+            loop.quit()
+
+    def print_metrics():
+        metrics = controller.metrics()
+        print("level {0} ({1}), {2} degradations, {3} recoveries".format(
+            metrics["level"], metrics["level-name"], metrics["degradations"],
+            metrics["recoveries"]))
+        for name, stats in sorted(metrics["elements"].items()):
+            print("  {0:24s} processed {1:7d} dropped {2:6d} jitter {3:+.1f} ms".format(
+                name, stats["processed"], stats["dropped"],
+                stats["jitter"] / 1e6))
+        return True
+
+    bus = playbin.get_bus()
+    bus.add_signal_watch()
+    bus.connect("message", on_message)
+    GLib.timeout_add(500, controller.evaluate)
+    GLib.timeout_add_seconds(5, print_metrics)
+
+    playbin.set_state(Gst.State.PLAYING)
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+    playbin.set_state(Gst.State.NULL)
+    print_metrics()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
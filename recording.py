@@ -0,0 +1,314 @@
+# rolling recording branch for a tee: the stream is encoded and written by
+# splitmuxsink into segments of a fixed duration (or size). whenever a
+# segment is opened or closed the oldest segments are deleted until all of
+# them fit into the disk budget, together with the room the segment being
+# written is expected to take (its maximum size, or the bitrate measured on
+# the segments written so far times the segment duration).
+#
+# the branch can be attached to and detached from a PLAYING pipeline without
+# disturbing the other branches of the tee: it is linked to a new request pad
+# of the tee, and on detach it is unlinked from the streaming thread while
+# that pad is idle, EOS is sent into it so splitmuxsink finishes the current
+# segment, and it is removed once splitmuxsink reports the EOS.
+#
+# the recorder is fed the ELEMENT messages from the bus.
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+7%3A+Multithreading+and+Pad+Availability
+
+import glob
+import os
+import threading
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from helper import add_probe, connect, percentile
+
+
+class Segment(object):
+
+    def __init__(self, location):
+        self.location = location
+        self.size = 0
+        self.opened = time.monotonic()
+        self.closed = None
+
+
+class Recorder(object):
+
+    def __init__(self, pipeline, tee, directory, encoder, muxer="matroskamux",
+                 extension="mkv", segment_duration=60.0, segment_size=0,
+                 budget=1 << 30, max_lateness=2.0, log=None):
+        self.pipeline = pipeline
+        self.tee = tee
+        self.directory = directory
+        self.encoder = encoder
+        self.muxer = muxer
+        self.extension = extension
+        self.segment_duration = segment_duration
+        self.segment_size = segment_size
+        # bytes all segments may use together
+        self.budget = budget
+        # seconds of data the branch queue holds before dropping the oldest
+        self.max_lateness = max_lateness
+        self.log = log
+
+        self.bin = None
+        self.tee_pad = None
+        self.detaching = False
+        self.attachments = 0
+
+        # closed segments, oldest first, including those of earlier runs.
+        # segments a crashed run did not finish are counted like the others
+        os.makedirs(directory, exist_ok=True)
+        self.segments = []
+        for location in sorted(glob.glob(os.path.join(
+                directory, "rec-*." + extension)), key=os.path.getmtime):
+            segment = Segment(location)
+            segment.size = os.path.getsize(location)
+            self.segments.append(segment)
+        self.current = None
+        # bytes per second written into the segments of this run
+        self.rate = None
+
+        self.deleted = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+        # seconds between capture and the buffer reaching the file writer
+        self.latencies = []
+
+    def report(self, text):
+        if self.log:
+            self.log.event("recording", self.pipeline.get_name(), text)
+        else:
+            print(text)
+
+    def is_attached(self):
+        return self.bin is not None
+
+    def attach(self):
+        if self.bin:
+            return False
+
+        self.attachments += 1
+        self.bin = Gst.Bin.new("recording{0}".format(self.attachments))
+        # pass the EOS message of splitmuxsink on to the bus, it is posted
+        # once the last segment is complete
+        self.bin.set_property("message-forward", True)
+        queue = Gst.ElementFactory.make("queue", None)
+        encoder = Gst.parse_bin_from_description(self.encoder, True)
+        splitmux = Gst.ElementFactory.make("splitmuxsink", None)
+        writer = Gst.ElementFactory.make("filesink", None)
+        if not queue or not encoder or not splitmux or not writer:
+            self.bin = None
+            self.report("ERROR: Could not create the recording elements")
+            return False
+
+        # never block the tee: if the disk stalls, drop the oldest data
+        queue.set_property("leaky", 2)
+        queue.set_property("max-size-buffers", 0)
+        queue.set_property("max-size-bytes", 0)
+        queue.set_property("max-size-time", int(self.max_lateness * Gst.SECOND))
+        connect(queue, "overrun", self.on_overrun)
+
+        # a new prefix per attachment, the segments of earlier ones are kept
+        prefix = time.strftime("rec-%Y%m%d-%H%M%S-")
+        splitmux.set_property("location", os.path.join(
+            self.directory, prefix + "%05d." + self.extension))
+        splitmux.set_property("muxer", Gst.ElementFactory.make(self.muxer, None))
+        splitmux.set_property("sink", writer)
+        splitmux.set_property(
+            "max-size-time", int(self.segment_duration * Gst.SECOND))
+        splitmux.set_property("max-size-bytes", self.segment_size)
+        # the rest of the pipeline is already playing, do not wait for us
+        writer.set_property("async", False)
+        add_probe(writer.get_static_pad("sink"), Gst.PadProbeType.BUFFER,
+                  self.on_writer_buffer)
+
+        self.bin.add(queue, encoder, splitmux)
+        mux_pad = self.request_mux_pad(splitmux, encoder.get_static_pad("src"))
+        if (not queue.link(encoder) or not mux_pad
+                or encoder.get_static_pad("src").link(mux_pad) != Gst.PadLinkReturn.OK):
+            self.bin = None
+            self.report("ERROR: Could not link the recording branch")
+            return False
+        pad = Gst.GhostPad.new("sink", queue.get_static_pad("sink"))
+        pad.set_active(True)
+        self.bin.add_pad(pad)
+
+        # bring the branch up before data can reach it
+        self.pipeline.add(self.bin)
+        self.bin.sync_state_with_parent()
+        self.tee_pad = self.tee.request_pad(
+            self.tee.get_pad_template("src_%u"), None, None)
+        if self.tee_pad.link(pad) != Gst.PadLinkReturn.OK:
+            self.report("ERROR: Could not link the recording branch to the tee")
+            self.remove()
+            return False
+
+        self.report("Recording to {0}".format(self.directory))
+        return True
+
+    # requests the splitmuxsink pad for the encoder's output. link() would
+    # take the first template, video, whose ANY caps accept everything, and
+    # the video stream is the one the segments are split on
+    def request_mux_pad(self, splitmux, src_pad):
+        caps = src_pad.query_caps(None)
+        name = caps.get_structure(0).get_name() if not caps.is_empty() else ""
+        if name.startswith("video/"):
+            template = "video"
+        elif name.startswith("audio/"):
+            template = "audio_%u"
+        else:
+            template = "subtitle_%u"
+        return splitmux.request_pad(
+            splitmux.get_pad_template(template), None, None)
+
+    def detach(self):
+        if not self.bin or self.detaching:
+            return False
+
+        self.detaching = True
+        # unlink from the streaming thread of the tee, between two buffers
+        add_probe(self.tee_pad, Gst.PadProbeType.IDLE, self.on_tee_idle)
+        return True
+
+    # called from the streaming thread of the tee, or right away if the pad
+    # is idle
+    def on_tee_idle(self, pad, info):
+        sink_pad = self.bin.get_static_pad("sink")
+        pad.unlink(sink_pad)
+        # let splitmuxsink finish the current segment
+        sink_pad.send_event(Gst.Event.new_eos())
+        return Gst.PadProbeReturn.REMOVE
+
+    # called from the streaming thread of the recording branch. measures the
+    # time from capture (the running time of the buffer in a live pipeline)
+    # until the buffer is handed to the file writer
+    def on_writer_buffer(self, pad, info):
+        buffer = info.get_buffer()
+        clock = self.pipeline.get_clock()
+        event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if not clock or not event or buffer.pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+
+        running_time = event.parse_segment().to_running_time(
+            Gst.Format.TIME, buffer.pts)
+        now = clock.get_time() - self.pipeline.get_base_time()
+        with self.lock:
+            self.latencies.append((now - running_time) / Gst.SECOND)
+        return Gst.PadProbeReturn.OK
+
+    # called from the streaming thread of the tee
+    def on_overrun(self, queue):
+        with self.lock:
+            self.dropped += 1
+
+    def remove(self):
+        self.bin.set_state(Gst.State.NULL)
+        self.pipeline.remove(self.bin)
+        self.tee.release_request_pad(self.tee_pad)
+        self.bin = None
+        self.tee_pad = None
+        self.detaching = False
+
+        # a segment that was never closed (an error, or we gave up waiting
+        # for the EOS) stays on disk, keep it under the budget as well
+        if self.current:
+            self.on_segment_closed(self.current.location)
+
+    def handle_message(self, msg):
+        s = msg.get_structure()
+        if msg.type != Gst.MessageType.ELEMENT or not s:
+            return
+
+        if s.get_name() == "splitmuxsink-fragment-opened":
+            self.current = Segment(s.get_string("location"))
+            # make room for the new segment before it is written
+            self.enforce_budget()
+        elif s.get_name() == "splitmuxsink-fragment-closed":
+            self.on_segment_closed(s.get_string("location"))
+        elif (s.get_name() == "GstBinForwarded" and self.detaching
+                and msg.src == self.bin):
+            # the last segment is complete, the branch can go
+            forwarded = s.get_value("message")
+            if forwarded.type == Gst.MessageType.EOS:
+                self.remove()
+                self.report("Recording stopped")
+
+    def on_segment_closed(self, location):
+        segment = self.current
+        if not segment or segment.location != location:
+            segment = Segment(location)
+        self.current = None
+        segment.closed = time.monotonic()
+        try:
+            segment.size = os.path.getsize(location)
+        except OSError:
+            segment.size = 0
+        self.segments.append(segment)
+
+        elapsed = segment.closed - segment.opened
+        if segment.size and elapsed > 0:
+            rate = segment.size / elapsed
+            self.rate = rate if self.rate is None else 0.5 * (self.rate + rate)
+        self.enforce_budget()
+
+    # the size the segment being written is expected to reach
+    def expected_size(self):
+        if self.rate and self.segment_duration:
+            expected = self.rate * self.segment_duration
+        elif self.segments:
+            # nothing measured yet, assume it is like the largest one
+            expected = max(s.size for s in self.segments)
+        else:
+            expected = 0
+        if self.segment_size:
+            expected = min(expected, self.segment_size) if expected else self.segment_size
+        return int(expected)
+
+    # the bytes the segment being written takes now, and is expected to take
+    def open_size(self):
+        if not self.current:
+            return 0, 0
+        try:
+            size = os.path.getsize(self.current.location)
+        except OSError:
+            size = 0
+        return size, max(size, self.expected_size())
+
+    # deletes the oldest segments until the rest, and the room reserved for
+    # the segment being written, fit into the budget. without an open
+    # segment the newest one is always kept
+    def enforce_budget(self):
+        keep = 0 if self.current else 1
+        total = sum(s.size for s in self.segments) + self.open_size()[1]
+        while total > self.budget and len(self.segments) > keep:
+            segment = self.segments.pop(0)
+            try:
+                os.remove(segment.location)
+            except OSError:
+                pass
+            total -= segment.size
+            self.deleted += 1
+            self.report("Deleted {0}".format(segment.location))
+
+    def stats(self):
+        with self.lock:
+            latencies, self.latencies = self.latencies, []
+            dropped = self.dropped
+        closed = [s for s in self.segments if s.closed]
+        size, reserved = self.open_size()
+        return {
+            "segments": len(self.segments) + (1 if self.current else 0),
+            "bytes": sum(s.size for s in self.segments) + size,
+            "reserved": reserved,
+            "budget": self.budget,
+            "deleted": self.deleted,
+            "dropped": dropped,
+            "segment-seconds": [s.closed - s.opened for s in closed[-10:]],
+            "latency-p50": percentile(latencies, 50),
+            "latency-p99": percentile(latencies, 99),
+            "latency-max": max(latencies) if latencies else None,
+        }
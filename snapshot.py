@@ -0,0 +1,161 @@
+# takes pictures of the video a playbin is showing, without a second video
+# branch converting every frame.
+#
+# playbin keeps the last frame handed to the video sink in its "sample"
+# property, in the format of the sink. only when a snapshot is requested is
+# that frame converted (scaled down if asked for) to an image, the same way
+# playbin's "convert-sample" action does it. the converted snapshots of the
+# last few frames are cached, so polling a paused player costs nothing, and
+# requests coming in faster than the rate limit get the previous snapshot.
+#
+# http://docs.gstreamer.com/display/GstSDK/Playback+tutorial+1%3A+Playbin+usage
+
+import collections
+import time
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo, GLib
+
+
+class Snapshotter(object):
+
+    def __init__(self, playbin, format="image/png", max_width=None,
+                 max_height=None, min_interval=0.5, cache_size=8,
+                 timeout=Gst.SECOND):
+        self.playbin = playbin
+        self.format = format
+        self.max_width = max_width
+        self.max_height = max_height
+        # seconds between two conversions
+        self.min_interval = min_interval
+        self.cache_size = cache_size
+        self.timeout = timeout
+
+        # (converted sample, stream time of its frame) by (pts, size), most
+        # recent last
+        self.cache = collections.OrderedDict()
+        self.last = None
+        self.last_time = None
+        # the media the cached snapshots were taken of
+        self.uri = None
+        # stream time of the frame of the snapshot returned last, and whether
+        # it is the frame being shown or a rate limited, older one
+        self.position = None
+        self.current = False
+
+        self.requests = 0
+        self.conversions = 0
+        self.hits = 0
+        self.limited = 0
+        self.convert_time = 0.0
+
+    # the size to convert to: the frame size with the pixel aspect ratio
+    # applied, scaled down to fit the limits
+    def target_size(self, caps, max_width, max_height):
+        s = caps.get_structure(0)
+        ok, width = s.get_int("width")
+        ok2, height = s.get_int("height")
+        if not ok or not ok2:
+            return None
+
+        ok, par_n, par_d = s.get_fraction("pixel-aspect-ratio")
+        if ok and par_d:
+            width = width * par_n // par_d
+
+        factor = 1.0
+        if max_width:
+            factor = min(factor, max_width / width)
+        if max_height:
+            factor = min(factor, max_height / height)
+        return max(2, int(width * factor) // 2 * 2), max(2, int(height * factor) // 2 * 2)
+
+    # returns the snapshot as a Gst.Sample in the configured format, or None
+    # if no frame has been shown yet. position and current tell which frame
+    # it shows
+    def snapshot(self, max_width=None, max_height=None):
+        self.requests += 1
+        sample = self.playbin.get_property("sample")
+        if not sample or not sample.get_buffer() or not sample.get_caps():
+            return None
+
+        size = self.target_size(sample.get_caps(), max_width or self.max_width,
+                                max_height or self.max_height)
+        if not size:
+            return None
+
+        # the timestamps of other media start over, forget the old snapshots
+        uri = self.playbin.get_property("current-uri") or self.playbin.get_property("uri")
+        if uri != self.uri:
+            self.uri = uri
+            self.cache.clear()
+            self.last = None
+            self.last_time = None
+
+        pts = sample.get_buffer().pts
+        key = (pts, size)
+        entry = self.cache.get(key)
+        if entry:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.returned(entry, True)
+
+        now = time.monotonic()
+        if (self.last and self.last_time is not None
+                and now - self.last_time < self.min_interval):
+            self.limited += 1
+            return self.returned(self.last, False)
+
+        caps = Gst.Caps.from_string(
+            "{0},width={1},height={2},pixel-aspect-ratio=1/1".format(
+                self.format, size[0], size[1]))
+        start = time.monotonic()
+        try:
+            converted = GstVideo.video_convert_sample(sample, caps, self.timeout)
+        except GLib.Error as e:
+            print("ERROR: Could not convert the snapshot:", e.message)
+            return None
+        self.convert_time += time.monotonic() - start
+        self.conversions += 1
+
+        position = pts
+        segment = sample.get_segment()
+        if segment and pts != Gst.CLOCK_TIME_NONE:
+            position = segment.to_stream_time(Gst.Format.TIME, pts)
+        entry = (converted, position)
+
+        self.cache[key] = entry
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        self.last = entry
+        self.last_time = now
+        return self.returned(entry, True)
+
+    def returned(self, entry, current):
+        converted, self.position = entry
+        self.current = current
+        return converted
+
+    # writes a snapshot to a file
+    def write(self, sample, path):
+        buffer = sample.get_buffer()
+        with open(path, "wb") as f:
+            f.write(buffer.extract_dup(0, buffer.get_size()))
+
+    # writes a snapshot to a file, returns False if there was none
+    def save(self, path, max_width=None, max_height=None):
+        sample = self.snapshot(max_width, max_height)
+        if not sample:
+            return False
+
+        self.write(sample, path)
+        return True
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "conversions": self.conversions,
+            "cache-hits": self.hits,
+            "rate-limited": self.limited,
+            "convert-time": self.convert_time,
+        }
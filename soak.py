@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+# soak test for the tutorial players: drives a player through thousands of
+# random state changes, seeks and URI changes on local test media, samples
+# RSS, open file descriptors, OS threads and live GStreamer objects while
+# doing so, and fails if any of them keeps growing past its limit.
+#
+#   ./soak.py --target tutorial-4 --cycles 5000
+#   ./soak.py --target tutorial-5 --csv samples.csv media1.webm media2.webm
+#
+# targets: playbin (a bare playbin), tutorial-3 (the reusable player of
+# basic-tutorial-3-ex-reuse.py), tutorial-4 and tutorial-5 (the players of
+# those tutorials, the latter needs a display). without media files two
+# short clips are generated first.
+#
+# live objects are counted with the leaks tracer, which is enabled unless
+# GST_TRACERS is already set.
+
+import argparse
+import gc
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GObject
+
+from helper import get_fd_count, get_rss, get_thread_count
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STATES = (Gst.State.NULL, Gst.State.READY, Gst.State.PAUSED,
+          Gst.State.PLAYING)
+
+# metric name, command line option, default limit of growth, unit scale
+METRICS = (
+    ("rss", "rss_limit", 32.0, 1048576.0),
+    ("fds", "fd_limit", 8, 1),
+    ("threads", "thread_limit", 8, 1),
+    ("objects", "object_limit", 100, 1),
+)
+
+
+# loads one of the tutorial scripts, their names are no module names
+def load_tutorial(filename):
+    spec = importlib.util.spec_from_file_location(
+        os.path.splitext(filename)[0].replace("-", "_"),
+        os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# renders a short clip with audio and video to play during the test
+def make_test_media(path, pattern):
+    pipeline = Gst.parse_launch(
+        "videotestsrc num-buffers=90 pattern={0} ! "
+        "video/x-raw,width=320,height=240,framerate=30/1 ! "
+        "vp8enc deadline=1 ! webmmux name=mux ! filesink location={1} "
+        "audiotestsrc num-buffers=130 ! audioconvert ! vorbisenc ! mux.".format(
+            pattern, path))
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+    pipeline.set_state(Gst.State.NULL)
+    if msg.type == Gst.MessageType.ERROR:
+        err, dbg = msg.parse_error()
+        print("ERROR: Could not create test media:", err.message)
+        sys.exit(1)
+    return Gst.filename_to_uri(path)
+
+
+# drives a pipeline directly and reads its bus from the soak loop
+class Driver(object):
+
+    def __init__(self, pipeline, uri_element):
+        self.pipeline = pipeline
+        self.uri_element = uri_element
+        self.errors = 0
+
+    def set_state(self, state):
+        self.pipeline.set_state(state)
+
+    def set_uri(self, uri):
+        self.uri_element.set_property("uri", uri)
+
+    # handle pending bus messages
+    def pump(self):
+        bus = self.pipeline.get_bus()
+        while True:
+            msg = bus.pop_filtered(Gst.MessageType.ERROR | Gst.MessageType.EOS)
+            if not msg:
+                break
+            if msg.type == Gst.MessageType.ERROR:
+                self.errors += 1
+
+    def close(self):
+        self.pipeline.set_state(Gst.State.NULL)
+
+
+def fake_sinks(playbin):
+    playbin.set_property("audio-sink", Gst.ElementFactory.make("fakesink"))
+    playbin.set_property("video-sink", Gst.ElementFactory.make("fakesink"))
+
+
+def playbin_driver():
+    playbin = Gst.ElementFactory.make("playbin", "playbin")
+    fake_sinks(playbin)
+    return Driver(playbin, playbin)
+
+
+def tutorial_3_driver():
+    player = load_tutorial("basic-tutorial-3-ex-reuse.py").Player(
+        audio_sink="fakesink", video_sink="fakesink")
+    return Driver(player.pipeline, player.source)
+
+
+def tutorial_4_driver():
+    player = load_tutorial("basic-tutorial-4.py").Player()
+    fake_sinks(player.playbin)
+    return Driver(player.playbin, player.playbin)
+
+
+# goes through the button handlers of the GTK player and lets GTK dispatch
+# the bus messages to it
+class Tutorial5Driver(Driver):
+
+    def __init__(self):
+        from gi.repository import Gtk
+        self.gtk = Gtk
+        self.player = load_tutorial("basic-tutorial-5.py").Player()
+        Driver.__init__(self, self.player.playbin, self.player.playbin)
+        self.pipeline.get_bus().connect("message::error", self.on_error)
+
+    def on_error(self, bus, msg):
+        self.errors += 1
+
+    def set_state(self, state):
+        if state == Gst.State.PLAYING:
+            self.player.on_play(None)
+        elif state == Gst.State.PAUSED:
+            self.player.on_pause(None)
+        elif state == Gst.State.READY:
+            self.player.on_stop(None)
+        else:
+            self.pipeline.set_state(state)
+
+    def pump(self):
+        while self.gtk.events_pending():
+            self.gtk.main_iteration_do(False)
+
+    def close(self):
+        self.player.cleanup()
+        self.pump()
+
+
+TARGETS = {
+    "playbin": playbin_driver,
+    "tutorial-3": tutorial_3_driver,
+    "tutorial-4": tutorial_4_driver,
+    "tutorial-5": Tutorial5Driver,
+}
+
+
+# number of live GstObjects and GstMiniObjects according to the leaks
+# tracer, or of GObjects known to Python if the tracer is not active
+def count_live_objects():
+    for tracer in Gst.tracing_get_active_tracers():
+        if GObject.type_name(tracer.__gtype__) == "GstLeaksTracer":
+            objects = tracer.emit("get-live-objects").get_value("objects")
+            return len(getattr(objects, "array", objects))
+
+    return sum(1 for o in gc.get_objects() if isinstance(o, GObject.Object))
+
+
+def sample(cycle):
+    return {
+        "cycle": cycle,
+        "rss": get_rss(),
+        "fds": get_fd_count(),
+        "threads": get_thread_count(),
+        "objects": count_live_objects(),
+    }
+
+
+class Soak(object):
+
+    def __init__(self, driver, uris, seed=0):
+        self.driver = driver
+        self.uris = uris
+        self.random = random.Random(seed)
+        self.state = Gst.State.NULL
+        self.uri_index = 0
+        self.actions = {"state": 0, "seek": 0, "uri": 0}
+        self.stuck = 0
+
+    def wait(self):
+        # wait for the state change to finish, processing messages meanwhile
+        ret, state, pending = self.driver.pipeline.get_state(5 * Gst.SECOND)
+        if ret == Gst.StateChangeReturn.ASYNC:
+            self.stuck += 1
+        self.driver.pump()
+
+    def set_state(self, state):
+        self.driver.set_state(state)
+        self.state = state
+        self.wait()
+
+    def step(self):
+        action = self.random.choice(("state", "state", "seek", "uri"))
+        if action == "seek" and self.state < Gst.State.PAUSED:
+            action = "state"
+
+        self.actions[action] += 1
+        if action == "state":
+            self.set_state(self.random.choice(STATES))
+        elif action == "seek":
+            ok, duration = self.driver.pipeline.query_duration(Gst.Format.TIME)
+            if ok and duration > 0:
+                self.driver.pipeline.seek_simple(
+                    Gst.Format.TIME,
+                    Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
+                    self.random.randrange(duration))
+                self.wait()
+        else:
+            # a new URI only takes effect from READY
+            previous = self.state
+            self.set_state(Gst.State.READY)
+            self.uri_index = (self.uri_index + 1) % len(self.uris)
+            self.driver.set_uri(self.uris[self.uri_index])
+            self.set_state(previous)
+
+    def run(self, cycles, sample_every):
+        self.driver.set_uri(self.uris[0])
+        samples = [sample(0)]
+        for cycle in range(1, cycles + 1):
+            self.step()
+            if cycle % sample_every == 0:
+                samples.append(sample(cycle))
+                last = samples[-1]
+                print("cycle {0:6d}: rss {1:7.1f} MiB  fds {2:4d}  threads {3:3d}  objects {4:6d}".format(
+                    cycle, last["rss"] / 1048576.0, last["fds"],
+                    last["threads"], last["objects"]))
+
+        self.set_state(Gst.State.NULL)
+        return samples
+
+
+# growth of every metric between the start (after warm-up) and the end of
+# the run, averaged over a few samples on each side to smooth out noise
+def growth(samples, warmup=0.1, window=3):
+    samples = samples[int(len(samples) * warmup):]
+    window = max(1, min(window, len(samples) // 2))
+    result = {}
+    for name, option, limit, scale in METRICS:
+        start = sum(s[name] for s in samples[:window]) / window
+        end = sum(s[name] for s in samples[-window:]) / window
+        result[name] = (end - start) / scale
+    return result
+
+
+def write_csv(path, samples):
+    keys = ["cycle"] + [m[0] for m in METRICS]
+    with open(path, "w") as f:
+        f.write(",".join(keys) + "\n")
+        for s in samples:
+            f.write(",".join(str(s[k]) for k in keys) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test a tutorial player")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="playbin")
+    parser.add_argument("--cycles", type=int, default=2000)
+    parser.add_argument("--sample-every", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", help="write the samples to this file")
+    for name, option, limit, scale in METRICS:
+        parser.add_argument("--" + option.replace("_", "-"), type=float,
+                            default=limit,
+                            help="allowed growth of {0} (default {1})".format(
+                                name, limit))
+    parser.add_argument("media", nargs="*")
+    args = parser.parse_args()
+
+    # must be set before GStreamer is initialized
+    os.environ.setdefault("GST_TRACERS", "leaks")
+    Gst.init(None)
+
+    if args.media:
+        uris = [m if "://" in m else Gst.filename_to_uri(os.path.abspath(m))
+                for m in args.media]
+    else:
+        directory = tempfile.mkdtemp(prefix="gst-soak-")
+        uris = [make_test_media(os.path.join(directory, "{0}.webm".format(i)), i)
+                for i in range(2)]
+
+    driver = TARGETS[args.target]()
+    soak = Soak(driver, uris, args.seed)
+    samples = soak.run(args.cycles, args.sample_every)
+    driver.close()
+
+    if args.csv:
+        write_csv(args.csv, samples)
+
+    print("actions: {0}, stuck state changes: {1}, errors: {2}".format(
+        ", ".join("{0}={1}".format(k, v) for k, v in sorted(soak.actions.items())),
+        soak.stuck, driver.errors))
+
+    failed = False
+    result = growth(samples)
+    for name, option, limit, scale in METRICS:
+        limit = getattr(args, option)
+        ok = result[name] <= limit
+        failed = failed or not ok
+        print("{0:8s} growth {1:+10.1f} (limit {2}) {3}".format(
+            name, result[name], limit, "ok" if ok else "FAILED"))
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# runs the streaming threads of many pipelines on one shared, bounded pool of
+# threads instead of the default pool, which starts a thread for every task
+# that needs one.
+#
+# every element that needs a streaming thread (sources, queues, ...) creates
+# a GstTask and posts a STREAM_STATUS message of type CREATE before the task
+# is started. the message is handled from a bus sync handler, on the thread
+# that creates the task, which is the only place where the task's pool can
+# still be replaced.
+#
+# CAVEAT: a streaming task keeps its thread until the element stops, it does
+# not hand it back between buffers. a pool smaller than the number of tasks
+# that run at the same time does not make them take turns, the tasks that do
+# not get a thread simply never start and their pipelines stall. what the
+# shared pool buys is a hard cap on the threads of the process and reusing
+# threads when pipelines are started and stopped; size it for the tasks that
+# run at the same time.
+#
+#   ./taskpool.py --pipelines 200 --pool-size 1000
+#
+# reports the peak number of threads, the time tasks waited for a thread
+# (from CREATE until the task ENTERs its thread) and the throughput, with
+# the default pool and with the shared one.
+
+import argparse
+import sys
+import threading
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from helper import get_thread_count, percentile
+
+# the pipeline of basic tutorial 7 without output: a tee with two queued
+# branches, three streaming threads
+BENCH_PIPELINE = (
+    "audiotestsrc num-buffers={0} samplesperbuffer=441 ! tee name=t "
+    "t. ! queue ! audioconvert ! fakesink "
+    "t. ! queue ! wavescope ! videoconvert ! fakesink")
+
+
+# a pool of at most size threads shared by all tasks it is assigned to.
+# GstSharedTaskPool is new in 1.20, before that the pool is not bounded
+def make_pool(size):
+    if hasattr(Gst, "SharedTaskPool"):
+        pool = Gst.SharedTaskPool.new()
+        pool.set_max_threads(size)
+    else:
+        pool = Gst.TaskPool.new()
+    pool.prepare()
+    return pool
+
+
+class TaskPoolAssigner(object):
+
+    def __init__(self, pool=None):
+        # None leaves the default pool in place, only the statistics are
+        # collected
+        self.pool = pool
+        self.lock = threading.Lock()
+        # task (by address): time of CREATE
+        self.created = {}
+        # seconds from CREATE to ENTER of every task
+        self.waits = []
+        self.tasks = 0
+
+    # call from a bus sync handler for every message
+    def handle_sync_message(self, bus, msg):
+        if msg.type != Gst.MessageType.STREAM_STATUS:
+            return Gst.BusSyncReply.PASS
+
+        status, owner = msg.parse_stream_status()
+        task = msg.get_stream_status_object()
+        if not isinstance(task, Gst.Task):
+            return Gst.BusSyncReply.PASS
+
+        now = time.perf_counter()
+        key = hash(task)
+        if status == Gst.StreamStatusType.CREATE:
+            if self.pool:
+                task.set_pool(self.pool)
+            with self.lock:
+                self.created[key] = now
+                self.tasks += 1
+        elif status == Gst.StreamStatusType.ENTER:
+            with self.lock:
+                start = self.created.pop(key, None)
+                if start is not None:
+                    self.waits.append(now - start)
+        return Gst.BusSyncReply.PASS
+
+    # a bus has only one sync handler. to combine this with a
+    # busfilter.BusFilter, pass handle_sync_message in its handlers instead
+    def install(self, pipeline):
+        pipeline.get_bus().set_sync_handler(self.handle_sync_message)
+
+    def stats(self):
+        with self.lock:
+            waits = list(self.waits)
+            return {
+                "tasks": self.tasks,
+                # created but never started, starved by a too small pool
+                "waiting": len(self.created),
+                "wait-p50": percentile(waits, 50),
+                "wait-p99": percentile(waits, 99),
+                "wait-max": max(waits) if waits else None,
+            }
+
+
+# builds pipelines whose streaming threads come from one pool: make() from a
+# description, adopt() for pipelines built element by element (the tutorial
+# 7 variants with --pool-size). adopt before the pipeline leaves NULL, the
+# tasks are created on the way to PAUSED
+class PipelineFactory(object):
+
+    def __init__(self, pool=None):
+        self.assigner = TaskPoolAssigner(pool)
+
+    def make(self, description):
+        pipeline = Gst.parse_launch(description)
+        self.assigner.install(pipeline)
+        return pipeline
+
+    def adopt(self, pipeline):
+        self.assigner.install(pipeline)
+        return pipeline
+
+    def summary(self):
+        stats = self.assigner.stats()
+        text = "{0} streaming tasks".format(stats["tasks"])
+        if self.assigner.pool:
+            text += " on a shared pool"
+        if stats["wait-max"] is not None:
+            text += ", waited up to {0:.3f} ms for a thread".format(
+                stats["wait-max"] * 1e3)
+        if stats["waiting"]:
+            text += ", {0} never got one".format(stats["waiting"])
+        return text
+
+
+# runs n pipelines to EOS at the same time, sampling the thread count
+def bench(factory, n, buffers, timeout):
+    pipelines = [factory.make(BENCH_PIPELINE.format(buffers)) for i in range(n)]
+    threads_before = get_thread_count()
+    peak = threads_before
+
+    start = time.monotonic()
+    for pipeline in pipelines:
+        pipeline.set_state(Gst.State.PLAYING)
+
+    pending = list(pipelines)
+    errors = 0
+    while pending and time.monotonic() - start < timeout:
+        peak = max(peak, get_thread_count())
+        still = []
+        for pipeline in pending:
+            msg = pipeline.get_bus().pop_filtered(
+                Gst.MessageType.ERROR | Gst.MessageType.EOS)
+            if not msg:
+                still.append(pipeline)
+            elif msg.type == Gst.MessageType.ERROR:
+                errors += 1
+        pending = still
+        time.sleep(0.01)
+    elapsed = time.monotonic() - start
+
+    for pipeline in pipelines:
+        pipeline.set_state(Gst.State.NULL)
+
+    done = n - len(pending) - errors
+    result = factory.assigner.stats()
+    result.update({
+        "pipelines": n,
+        "done": done,
+        "stalled": len(pending),
+        "errors": errors,
+        "threads": peak - threads_before,
+        "elapsed": elapsed,
+        "buffers-per-second": done * buffers / elapsed if elapsed else 0,
+    })
+    return result
+
+
+def print_result(name, r):
+    print("{0}: {1}/{2} pipelines done in {3:.2f}s, {4:.0f} buffers/s".format(
+        name, r["done"], r["pipelines"], r["elapsed"], r["buffers-per-second"]))
+    print("    {0} tasks, {1} extra threads at peak".format(
+        r["tasks"], r["threads"]))
+    if r["wait-p50"] is not None:
+        print("    wait for a thread: p50 {0:.3f} ms, p99 {1:.3f} ms, max {2:.3f} ms".format(
+            r["wait-p50"] * 1e3, r["wait-p99"] * 1e3, r["wait-max"] * 1e3))
+    if r["stalled"]:
+        print("    {0} pipelines stalled, {1} tasks never got a thread".format(
+            r["stalled"], r["waiting"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the default and a shared streaming thread pool")
+    parser.add_argument("--pipelines", type=int, default=50)
+    parser.add_argument("--pool-size", type=int, default=200)
+    parser.add_argument("--buffers", type=int, default=500,
+                        help="buffers every pipeline processes")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    Gst.init(None)
+
+    print_result("default pool", bench(
+        PipelineFactory(), args.pipelines, args.buffers, args.timeout))
+    print_result("shared pool of {0}".format(args.pool_size), bench(
+        PipelineFactory(make_pool(args.pool_size)), args.pipelines,
+        args.buffers, args.timeout))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+# runs any of the tutorials with GStreamer's tracers enabled, then parses the
+# tracer output into columnar records and per-element summaries
+#
+#   ./tracers.py run --duration 10 -- ./basic-tutorial-7.py
+#   ./tracers.py report gst-tracers.log --json report.json
+#
+# https://gstreamer.freedesktop.org/documentation/additional/design/tracing.html
+
+import argparse
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+
+from helper import format_ns, percentile
+
+# tracers enabled by default. proctime and queuelevel come from GstShark and
+# are silently skipped by GStreamer if they are not installed
+DEFAULT_TRACERS = "latency(flags=pipeline+element);rusage;stats;proctime;queuelevel"
+
+# percentiles reported for every timing distribution
+PERCENTILES = (50, 90, 99)
+
+# "0:00:01.234567890  1234 0x55d0c0 TRACE  GST_TRACER :0:: latency, ..."
+LINE_RE = re.compile(
+    r"^\s*(?P<ts>\d+:\d{2}:\d{2}\.\d+)\s.*?GST_TRACER\s+\S*?::\s*(?P<body>.+?)\s*$")
+
+# "key=(type)value" where value may be a quoted string
+FIELD_RE = re.compile(
+    r'(?P<key>[\w-]+)=\((?P<type>[\w]+)\)(?P<value>"(?:[^"\\]|\\.)*"|[^,;]*)')
+
+CLOCK_TIME_RE = re.compile(r"^(\d+):(\d{2}):(\d{2})\.(\d+)$")
+
+INT_TYPES = ("int", "uint", "gint", "guint", "int64", "uint64", "gint64",
+             "guint64", "long", "ulong", "glong", "gulong")
+FLOAT_TYPES = ("double", "gdouble", "float", "gfloat")
+
+
+# parses a clock time string like "0:00:01.234567890" into nanoseconds
+def parse_clock_time(text):
+    m = CLOCK_TIME_RE.match(text.strip())
+    if not m:
+        return None
+
+    h, mi, s, frac = m.groups()
+    ns = int((frac + "000000000")[:9])
+    return ((int(h) * 60 + int(mi)) * 60 + int(s)) * 1000000000 + ns
+
+
+def parse_value(type_name, value):
+    if value.startswith('"'):
+        value = value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+
+    if type_name in INT_TYPES:
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    elif type_name in FLOAT_TYPES:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    elif type_name in ("boolean", "gboolean"):
+        return value.lower() in ("1", "true", "yes", "t")
+    elif type_name == "string":
+        # GstShark reports times as clock time strings
+        ns = parse_clock_time(value)
+        return ns if ns is not None else value
+
+    return value
+
+
+# parses a serialized GstStructure ("name, key=(type)value, ...;") into its
+# name and a dictionary of fields
+def parse_structure(body):
+    name, _, rest = body.partition(",")
+    fields = {}
+    for m in FIELD_RE.finditer(rest):
+        fields[m.group("key")] = parse_value(m.group("type"), m.group("value"))
+
+    return name.strip().rstrip(";"), fields
+
+
+# column-oriented store: one table per record name, one list per column.
+# rows missing a column get None so all columns of a table stay aligned
+class Records(object):
+
+    def __init__(self):
+        self.tables = {}
+
+    def add(self, name, fields):
+        table = self.tables.setdefault(name, {})
+        rows = len(next(iter(table.values()))) if table else 0
+        for key in fields:
+            if key not in table:
+                table[key] = [None] * rows
+
+        for key, column in table.items():
+            column.append(fields.get(key))
+
+    def column(self, name, key):
+        table = self.tables.get(name, {})
+        return table.get(key, [None] * self.count(name))
+
+    def count(self, name):
+        table = self.tables.get(name)
+        if not table:
+            return 0
+        return len(next(iter(table.values())))
+
+    # iterates over the rows of a table as dictionaries
+    def rows(self, name):
+        table = self.tables.get(name, {})
+        keys = list(table.keys())
+        for i in range(self.count(name)):
+            yield dict((k, table[k][i]) for k in keys)
+
+
+def parse_log(lines):
+    records = Records()
+    for line in lines:
+        m = LINE_RE.match(line)
+        if not m:
+            continue
+
+        name, fields = parse_structure(m.group("body"))
+        # keep the log timestamp, GstShark records do not carry their own
+        fields["log-ts"] = parse_clock_time(m.group("ts"))
+        records.add(name, fields)
+
+    return records
+
+
+def distribution(values):
+    values = [v for v in values if v is not None]
+    summary = {"count": len(values)}
+    if values:
+        for p in PERCENTILES:
+            summary["p{0}".format(p)] = percentile(values, p)
+        summary["max"] = max(values)
+        summary["mean"] = sum(values) // len(values)
+
+    return summary
+
+
+def summarize_proctime(records):
+    per_element = {}
+    for row in records.rows("proctime"):
+        per_element.setdefault(row.get("element"), []).append(row.get("time"))
+
+    return dict((k, distribution(v)) for k, v in per_element.items())
+
+
+def summarize_latency(records):
+    per_path = {}
+    for row in records.rows("latency"):
+        path = "{0}.{1} -> {2}.{3}".format(
+            row.get("src-element"), row.get("src"),
+            row.get("sink-element"), row.get("sink"))
+        per_path.setdefault(path, []).append(row.get("time"))
+
+    per_element = {}
+    for row in records.rows("element-latency"):
+        per_element.setdefault(row.get("element"), []).append(row.get("time"))
+
+    return {
+        "pipeline": dict((k, distribution(v)) for k, v in per_path.items()),
+        "element": dict((k, distribution(v)) for k, v in per_element.items()),
+    }
+
+
+# the stats tracer tells us which elements push buffers on which thread, so
+# the per-thread cpu time of the rusage tracer can be attributed to elements
+def summarize_stats(records):
+    elements = {}
+    for row in records.rows("new-element"):
+        elements[row.get("ix")] = row.get("name")
+
+    per_element = {}
+    threads = {}
+    for row in records.rows("buffer"):
+        name = elements.get(row.get("element-ix"), row.get("element-ix"))
+        entry = per_element.setdefault(name, {"buffers": 0, "bytes": 0})
+        entry["buffers"] += 1
+        entry["bytes"] += row.get("buffer-size") or 0
+        threads.setdefault(row.get("thread-id"), set()).add(name)
+
+    return per_element, threads
+
+
+def summarize_rusage(records, thread_elements):
+    # the last record of every thread carries its accumulated cpu time
+    per_thread = {}
+    for row in records.rows("thread-rusage"):
+        per_thread[row.get("thread-id")] = row
+
+    total = sum(r.get("time") or 0 for r in per_thread.values())
+    threads = {}
+    per_element = {}
+    for tid, row in per_thread.items():
+        share = (row.get("time") or 0) / total if total else 0.0
+        names = sorted(str(n) for n in thread_elements.get(tid, ()))
+        threads[str(tid)] = {
+            "cpu-time": row.get("time"),
+            "cpu-share": share,
+            "average-cpuload": row.get("average-cpuload"),
+            "elements": names,
+        }
+        # a thread runs every element it pushes through, split its share
+        # evenly as we cannot do better from the tracer data
+        for name in names:
+            per_element[name] = per_element.get(name, 0.0) + share / len(names)
+
+    process = None
+    if records.count("proc-rusage"):
+        last = list(records.rows("proc-rusage"))[-1]
+        process = {
+            "cpu-time": last.get("time"),
+            "average-cpuload": last.get("average-cpuload"),
+        }
+
+    return {"process": process, "thread": threads, "element": per_element}
+
+
+def summarize_queuelevel(records):
+    per_queue = {}
+    for row in records.rows("queuelevel"):
+        name = row.get("queue") or row.get("element")
+        per_queue.setdefault(name, []).append({
+            "ts": row.get("log-ts"),
+            "buffers": row.get("size_buffers", row.get("size-buffers")),
+            "bytes": row.get("size_bytes", row.get("size-bytes")),
+            "time": row.get("size_time", row.get("size-time")),
+        })
+
+    summary = {}
+    for name, samples in per_queue.items():
+        summary[name] = {
+            "buffers": distribution([s["buffers"] for s in samples]),
+            "samples": samples,
+        }
+
+    return summary
+
+
+def build_report(records):
+    stats, thread_elements = summarize_stats(records)
+    return {
+        "records": dict((k, records.count(k)) for k in records.tables),
+        "proctime": summarize_proctime(records),
+        "latency": summarize_latency(records),
+        "cpu": summarize_rusage(records, thread_elements),
+        "queuelevel": summarize_queuelevel(records),
+        "buffers": stats,
+    }
+
+
+def format_distribution(name, dist):
+    if not dist.get("count"):
+        return "  {0:40s} (no samples)".format(name)
+
+    return "  {0:40s} n={1:<7d} {2}  max={3}".format(
+        name, dist["count"],
+        "  ".join("p{0}={1}".format(p, format_ns(dist["p{0}".format(p)]))
+                  for p in PERCENTILES),
+        format_ns(dist["max"]))
+
+
+def print_report(report):
+    print("Records:", ", ".join(
+        "{0}={1}".format(k, v) for k, v in sorted(report["records"].items())))
+
+    if report["proctime"]:
+        print("\nProcessing time per element:")
+        for name, dist in sorted(report["proctime"].items(),
+                                 key=lambda i: -i[1].get("p50", 0)):
+            print(format_distribution(name, dist))
+
+    if report["latency"]["pipeline"]:
+        print("\nEnd-to-end latency (source -> sink):")
+        for name, dist in sorted(report["latency"]["pipeline"].items()):
+            print(format_distribution(name, dist))
+
+    if report["latency"]["element"]:
+        print("\nLatency per element:")
+        for name, dist in sorted(report["latency"]["element"].items(),
+                                 key=lambda i: -i[1].get("p50", 0)):
+            print(format_distribution(name, dist))
+
+    cpu = report["cpu"]
+    if cpu["element"]:
+        print("\nCPU share per element:")
+        for name, share in sorted(cpu["element"].items(), key=lambda i: -i[1]):
+            print("  {0:40s} {1:6.1%}".format(name, share))
+    if cpu["process"]:
+        print("\nProcess CPU load: {0}‰ ({1} cpu time)".format(
+            cpu["process"]["average-cpuload"],
+            format_ns(cpu["process"]["cpu-time"] or 0)))
+
+    if report["queuelevel"]:
+        print("\nQueue levels (buffers):")
+        for name, entry in sorted(report["queuelevel"].items()):
+            dist = entry["buffers"]
+            if not dist.get("count"):
+                continue
+            print("  {0:40s} n={1:<7d} p50={2} p90={3} max={4}".format(
+                name, dist["count"], dist["p50"], dist["p90"], dist["max"]))
+
+    if report["buffers"]:
+        print("\nBuffers pushed per element:")
+        for name, entry in sorted(report["buffers"].items(),
+                                  key=lambda i: -i[1]["buffers"]):
+            print("  {0:40s} {1:8d} buffers {2:12d} bytes".format(
+                str(name), entry["buffers"], entry["bytes"]))
+
+
+# runs the given command with the tracers enabled and their output sent to
+# log_path. returns the exit code of the command
+def run_traced(command, log_path, tracers=DEFAULT_TRACERS, duration=None):
+    env = dict(os.environ)
+    env["GST_TRACERS"] = tracers
+    env["GST_DEBUG"] = ",".join(
+        d for d in (env.get("GST_DEBUG"), "GST_TRACER:7") if d)
+    env["GST_DEBUG_FILE"] = log_path
+    env["GST_DEBUG_NO_COLOR"] = "1"
+
+    proc = subprocess.Popen(command, env=env)
+    try:
+        proc.wait(timeout=duration)
+    except subprocess.TimeoutExpired:
+        # the tutorials treat Ctrl-C as a request to shut down cleanly
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    except KeyboardInterrupt:
+        proc.wait()
+
+    return proc.returncode
+
+
+def report_file(log_path, json_path=None):
+    with open(log_path, errors="replace") as f:
+        records = parse_log(f)
+
+    report = build_report(records)
+    print_report(report)
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        print("\nJSON report written to", json_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Profile tutorial pipelines with GStreamer tracers")
+    sub = parser.add_subparsers(dest="command")
+
+    run = sub.add_parser("run", help="run a command with tracers enabled")
+    run.add_argument("--tracers", default=DEFAULT_TRACERS)
+    run.add_argument("--log", default="gst-tracers.log")
+    run.add_argument("--json", help="write the report as JSON to this file")
+    run.add_argument("--duration", type=float,
+                     help="stop the command after this many seconds")
+    run.add_argument("cmd", nargs=argparse.REMAINDER)
+
+    report = sub.add_parser("report", help="report on an existing tracer log")
+    report.add_argument("log")
+    report.add_argument("--json", help="write the report as JSON to this file")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        # only the separator in front of the command, the command may have
+        # its own
+        cmd = list(args.cmd)
+        if cmd and cmd[0] == "--":
+            del cmd[0]
+        if not cmd:
+            parser.error("no command given")
+        if cmd[0].endswith(".py"):
+            cmd.insert(0, sys.executable)
+
+        ret = run_traced(cmd, args.log, args.tracers, args.duration)
+        if ret:
+            print("WARNING: command exited with code", ret)
+        report_file(args.log, args.json)
+    elif args.command == "report":
+        report_file(args.log, args.json)
+    else:
+        parser.print_help()
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+# batch transcoding with the dynamic pipeline of basic tutorial 3: uridecodebin
+# hands out raw audio and video pads, and for every pad a converter and
+# encoder branch is created and linked to a muxer writing to a file.
+#
+# the scheduler runs every transcode in its own process, a bounded number per
+# core, highest priority first, with per-job timeouts and retries.
+#
+# usage: transcode.py [--per-core N] [--timeout SECONDS] [--retries N]
+#                     [--profile NAME] OUTDIR URI[@PRIO] [URI[@PRIO]...]
+#
+# a URI can be given a priority with a trailing @PRIO, the default is 0.
+#
+# http://docs.gstreamer.com/display/GstSDK/Basic+tutorial+3%3A+Dynamic+pipelines
+
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import os
+import sys
+import time
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from helper import connect
+
+# encoders use a single thread: parallelism comes from running several jobs
+PROFILES = {
+    "webm": {
+        "video": "videoconvert ! vp8enc deadline=1 cpu-used=8 threads=1",
+        "audio": "audioconvert ! audioresample ! vorbisenc",
+        "muxer": "webmmux",
+        "extension": "webm",
+    },
+    "mkv": {
+        "video": "videoconvert ! x264enc speed-preset=veryfast threads=1 ! h264parse",
+        "audio": "audioconvert ! audioresample ! opusenc",
+        "muxer": "matroskamux",
+        "extension": "mkv",
+    },
+}
+
+
+class Transcoder(object):
+
+    def __init__(self, uri, output, profile="webm"):
+        self.profile = PROFILES[profile]
+        self.branches = []
+
+        # create the elements
+        self.source = Gst.ElementFactory.make("uridecodebin", "source")
+        self.muxer = Gst.ElementFactory.make(self.profile["muxer"], "muxer")
+        self.sink = Gst.ElementFactory.make("filesink", "sink")
+
+        # create empty pipeline
+        self.pipeline = Gst.Pipeline.new("transcode-pipeline")
+
+        if not self.pipeline or not self.source or not self.muxer or not self.sink:
+            raise RuntimeError("Could not create all elements")
+
+        # the encoding branches are created and linked from pad-added
+        self.pipeline.add(self.source, self.muxer, self.sink)
+        if not self.muxer.link(self.sink):
+            raise RuntimeError("Could not link 'muxer' to 'sink'")
+
+        self.source.set_property("uri", uri)
+        self.sink.set_property("location", output)
+        connect(self.source, "pad-added", self.on_pad_added)
+
+    # handler for the pad-added signal, called from a streaming thread
+    def on_pad_added(self, src, new_pad):
+        new_pad_type = new_pad.get_current_caps().get_structure(0).get_name()
+
+        if new_pad_type.startswith("audio/x-raw"):
+            description = self.profile["audio"]
+        elif new_pad_type.startswith("video/x-raw"):
+            description = self.profile["video"]
+        else:
+            return
+
+        # converter and encoder, with ghost pads on both ends. the queue
+        # decouples the encoder from the other streams feeding the muxer
+        branch = Gst.parse_bin_from_description(
+            description + " ! queue", True)
+        self.pipeline.add(branch)
+
+        # link() requests a compatible pad from the muxer
+        if (new_pad.link(branch.get_static_pad("sink")) != Gst.PadLinkReturn.OK
+                or not branch.link(self.muxer)):
+            self.pipeline.post_message(Gst.Message.new_error(
+                self.pipeline,
+                GLib.Error.new_literal(Gst.core_error_quark(),
+                                       "Could not link the encoding branch",
+                                       int(Gst.CoreError.NEGOTIATION)),
+                new_pad_type))
+            return
+
+        branch.sync_state_with_parent()
+        self.branches.append(branch)
+
+    # runs the transcode to the end and returns a result dictionary
+    def run(self):
+        start = time.monotonic()
+        result = {"ok": False, "error": None, "media-duration": 0}
+
+        ret = self.pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            result["error"] = "Unable to set the pipeline to the playing state"
+            self.pipeline.set_state(Gst.State.NULL)
+            return result
+
+        bus = self.pipeline.get_bus()
+        while True:
+            msg = bus.timed_pop_filtered(
+                Gst.CLOCK_TIME_NONE, Gst.MessageType.ERROR | Gst.MessageType.EOS)
+            if not msg:
+                continue
+
+            if msg.type == Gst.MessageType.ERROR:
+                err, dbg = msg.parse_error()
+                result["error"] = "{0}: {1}".format(msg.src.get_name(), err.message)
+            else:
+                result["ok"] = True
+            break
+
+        ok, duration = self.pipeline.query_duration(Gst.Format.TIME)
+        if ok:
+            result["media-duration"] = duration / Gst.SECOND
+        self.pipeline.set_state(Gst.State.NULL)
+
+        result["wall-time"] = time.monotonic() - start
+        return result
+
+
+# entry point of the worker processes
+def work(conn, uri, output, profile):
+    Gst.init(None)
+    try:
+        result = Transcoder(uri, output, profile).run()
+    except Exception as e:
+        result = {"ok": False, "error": str(e), "media-duration": 0}
+    conn.send(result)
+    conn.close()
+
+
+class Job(object):
+
+    def __init__(self, uri, output, profile, priority, timeout, retries):
+        self.uri = uri
+        self.output = output
+        self.profile = profile
+        self.priority = priority
+        self.timeout = timeout
+        self.retries = retries
+        self.attempts = 0
+        self.status = "pending"
+        self.error = None
+        self.media_duration = 0
+        self.wall_time = 0
+
+    def realtime_factor(self):
+        return self.media_duration / self.wall_time if self.wall_time else 0
+
+
+class Scheduler(object):
+
+    def __init__(self, per_core=1, workers=None):
+        self.workers = workers or max(1, per_core * (os.cpu_count() or 1))
+        self.jobs = []
+        self.pending = []
+        self.seq = itertools.count()
+        # GStreamer does not survive fork() well, start workers from scratch
+        self.context = multiprocessing.get_context("spawn")
+
+    # queue a job. jobs with a higher priority start first
+    def submit(self, uri, output, profile="webm", priority=0, timeout=None,
+               retries=0):
+        job = Job(uri, output, profile, priority, timeout, retries)
+        self.jobs.append(job)
+        self.push(job)
+        return job
+
+    def push(self, job):
+        job.status = "pending"
+        heapq.heappush(self.pending, (-job.priority, next(self.seq), job))
+
+    def start(self, job):
+        reader, writer = self.context.Pipe(duplex=False)
+        proc = self.context.Process(
+            target=work, args=(writer, job.uri, job.output, job.profile))
+        proc.start()
+        writer.close()
+
+        job.attempts += 1
+        job.status = "running"
+        return {"proc": proc, "conn": reader, "start": time.monotonic()}
+
+    def finish(self, job, run, result):
+        run["proc"].join()
+        run["conn"].close()
+        job.wall_time = time.monotonic() - run["start"]
+
+        if result and result["ok"]:
+            job.status = "done"
+            job.error = None
+            job.media_duration = result["media-duration"]
+            return
+
+        job.error = result["error"] if result else "worker died"
+        if job.attempts <= job.retries:
+            print("Retrying {0} ({1})".format(job.uri, job.error))
+            self.push(job)
+        else:
+            job.status = "failed"
+
+    # runs all queued jobs and returns the elapsed wall time
+    def run(self):
+        start = time.monotonic()
+        running = {}
+
+        while self.pending or running:
+            while self.pending and len(running) < self.workers:
+                job = heapq.heappop(self.pending)[2]
+                running[job] = self.start(job)
+
+            waitables = [r["conn"] for r in running.values()]
+            waitables += [r["proc"].sentinel for r in running.values()]
+            multiprocessing.connection.wait(waitables, timeout=0.5)
+
+            now = time.monotonic()
+            for job, run in list(running.items()):
+                if run["conn"].poll():
+                    try:
+                        result = run["conn"].recv()
+                    except EOFError:
+                        result = None
+                elif not run["proc"].is_alive():
+                    result = None
+                elif job.timeout and now - run["start"] > job.timeout:
+                    run["proc"].kill()
+                    result = {"ok": False, "error": "timed out after {0}s".format(
+                        job.timeout)}
+                else:
+                    continue
+
+                del running[job]
+                self.finish(job, run, result)
+
+        return time.monotonic() - start
+
+    def print_summary(self, elapsed):
+        print("{0:8s} {1:>8s} {2:>9s} {3:>8s} {4:>8s}  {5}".format(
+            "status", "attempts", "media (s)", "wall (s)", "x rt", "uri"))
+        for job in self.jobs:
+            print("{0:8s} {1:8d} {2:9.1f} {3:8.1f} {4:8.2f}  {5}".format(
+                job.status, job.attempts, job.media_duration, job.wall_time,
+                job.realtime_factor(), job.uri))
+            if job.error:
+                print("         error: {0}".format(job.error))
+
+        done = [j for j in self.jobs if j.status == "done"]
+        media = sum(j.media_duration for j in done)
+        print("{0}/{1} jobs done with {2} workers in {3:.1f}s".format(
+            len(done), len(self.jobs), self.workers, elapsed))
+        if elapsed:
+            print("aggregate: {0:.2f}x realtime, {1:.1f} jobs/hour".format(
+                media / elapsed, len(done) * 3600 / elapsed))
+
+
+# splits "URI@PRIO" into the URI and its priority
+def parse_job(arg):
+    uri, sep, priority = arg.rpartition("@")
+    if sep and priority.lstrip("-").isdigit():
+        return uri, int(priority)
+    return arg, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcode media files")
+    parser.add_argument("--per-core", type=int, default=1,
+                        help="concurrent jobs per CPU core")
+    parser.add_argument("--workers", type=int,
+                        help="concurrent jobs, overrides --per-core")
+    parser.add_argument("--timeout", type=float, help="per-job timeout (s)")
+    parser.add_argument("--retries", type=int, default=0)
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="webm")
+    parser.add_argument("outdir")
+    parser.add_argument("uris", nargs="+", metavar="URI[@PRIO]")
+    args = parser.parse_args()
+
+    os.makedirs(args.outdir, exist_ok=True)
+    scheduler = Scheduler(args.per_core, args.workers)
+    outputs = set()
+    for index, arg in enumerate(args.uris):
+        uri, priority = parse_job(arg)
+        if "://" not in uri:
+            uri = Gst.filename_to_uri(os.path.abspath(uri))
+
+        # inputs with the same base name (a/clip.mp4, b/clip.mov) must not
+        # write to the same file
+        name = os.path.splitext(os.path.basename(uri))[0]
+        output = os.path.join(args.outdir, "{0}.{1}".format(
+            name, PROFILES[args.profile]["extension"]))
+        if output in outputs:
+            output = os.path.join(args.outdir, "{0}-{1}.{2}".format(
+                name, index, PROFILES[args.profile]["extension"]))
+        outputs.add(output)
+
+        scheduler.submit(uri, output, args.profile, priority=priority,
+                         timeout=args.timeout, retries=args.retries)
+
+    elapsed = scheduler.run()
+    scheduler.print_summary(elapsed)
+    return 0 if all(j.status == "done" for j in scheduler.jobs) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())